@@ -0,0 +1,457 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: analog_index.py
+# USAGE: from analog_index import AnalogIndex
+#        python analog_index.py <dataset> <mode> [num_neighbours] [-weight]
+# DESCR: Finds the historical days most like a given day. Nearest neighbour
+#        index over the cleaned first day features of a dataset, saved inside
+#        the dataset directory so it is built once. Three modes:
+#            blocked - exact, brute force a block of mapped rows at a time
+#                      against cached row norms
+#            balltree - exact, sklearn BallTree
+#            ivf - approximate, rows bucketed by their nearest of nlist coarse
+#                  centers and stored bucket by bucket, a query only looks in
+#                  its nprobe closest buckets then reranks exactly
+#        Answers come back with the neighbours' meta and next morning candles.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, blocked / balltree / ivf modes saved next
+#                      to the dataset arrays
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+from sklearn.neighbors import BallTree
+from chart_store import load_charts, read_info, DATASET_EXT
+from chunked_kmeans import iter_chunks, fit_minibatch, predict_chunked
+from forecaster import to_day_ohlc, clean_day
+from time import time
+import cPickle as pickle
+import numpy as np
+import json
+import os
+import sys
+
+# CONSTANT SECTION
+RANDOM_STATE = 42
+MODES = ['blocked', 'balltree', 'ivf']
+BLOCK_SIZE = 20000
+LEAF_SIZE = 40
+N_PROBE = 16
+RERANK = 4
+
+# Files written inside the dataset directory, one info json per mode
+INDEX_INFO = 'analog_{}.json'
+NORMS_FILE = 'analog_norms.npy'
+TREE_FILE = 'analog_balltree.pkl'
+IVF_CENTERS = 'analog_ivf_centers.npy'
+IVF_OFFSETS = 'analog_ivf_offsets.npy'
+IVF_IDS = 'analog_ivf_ids.npy'
+IVF_VECTORS = 'analog_ivf_vectors.npy'
+
+
+# FUNCTION SECTION
+def dataset_dir(path):
+    """
+    DESCR: directory of a dataset path given with or without DATASET_EXT,
+           indexes are only kept for datasets, not old pickles
+    """
+    if os.path.isdir(path):
+        return path
+    if os.path.isdir(path + DATASET_EXT):
+        return path + DATASET_EXT
+    raise ValueError("{} is not a dataset directory, make one with "
+                     "clean_stock_stream first".format(path))
+
+
+def default_nlist(n_rows):
+    """
+    DESCR: number of ivf buckets, about 4 * sqrt(n) like faiss suggests
+    """
+    return int(max(1, min(n_rows // 40, 4 * np.sqrt(n_rows))))
+
+
+def row_norms(X, transform=None, block_size=BLOCK_SIZE):
+    """
+    DESCR: squared length of every row, a block at a time
+    INPUT:
+        X - array - (n, n_features), memory mapped is fine
+        transform - function - applied to each block, ie weight_features
+        block_size - int
+    OUTPUT:
+        norms - array - (n,)
+    """
+    norms = np.empty(len(X))
+    for start, chunk in iter_chunks(X, block_size, transform=transform):
+        norms[start:start + len(chunk)] = np.einsum('ij,ij->i', chunk, chunk)
+    return norms
+
+
+def smallest_k(dists, ids, k):
+    """
+    DESCR: k smallest distances of every row, sorted
+    INPUT:
+        dists - array - (m, n) candidate distances
+        ids - array - (m, n) or (n,) row id of each candidate
+        k - int
+    OUTPUT:
+        dists - array - (m, min(k, n))
+        ids - array - (m, min(k, n))
+    """
+    if ids.ndim == 1:
+        ids = np.broadcast_to(ids, dists.shape)
+    k = min(k, dists.shape[1])
+    if k < dists.shape[1]:
+        part = np.argpartition(dists, k - 1, axis=1)[:, :k]
+        dists = np.take_along_axis(dists, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1)
+    order = np.argsort(dists, axis=1, kind='mergesort')
+    return np.take_along_axis(dists, order, axis=1), \
+           np.take_along_axis(ids, order, axis=1)
+
+
+def blocked_search(X, norms, Q, k, transform=None, block_size=BLOCK_SIZE):
+    """
+    DESCR: exact k nearest rows of X for every query, one matrix product per
+           block of X and only the best k of each block kept
+    INPUT:
+        X - array - (n, n_features), memory mapped is fine
+        norms - array - (n,) from row_norms
+        Q - array - (m, n_features) queries, already transformed
+        k - int
+        transform - function - applied to each block of X
+        block_size - int
+    OUTPUT:
+        dists - array - (m, k) squared distances, closest first
+        ids - array - (m, k) rows of X
+    """
+    best_d = np.empty((len(Q), 0))
+    best_i = np.empty((len(Q), 0), dtype=np.int64)
+    for start, chunk in iter_chunks(X, block_size, transform=transform):
+        dists = np.dot(Q, chunk.T)
+        dists *= -2
+        dists += norms[start:start + len(chunk)]
+        dists, ids = smallest_k(dists, np.arange(start, start + len(chunk)), k)
+        best_d, best_i = smallest_k(np.hstack([best_d, dists]),
+                                    np.hstack([best_i, ids]), k)
+    best_d += np.einsum('ij,ij->i', Q, Q)[:, None]
+    return np.maximum(best_d, 0), best_i
+
+
+def build_ivf(X, nlist, transform=None, random_state=RANDOM_STATE):
+    """
+    DESCR: coarse centers by a streamed MiniBatchKMeans, then every row's
+           bucket, rows put in bucket order so a bucket is one slice
+    INPUT:
+        X - array - (n, n_features), memory mapped is fine
+        nlist - int - buckets
+        transform - function - applied to each block of X
+        random_state - int
+    OUTPUT:
+        centers - array - (nlist, n_features)
+        offsets - array - (nlist + 1,) bucket i is rows offsets[i]:offsets[i+1]
+        ids - array - (n,) dataset row of each stored row
+        vectors - array - (n, n_features) float32 rows in bucket order
+    """
+    cluster = fit_minibatch(X, nlist, random_state=random_state,
+                            transform=transform, n_epochs=1)
+    labels, _ = predict_chunked(cluster, X, transform=transform)
+    ids = np.argsort(labels, kind='mergesort')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(labels,
+                                                         minlength=nlist))])
+
+    vectors = np.empty(X.shape, dtype=np.float32)
+    for start in range(0, len(ids), BLOCK_SIZE):
+        chunk = np.asarray(X[ids[start:start + BLOCK_SIZE]])
+        if transform is not None:
+            chunk = transform(chunk)
+        vectors[start:start + len(chunk)] = chunk
+    return cluster.cluster_centers_, offsets, ids, vectors
+
+
+def ivf_search(centers, offsets, ids, vectors, Q, k, n_probe=N_PROBE):
+    """
+    DESCR: approximate k nearest stored rows of every query from its n_probe
+           closest buckets
+    INPUT:
+        centers, offsets, ids, vectors - from build_ivf
+        Q - array - (m, n_features) queries, already transformed
+        k - int
+        n_probe - int - buckets looked in per query
+    OUTPUT:
+        dists - array - (m, k) squared distances, inf past the candidates
+        ids - array - (m, k) dataset rows, -1 past the candidates
+    """
+    n_probe = min(n_probe, len(centers))
+    coarse = np.dot(Q, centers.T)
+    coarse *= -2
+    coarse += (centers ** 2).sum(axis=1)
+    probes = np.argpartition(coarse, n_probe - 1, axis=1)[:, :n_probe]
+
+    best_d = np.full((len(Q), k), np.inf)
+    best_i = np.full((len(Q), k), -1, dtype=np.int64)
+    for row, query in enumerate(Q):
+        slices = [np.arange(offsets[b], offsets[b + 1]) for b in probes[row]]
+        stored = np.concatenate(slices)
+        if not len(stored):
+            continue
+        diff = vectors[stored] - query.astype(np.float32)
+        dists = np.einsum('ij,ij->i', diff, diff)[None]
+        dists, found = smallest_k(dists, ids[stored], k)
+        best_d[row, :dists.shape[1]] = dists[0]
+        best_i[row, :dists.shape[1]] = found[0]
+    return best_d, best_i
+
+
+# CLASS SECTION
+class AnalogIndex(object):
+    """
+    DESCR: nearest neighbour index over one dataset's first days, built with
+           build and opened again with open
+    """
+
+    def __init__(self, path, mode, weight=False, **params):
+        """
+        DESCR: initialize around a dataset directory, see build and open
+        INPUT:
+            path - str - dataset directory
+            mode - str - one of MODES
+            weight - bool - features weighted like cluster_attempt -weight
+            params - extra numbers of the mode, ie nlist
+        OUTPUT: None
+        """
+        if mode not in MODES:
+            raise ValueError("mode should be one of {}, got {}".format(MODES,
+                                                                      mode))
+        self.path = dataset_dir(path)
+        self.mode = mode
+        self.weight = weight
+        self.params = params
+        self.store = load_charts(self.path)
+        self.flags = read_info(self.path)['flags']
+        self.X, _ = self.store.day_split()
+
+        self.transform = None
+        if weight:
+            from cluster_attempt import weight_features
+            self.transform = weight_features
+
+    def __str__(self):
+        """
+        DESCR: Pretty representation of index
+        """
+        return "AnalogIndex: {} over {} charts, weighted {}".format(
+               self.mode, self.store.n_charts, self.weight)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @classmethod
+    def build(cls, path, mode='blocked', weight=False, nlist=None,
+              leaf_size=LEAF_SIZE, random_state=RANDOM_STATE):
+        """
+        DESCR: build an index and save it inside the dataset directory
+        INPUT:
+            path - str - dataset directory
+            mode - str - one of MODES
+            weight - bool - weight features like cluster_attempt -weight
+            nlist - int - ivf buckets, default about 4 * sqrt(n)
+            leaf_size - int - balltree leaf size
+            random_state - int - ivf coarse centers
+        OUTPUT:
+            index - AnalogIndex - ready to query
+        """
+        index = cls(path, mode, weight)
+        X, transform = index.X, index.transform
+        if mode == 'blocked':
+            np.save(index._file(NORMS_FILE), row_norms(X, transform))
+        elif mode == 'balltree':
+            features = np.asarray(X) if transform is None else transform(X)
+            index.params['leaf_size'] = leaf_size
+            with open(index._file(TREE_FILE), 'wb') as f:
+                pickle.dump(BallTree(features, leaf_size=leaf_size), f,
+                            pickle.HIGHEST_PROTOCOL)
+        else:
+            nlist = nlist or default_nlist(len(X))
+            index.params['nlist'] = nlist
+            centers, offsets, ids, vectors = build_ivf(X, nlist, transform,
+                                                       random_state)
+            np.save(index._file(IVF_CENTERS), centers)
+            np.save(index._file(IVF_OFFSETS), offsets)
+            np.save(index._file(IVF_IDS), ids)
+            np.save(index._file(IVF_VECTORS), vectors)
+
+        info = {'mode': mode, 'weight': weight, 'n_charts': len(X),
+                'params': index.params}
+        with open(index._file(INDEX_INFO.format(mode)), 'w') as f:
+            json.dump(info, f)
+        return cls.open(path, mode)
+
+    @classmethod
+    def open(cls, path, mode='blocked'):
+        """
+        DESCR: open a saved index, big arrays are memory mapped
+        INPUT:
+            path - str - dataset directory
+            mode - str - one of MODES
+        OUTPUT:
+            index - AnalogIndex
+        """
+        info_path = os.path.join(dataset_dir(path), INDEX_INFO.format(mode))
+        with open(info_path, 'r') as f:
+            info = json.load(f)
+        index = cls(path, mode, info['weight'], **info['params'])
+        if info['n_charts'] != index.store.n_charts:
+            raise ValueError("index has {} charts but dataset has {}, build "
+                             "it again".format(info['n_charts'],
+                                               index.store.n_charts))
+
+        if mode == 'blocked':
+            index.norms = np.load(index._file(NORMS_FILE), mmap_mode='r')
+        elif mode == 'balltree':
+            with open(index._file(TREE_FILE), 'rb') as f:
+                index.tree = pickle.load(f)
+        else:
+            index.centers = np.load(index._file(IVF_CENTERS))
+            index.offsets = np.load(index._file(IVF_OFFSETS))
+            index.ids = np.load(index._file(IVF_IDS), mmap_mode='r')
+            index.vectors = np.load(index._file(IVF_VECTORS), mmap_mode='r')
+        return index
+
+    def features(self, charts, raw=True):
+        """
+        DESCR: query days as index features
+        INPUT:
+            charts - array like - days, see forecaster.to_day_ohlc
+            raw - bool - days are raw prices needing the dataset's cleaning,
+                  False when they are already cleaned (ie dataset rows)
+        OUTPUT:
+            Q - array - (m, n_features)
+        """
+        ohlc = to_day_ohlc(charts)
+        if raw:
+            ohlc = clean_day(ohlc, self.flags)
+        Q = ohlc.reshape(len(ohlc), -1)
+        if self.transform is not None:
+            Q = self.transform(Q)
+        return Q
+
+    def search(self, Q, k, n_probe=N_PROBE):
+        """
+        DESCR: k nearest dataset rows of every query feature row
+        INPUT:
+            Q - array - (m, n_features) from features
+            k - int
+            n_probe - int - ivf buckets looked in per query
+        OUTPUT:
+            dists - array - (m, k) euclidean distances, closest first
+            ids - array - (m, k) dataset rows
+        """
+        if self.mode == 'blocked' and self.transform is None:
+            # X is a strided view so np.dot would not use blas on it, the
+            # whole contiguous chart rows times zero padded queries is the
+            # same product at full speed
+            padded = np.zeros((len(Q), self.store.n_candles * 4))
+            padded[:, :Q.shape[1]] = Q
+            dists, ids = blocked_search(self.store.flat(), self.norms, padded,
+                                        k)
+        elif self.mode == 'blocked':
+            dists, ids = blocked_search(self.X, self.norms, Q, k,
+                                        self.transform)
+        elif self.mode == 'balltree':
+            return self.tree.query(Q, k)
+        else:
+            # Float32 bucket search, then exact distances of the best few
+            _, found = ivf_search(self.centers, self.offsets, self.ids,
+                                  self.vectors, Q, RERANK * k, n_probe)
+            dists = np.full(found.shape, np.inf)
+            for row in range(len(Q)):
+                good = found[row] >= 0
+                rows = np.sort(found[row][good])
+                X = np.asarray(self.X[rows])
+                if self.transform is not None:
+                    X = self.transform(X)
+                dists[row, :len(rows)] = ((X - Q[row]) ** 2).sum(axis=1)
+                found[row, :len(rows)] = rows
+            dists, ids = smallest_k(dists, found, k)
+        return np.sqrt(dists), ids
+
+    def query(self, charts, k=50, raw=True, n_probe=N_PROBE, exclude=None):
+        """
+        DESCR: most similar historical days with their meta and next morning
+        INPUT:
+            charts - array like - days, see forecaster.to_day_ohlc
+            k - int - neighbours per day
+            raw - bool - see features
+            n_probe - int - ivf buckets looked in per query
+            exclude - array like - (m,) dataset row to leave out of each
+                      answer, ie the query's own row
+        OUTPUT:
+            analogs - dict
+                ids, distances - (m, k) arrays
+                neighbours - dataframe - one row per (query, rank) with the
+                             distance, dataset row and its meta
+                next_morning - (m, k, 6, 4) neighbours' next morning candles
+        """
+        Q = self.features(charts, raw)
+        extra = 0 if exclude is None else 1
+        dists, ids = self.search(Q, k + extra, n_probe)
+        if exclude is not None:
+            keep = ids != np.asarray(exclude)[:, None]
+            keep &= np.cumsum(keep, axis=1) <= k
+            dists = dists[keep].reshape(len(Q), -1)[:, :k]
+            ids = ids[keep].reshape(len(Q), -1)[:, :k]
+
+        found = np.maximum(ids, 0)
+        neighbours = self.store.meta.iloc[found.ravel()].reset_index(drop=True)
+        neighbours.insert(0, 'query', np.repeat(np.arange(len(Q)), ids.shape[1]))
+        neighbours.insert(1, 'rank', np.tile(np.arange(ids.shape[1]), len(Q)))
+        neighbours.insert(2, 'distance', dists.ravel())
+        neighbours.insert(3, 'id', ids.ravel())
+        next_morning = np.asarray(self.store.next_morning()[found.ravel()])
+        return {'ids': ids, 'distances': dists, 'neighbours': neighbours,
+                'next_morning': next_morning.reshape(ids.shape + (-1, 4))}
+
+
+if __name__ == '__main__':
+    """
+    DESCR: Build an index, time queries and check it against blocked search
+    """
+    import warnings
+    warnings.filterwarnings("ignore")
+
+    try:
+        data_path = sys.argv[1]
+        mode = sys.argv[2]
+        args = [arg for arg in sys.argv[3:] if arg != "-weight"]
+        num_neighbours = int(args[0]) if args else 50
+        weight = "-weight" in sys.argv[3:]
+    except:
+        print "ERROR Usage: python analog_index.py <dataset> <mode> " \
+              "[num_neighbours] [-weight]"
+        sys.exit(-1)
+
+    start_time = time()
+    index = AnalogIndex.build(data_path, mode, weight)
+    print "{} built in {:.1f}s".format(index, time() - start_time)
+
+    rows = np.random.RandomState(0).choice(index.store.n_charts, 100,
+                                           replace=False)
+    days = np.asarray(index.store.first_day()[rows])
+    start_time = time()
+    for row, day in zip(rows, days):
+        index.query(day, num_neighbours, raw=False, exclude=[row])
+    print "One day at a time: {:.2f}ms per day".format(
+          (time() - start_time) * 1000 / len(rows))
+
+    start_time = time()
+    analogs = index.query(days, num_neighbours, raw=False, exclude=rows)
+    print "{} days at once: {:.1f}ms".format(len(rows),
+                                             (time() - start_time) * 1000)
+
+    if mode != 'blocked':
+        exact = AnalogIndex.build(data_path, 'blocked', weight)
+        truth = exact.query(days, num_neighbours, raw=False, exclude=rows)
+        recall = np.mean([len(np.intersect1d(a, b)) / float(num_neighbours)
+                          for a, b in zip(analogs['ids'], truth['ids'])])
+        print "Recall against blocked: {:.3f}".format(recall)
+    print analogs['neighbours'].head(10)
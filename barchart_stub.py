@@ -0,0 +1,244 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: barchart_stub.py
+# USAGE: python barchart_stub.py <port> [--fixtures DIR] [--latency MS]
+#                                [--error-rate R] [--short-rate R]
+#                                [--malformed-rate R]
+# DESCR: Local stand in for barchart so the puller can be tuned and load
+#        tested offline. Answers chart.php?sym=...&sd=...&ed=... with either
+#        recorded fixture pages or generated random walk pages covering the
+#        weekdays asked for, with configurable latency, 503s, short pages
+#        (< 156 candles) and malformed pages. Recorded pages keep their own
+#        dates, so they only make sense for one pair per request.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, threaded stub server with fault injection
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+from chart_fixtures import make_days, random_walk_day, render_chart_page
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import urlparse
+import threading
+import datetime
+import random
+import time
+import os
+import sys
+
+# CONSTANT SECTION
+DEFAULT_PORT = 8642
+RECOGNIZED_OPTIONS = {"--fixtures": str, "--latency": float,
+                      "--error-rate": float, "--short-rate": float,
+                      "--malformed-rate": float}
+MALFORMED_PAGE = "<html><body><center><img src=\"/cache/chart.png\"></bo"
+
+
+# FUNCTION SECTION
+def parse_date(text):
+    """
+    DESCR: date out of a url param like 3/6/2014 (already unquoted)
+    """
+    month, day, year = [int(x) for x in text.split('/')]
+    return datetime.datetime(year, month, day)
+
+
+def generated_page(symb, start_date, end_date):
+    """
+    DESCR: random walk page for every weekday from start_date to end_date,
+           same symbol and dates always give the same page
+    INPUT:
+        symb - str
+        start_date - datetime
+        end_date - datetime
+    OUTPUT:
+        page - str
+    """
+    rng = random.Random('{}{}'.format(symb, start_date.toordinal()))
+    n_days = sum(1 for x in range((end_date - start_date).days + 1)
+                 if (start_date + datetime.timedelta(days=x)).weekday() < 5)
+    days = make_days(rng, start_date, max(n_days, 1),
+                     price=rng.uniform(20, 500))
+    return render_chart_page(symb, days)
+
+
+def load_recorded_pages(fixture_dir):
+    """
+    DESCR: recorded pages with enough candles to be a chart
+    INPUT:
+        fixture_dir - str - directory of .html pages
+    OUTPUT:
+        pages - list of str
+    """
+    pages = []
+    for name in sorted(os.listdir(fixture_dir)):
+        if name.endswith('.html') and not name.startswith('too_few'):
+            with open(os.path.join(fixture_dir, name), 'r') as f:
+                pages.append(f.read())
+    return pages
+
+
+# CLASS SECTION
+class StubConfig(object):
+    """
+    DESCR: knobs for how the stub behaves
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, short_rate=0.0,
+                 malformed_rate=0.0, fixture_dir=None, seed=None):
+        """
+        DESCR: set up stub behaviour
+        INPUT:
+            latency - float - mean ms before answering, exponential spread
+            error_rate - float - chance of a 503
+            short_rate - float - chance of a page with too few candles
+            malformed_rate - float - chance of a cut off page with no map
+            fixture_dir - str - serve recorded pages from here, else generate
+            seed - int - for the fault dice
+        OUTPUT: None
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.short_rate = short_rate
+        self.malformed_rate = malformed_rate
+        self.pages = load_recorded_pages(fixture_dir) if fixture_dir else None
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'ok': 0, 'error': 0, 'short': 0,
+                       'malformed': 0}
+
+    def roll(self):
+        """
+        DESCR: pick what kind of answer the next request gets
+        OUTPUT:
+            kind - str - 'error', 'short', 'malformed' or 'ok'
+            delay - float - seconds to wait first
+        """
+        with self.lock:
+            self.counts['requests'] += 1
+            dice = self.rng.random()
+            delay = self.rng.expovariate(1000.0 / self.latency) if self.latency else 0
+            kind = 'ok'
+            for name, rate in [('error', self.error_rate),
+                               ('short', self.short_rate),
+                               ('malformed', self.malformed_rate)]:
+                if dice < rate:
+                    kind = name
+                    break
+                dice -= rate
+            self.counts[kind] += 1
+        return kind, delay
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    DESCR: answers chart.php requests, config is set on the server
+    """
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body go out in one packet, otherwise nagle and delayed acks
+    # add ~40ms to every keep alive request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_page(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        config = self.server.config
+        url = urlparse.urlparse(self.path)
+        if not url.path.endswith('chart.php'):
+            self.send_page(404, 'not found')
+            return
+
+        kind, delay = config.roll()
+        if delay:
+            time.sleep(delay)
+
+        params = urlparse.parse_qs(url.query)
+        try:
+            symb = params['sym'][0]
+            start_date = parse_date(params['sd'][0])
+            end_date = parse_date(params['ed'][0])
+        except (KeyError, ValueError):
+            self.send_page(400, 'bad request')
+            return
+
+        if kind == 'error':
+            self.send_page(503, 'Service Unavailable')
+        elif kind == 'malformed':
+            self.send_page(200, MALFORMED_PAGE)
+        elif kind == 'short':
+            rng = random.Random(symb)
+            candles = random_walk_day(rng, 50.0, 100)[0]
+            self.send_page(200, render_chart_page(symb, [(start_date, candles)]))
+        elif config.pages:
+            page = config.pages[hash((symb, start_date)) % len(config.pages)]
+            self.send_page(200, page)
+        else:
+            self.send_page(200, generated_page(symb, start_date, end_date))
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    DESCR: threaded server, dropped client connections are not errors
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, config):
+        HTTPServer.__init__(self, address, StubHandler)
+        self.config = config
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+def start_stub(config=None, port=0):
+    """
+    DESCR: run a stub server on a background thread
+    INPUT:
+        config - StubConfig - defaults to no faults
+        port - int - 0 for any free port
+    OUTPUT:
+        server - StubServer - server.base_url is where to point a fetcher
+    """
+    server = StubServer(('127.0.0.1', port), config or StubConfig())
+    server.base_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    options = {}
+    args = sys.argv[2:]
+    while args:
+        arg = args.pop(0)
+        if arg not in RECOGNIZED_OPTIONS:
+            print "{} not recognized".format(arg)
+            continue
+        options[arg] = RECOGNIZED_OPTIONS[arg](args.pop(0))
+
+    config = StubConfig(latency=options.get("--latency", 0.0),
+                        error_rate=options.get("--error-rate", 0.0),
+                        short_rate=options.get("--short-rate", 0.0),
+                        malformed_rate=options.get("--malformed-rate", 0.0),
+                        fixture_dir=options.get("--fixtures"))
+    server = StubServer(('127.0.0.1', port), config)
+    print "Stub barchart on http://127.0.0.1:{}/chart.php".format(port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print config.counts
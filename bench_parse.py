@@ -0,0 +1,162 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: bench_parse.py
+# USAGE: python bench_parse.py <fixture_dir> <iterations>
+# DESCR: Times the original parse of a chart page (soup plus the old char by
+#        char number stripping), the soup parse with new number handling and
+#        the fast regex parse on the saved fixture pages. All have to give the
+#        exact same candles and meta before any timing is trusted.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, charts per second legacy vs soup vs fast
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+from pull_chart import parse_chart_page, parse_window_page, extract_candle_text
+from pull_chart import split_candle_text, group_by_day
+from pull_chart import CANDLES_IN_DAY, NUM_OF_NEXT_DAY_TO_KEEP
+from time import time
+import os
+import sys
+
+# CONSTANT SECTION
+DEFAULT_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'fixtures')
+DEFAULT_ITERATIONS = 50
+
+
+# FUNCTION SECTION
+def legacy_text_to_float(s):
+    """
+    DESCR: ugly_text_to_float as it was before the regex, kept as baseline
+    """
+    nums = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']
+    while s[0] not in nums:
+        s = s[1:]
+    while s[-1] not in nums:
+        s = s[:-1]
+
+    return float(s)
+
+
+def legacy_build_chart(candles):
+    """
+    DESCR: number and meta handling of pull_one_chart before the rewrite
+    """
+    meta = {}
+    meta['first_day'] = candles[0][0][2:]
+    meta['year'] = candles[0][1][:4]
+    meta['symbol'] = candles[0][2][1:-1]
+    meta['second_day'] = candles[79][0][2:]
+
+    candles = [candle[3:] for candle in candles]
+    candles = [[legacy_text_to_float(num) for num in candle] for candle in candles]
+
+    if len(candles) == 157 or len(candles) == 156:
+        if len(set(candles[78])) != 1:
+            new_candle = [candles[77][-1]]*4
+            candles = candles[:78] + [new_candle] + candles[78:]
+
+    return candles[:CANDLES_IN_DAY + NUM_OF_NEXT_DAY_TO_KEEP], meta
+
+
+def legacy_parse_page(name, text):
+    """
+    DESCR: soup and old number stripping, windows split one pair at a time
+    """
+    candles = split_candle_text(extract_candle_text(text, fast=False))
+    if not name.startswith('window'):
+        return [legacy_build_chart(candles)]
+    days = group_by_day(candles)
+    return [legacy_build_chart(day + next_day)
+            for day, next_day in zip(days[:-1], days[1:])]
+
+
+def load_fixtures(fixture_dir):
+    """
+    DESCR: read every .html page in a directory
+    INPUT:
+        fixture_dir - str
+    OUTPUT:
+        pages - dict - file name to unicode page text
+    """
+    pages = {}
+    for name in sorted(os.listdir(fixture_dir)):
+        if name.endswith('.html'):
+            with open(os.path.join(fixture_dir, name), 'r') as f:
+                pages[name] = f.read().decode('utf-8')
+    return pages
+
+
+def parse_page(name, text, fast):
+    """
+    DESCR: parse a fixture the way the puller would, windows split by day
+    INPUT:
+        name - str - fixture file name
+        text - str - page
+        fast - bool or 'legacy' - which parser
+    OUTPUT:
+        charts - list of (candles, meta)
+    """
+    if fast == 'legacy':
+        return legacy_parse_page(name, text)
+    if name.startswith('window'):
+        return parse_window_page(text, name, fast=fast)
+    return [parse_chart_page(text, name, fast=fast)]
+
+
+def time_parse(pages, fast, iterations):
+    """
+    DESCR: parse every page iterations times
+    INPUT:
+        pages - dict - name to text, only full chart pages
+        fast - bool or 'legacy' - which parser
+        iterations - int
+    OUTPUT:
+        seconds - float
+        n_charts - int - charts parsed in total
+    """
+    n_charts = 0
+    start_time = time()
+    for _ in range(iterations):
+        for name, text in pages.items():
+            n_charts += len(parse_page(name, text, fast))
+    return time() - start_time, n_charts
+
+
+if __name__ == '__main__':
+    fixture_dir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FIXTURE_DIR
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ITERATIONS
+
+    pages = load_fixtures(fixture_dir)
+    print "Loaded {} fixture pages from {}".format(len(pages), fixture_dir)
+
+    # Short pages only go as far as the candle count check
+    full_pages = {}
+    for name, text in pages.items():
+        soup_text = extract_candle_text(text, fast=False)
+        fast_text = extract_candle_text(text, fast=True)
+        if soup_text != fast_text:
+            print "MISMATCH: candle text differs on {}".format(name)
+            sys.exit(-1)
+        if len(fast_text) >= 156:
+            full_pages[name] = text
+
+    # Both parsers have to agree before timing means anything
+    for name, text in full_pages.items():
+        fast_charts = parse_page(name, text, True)
+        if (parse_page(name, text, False) != fast_charts or
+                parse_page(name, text, 'legacy') != fast_charts):
+            print "MISMATCH: charts differ on {}".format(name)
+            sys.exit(-1)
+    print "Legacy, soup and fast parse agree on all {} pages".format(len(pages))
+
+    print "                 charts   seconds   charts/sec"
+    times = {}
+    for label, fast in [('legacy', 'legacy'), ('soup', False), ('fast', True)]:
+        times[label], n_charts = time_parse(full_pages, fast, iterations)
+        print "{:14s} {:8d} {:9.3f} {:12.1f}".format(label + ':', n_charts,
+                                                     times[label],
+                                                     n_charts / times[label])
+    print "Speed up fast over legacy: {:.1f}x".format(times['legacy'] /
+                                                      times['fast'])
@@ -0,0 +1,355 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: benchmark_pipeline.py
+# USAGE: from benchmark_pipeline import run_benchmark
+#        python benchmark_pipeline.py <work_dir> <results_json> <num_charts>
+#                                     [num_clusters] [-minibatch]
+# DESCR: Times the whole pipeline on synthetic charts so a change that slows
+#        a stage down shows up without the real scrape. Every stage runs in
+#        its own forked process, one after another, and hands its output to
+#        the next through files in work_dir the way the scripts do: csv from
+#        synthetic_charts, csv ingest, end of day adjust, -zero / -norm /
+#        -lower, flatten, day split, KMeans fit, the cluster metrics block and
+#        the cluster report pngs. Each stage's seconds and the peak resident
+#        memory of its process (its inputs included, so the start is given
+#        too) go to a json file along with the versions it ran on.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, per stage time and peak memory of a
+#                      synthetic run written as json
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+import matplotlib
+matplotlib.use('Agg')
+from synthetic_charts import write_synthetic_csv
+from chart_reader import read_chart_csv
+from chart_store import ChartStore, load_charts, save_dataset
+from helper_functions import end_of_day_adjust_batch, zero_charts
+from helper_functions import normalize_charts, shift_candles_to_zero
+from cluster_metrics import cluster_metrics, summarize_metrics
+from k_sweep import fit_k
+from cluster_report import run_report
+from functools import partial
+from multiprocessing import Process, Queue, cpu_count
+from Queue import Empty
+from time import time
+import cPickle as pickle
+import numpy as np
+import traceback
+import platform
+import resource
+import datetime
+import sklearn
+import json
+import os
+import sys
+
+# CONSTANT SECTION
+RANDOM_STATE = 42
+N_CLUSTERS = 50
+N_MEMBERS = 10
+CSV_FILE = 'charts.csv'
+RAW_DATASET = 'raw.charts'
+ADJUSTED_DATASET = 'adjusted.charts'
+CLEAN_DATASET = 'clean.charts'
+MODEL_FILE = 'model.pkl'
+REPORT_DIR = 'report'
+
+
+# FUNCTION SECTION
+def peak_rss_mb():
+    """
+    DESCR: most memory this process has held so far, a forked process starts
+           at its parent's size. Linux gives ru_maxrss in KB
+    INPUT: none
+    OUTPUT:
+        mb - float
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def children_peak_rss_mb():
+    """
+    DESCR: most memory any finished child of this process held, ie a pool
+    INPUT: none
+    OUTPUT:
+        mb - float
+    """
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+
+
+def in_memory(path):
+    """
+    DESCR: a dataset read fully into memory, transforms change it in place
+    INPUT:
+        path - str - dataset directory
+    OUTPUT:
+        store - ChartStore
+    """
+    store = load_charts(path)
+    return ChartStore(np.array(store.ohlc), store.meta)
+
+
+def stage_generate(work_dir, options):
+    """
+    DESCR: write the synthetic csv
+    """
+    path = os.path.join(work_dir, CSV_FILE)
+    start_time = time()
+    n_charts = write_synthetic_csv(path, options['n_charts'],
+                                   random_state=options['random_state'])
+    seconds = time() - start_time
+    return seconds, {'n_charts': n_charts,
+                     'csv_mb': os.path.getsize(path) / 2.0 ** 20}
+
+
+def stage_csv_ingest(work_dir, options):
+    """
+    DESCR: read the csv into a ChartStore, saved untimed for the next stage
+    """
+    start_time = time()
+    store = read_chart_csv(os.path.join(work_dir, CSV_FILE))
+    seconds = time() - start_time
+    save_dataset(store, os.path.join(work_dir, RAW_DATASET))
+    return seconds, {'charts_per_second': len(store) / max(seconds, 1e-9)}
+
+
+def stage_end_of_day_adjust(work_dir, options):
+    """
+    DESCR: end of day adjust every chart, as clean_stock_stream always does
+    """
+    store = in_memory(os.path.join(work_dir, RAW_DATASET))
+    start_time = time()
+    end_of_day_adjust_batch(store.ohlc, in_place=True)
+    seconds = time() - start_time
+    save_dataset(store, os.path.join(work_dir, ADJUSTED_DATASET))
+    return seconds, {}
+
+
+def stage_transform(transform, save_as, work_dir, options):
+    """
+    DESCR: one of the flagged transforms on the adjusted charts, the one
+           clustered on is saved as the clean dataset
+    INPUT:
+        transform - function - ie normalize_charts
+        save_as - str - flag to save the result under, None to drop it
+        work_dir - str
+        options - dict
+    """
+    store = in_memory(os.path.join(work_dir, ADJUSTED_DATASET))
+    start_time = time()
+    transform(store.ohlc, in_place=True)
+    seconds = time() - start_time
+    if save_as:
+        save_dataset(store, os.path.join(work_dir, CLEAN_DATASET), [save_as])
+    return seconds, {}
+
+
+def stage_flatten(work_dir, options):
+    """
+    DESCR: flattened float dataframe, the -flatten -pickle output
+    """
+    store = load_charts(os.path.join(work_dir, CLEAN_DATASET))
+    start_time = time()
+    df = store.to_float_df()
+    seconds = time() - start_time
+    return seconds, {'shape': list(df.shape)}
+
+
+def stage_day_split(work_dir, options):
+    """
+    DESCR: X and y of the mapped clean dataset
+    """
+    store = load_charts(os.path.join(work_dir, CLEAN_DATASET))
+    start_time = time()
+    X, y = store.day_split()
+    seconds = time() - start_time
+    return seconds, {'X_shape': list(X.shape), 'y_shape': list(y.shape)}
+
+
+def stage_kmeans_fit(work_dir, options):
+    """
+    DESCR: fit the clusters like cluster_attempt, full KMeans or -minibatch
+    """
+    X, _ = load_charts(os.path.join(work_dir, CLEAN_DATASET)).day_split()
+    start_time = time()
+    cluster = fit_k(X, options['n_clusters'], minibatch=options['minibatch'],
+                    random_state=options['random_state'])
+    seconds = time() - start_time
+    with open(os.path.join(work_dir, MODEL_FILE), 'wb') as f:
+        pickle.dump(cluster, f, pickle.HIGHEST_PROTOCOL)
+    return seconds, {'inertia': float(cluster.inertia_),
+                     'n_iter': int(cluster.n_iter_)}
+
+
+def stage_cluster_metrics(work_dir, options):
+    """
+    DESCR: distance and similarity metrics of every cluster, big clusters
+           sampled for -minibatch like cluster_attempt does
+    """
+    X, y = load_charts(os.path.join(work_dir, CLEAN_DATASET)).day_split()
+    with open(os.path.join(work_dir, MODEL_FILE), 'rb') as f:
+        cluster = pickle.load(f)
+    large = 'sample' if options['minibatch'] else 'blocked'
+    start_time = time()
+    summary = summarize_metrics(cluster_metrics(X, y, cluster.labels_,
+                                                options['n_clusters'],
+                                                large=large))
+    seconds = time() - start_time
+    return seconds, dict((key, float(value)) for key, value in
+                         summary.items())
+
+
+def stage_render(work_dir, options):
+    """
+    DESCR: png of every cluster and the index page
+    """
+    with open(os.path.join(work_dir, MODEL_FILE), 'rb') as f:
+        cluster = pickle.load(f)
+    start_time = time()
+    run_report(os.path.join(work_dir, CLEAN_DATASET), cluster,
+               os.path.join(work_dir, REPORT_DIR), n_members=N_MEMBERS,
+               workers=options['workers'])
+    seconds = time() - start_time
+    return seconds, {'charts_drawn': options['n_clusters'] * (N_MEMBERS + 1)}
+
+
+STAGES = [('generate', stage_generate),
+          ('csv_ingest', stage_csv_ingest),
+          ('end_of_day_adjust', stage_end_of_day_adjust),
+          ('zero', partial(stage_transform, zero_charts, None)),
+          ('norm', partial(stage_transform, normalize_charts, '-norm')),
+          ('lower', partial(stage_transform, shift_candles_to_zero, None)),
+          ('flatten', stage_flatten),
+          ('day_split', stage_day_split),
+          ('kmeans_fit', stage_kmeans_fit),
+          ('cluster_metrics', stage_cluster_metrics),
+          ('render', stage_render)]
+
+
+def run_stage(stage, work_dir, options, queue):
+    """
+    DESCR: process target, run one stage and send back its time and memory
+    INPUT:
+        stage - function - (work_dir, options) -> (seconds, info)
+        work_dir - str
+        options - dict
+        queue - Queue - result dict is put here
+    OUTPUT: none
+    """
+    start_rss = peak_rss_mb()
+    try:
+        seconds, info = stage(work_dir, options)
+    except Exception:
+        queue.put({'error': traceback.format_exc()})
+        return
+    result = {'seconds': seconds, 'start_rss_mb': start_rss,
+              'peak_rss_mb': peak_rss_mb(),
+              'children_peak_rss_mb': children_peak_rss_mb()}
+    result['peak_rss_delta_mb'] = result['peak_rss_mb'] - start_rss
+    result.update(info)
+    queue.put(result)
+
+
+def wait_for_result(process, queue, poll=1.0):
+    """
+    DESCR: result a stage process sends, without hanging if it dies first
+    INPUT:
+        process - Process - running stage
+        queue - Queue - it puts its result here
+        poll - float - seconds between checks it is still alive
+    OUTPUT:
+        result - dict - an error entry if the process died without one
+    """
+    while True:
+        try:
+            return queue.get(timeout=poll)
+        except Empty:
+            if not process.is_alive() and queue.empty():
+                return {'error': 'exit code {}'.format(process.exitcode)}
+
+
+def environment():
+    """
+    DESCR: what the numbers were measured on
+    INPUT: none
+    OUTPUT:
+        env - dict
+    """
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'sklearn': sklearn.__version__,
+            'cpu_count': cpu_count()}
+
+
+def run_benchmark(work_dir, n_charts, n_clusters=N_CLUSTERS, minibatch=False,
+                  workers=None, stages=None, random_state=RANDOM_STATE):
+    """
+    DESCR: run the pipeline stages in order, each in a fresh process, and
+           stop at the first one that fails since the rest need its output
+    INPUT:
+        work_dir - str - where the csv, datasets, model and pngs go
+        n_charts - int - synthetic charts
+        n_clusters - int
+        minibatch - bool - MiniBatchKMeans fit like -minibatch
+        workers - int - render processes, default cpu count
+        stages - list of str - names from STAGES to run, default all
+        random_state - int
+    OUTPUT:
+        results - dict - options, environment and one dict per stage
+    """
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    options = {'n_charts': n_charts, 'n_clusters': n_clusters,
+               'minibatch': minibatch, 'workers': workers,
+               'random_state': random_state}
+    results = {'date': datetime.datetime.now().isoformat(),
+               'options': options, 'environment': environment(),
+               'stages': []}
+
+    for name, stage in STAGES:
+        if stages is not None and name not in stages:
+            continue
+        queue = Queue()
+        process = Process(target=run_stage,
+                          args=(stage, work_dir, options, queue))
+        process.start()
+        result = wait_for_result(process, queue)
+        process.join()
+        result['stage'] = name
+        results['stages'].append(result)
+
+        if 'error' in result:
+            print "   {:18s} FAILED\n{}".format(name, result['error'])
+            break
+        print "   {:18s} {:8.2f}s  peak {:8.1f}MB (+{:.1f})".format(
+              name, result['seconds'], result['peak_rss_mb'],
+              result['peak_rss_delta_mb'])
+
+    results['total_seconds'] = sum(result.get('seconds', 0)
+                                   for result in results['stages'])
+    return results
+
+
+if __name__ == '__main__':
+    try:
+        work_dir = sys.argv[1]
+        results_path = sys.argv[2]
+        n_charts = int(sys.argv[3])
+        minibatch = "-minibatch" in sys.argv[4:]
+        numbers = [int(arg) for arg in sys.argv[4:] if arg != "-minibatch"]
+    except:
+        print "ERROR Usage: python benchmark_pipeline.py <work_dir> " \
+              "<results_json> <num_charts> [num_clusters] [-minibatch]"
+        sys.exit(-1)
+    n_clusters = numbers[0] if numbers else N_CLUSTERS
+
+    print "Benchmarking {} synthetic charts, K = {}".format(n_charts,
+                                                            n_clusters)
+    results = run_benchmark(work_dir, n_charts, n_clusters, minibatch)
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print "Total {:.1f}s, results in {}".format(results['total_seconds'],
+                                                results_path)
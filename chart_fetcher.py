@@ -0,0 +1,239 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: chart_fetcher.py
+# USAGE: from chart_fetcher import ChartFetcher
+# DESCR: Faster way to pull lots of charts. One requests session with a pool
+#        of keep alive connections is shared by a pool of threads, a token
+#        bucket keeps from hammering the site, and non 200 responses are
+#        retried with backoff before being written off. Parsing and output are
+#        the same as pull_chart.pull_one_chart.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, fetcher with pooled session, rate limit
+#                      and retries
+#                    - fetch_window pulls many day pairs in one request
+#                    - Parse failures and other errors go in the error file
+#                      like bad responses
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+from pull_chart import build_chart_url, parse_chart_page, record_pull_error
+from pull_chart import parse_window_page, parse_or_record, BASE_URL
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+import requests
+import threading
+import time
+
+# CONSTANT SECTION
+DEFAULT_CONCURRENCY = 20
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+DEFAULT_TIMEOUT = 30
+RETRY_CODES = set([429, 500, 502, 503, 504])
+
+
+# CLASS SECTION
+class TokenBucket(object):
+    """
+    DESCR: thread safe token bucket, acquire blocks until a request is allowed
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        DESCR: initialize a full bucket
+        INPUT:
+            rate - float - tokens added per second, None for no limit
+            capacity - float - most tokens saved up, defaults to rate
+        OUTPUT: None
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate or 1, 1)
+        self.tokens = self.capacity
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        DESCR: take one token, sleeping until one is there if needed
+        """
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ChartFetcher(object):
+    """
+    DESCR: pulls charts over a shared pool of keep alive connections
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, rate=None,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 timeout=DEFAULT_TIMEOUT, base_url=BASE_URL):
+        """
+        DESCR: set up session and limits
+        INPUT:
+            concurrency - int - requests in flight at once
+            rate - float - most requests per second, None for no limit
+            retries - int - extra tries after a bad response
+            backoff - float - seconds before first retry, doubles each time
+            timeout - float - seconds to wait on a response
+            base_url - str - site to pull from
+        OUTPUT: None
+        """
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.base_url = base_url
+        self.bucket = TokenBucket(rate)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency,
+                              max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_page(self, url):
+        """
+        DESCR: get a page, retrying with backoff on bad codes or dropped
+               connections
+        INPUT:
+            url - str
+        OUTPUT:
+            response - requests.Response or None if never connected
+        """
+        response = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            self.bucket.acquire()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException as e:
+                response = None
+                error = e
+                continue
+            if response.status_code == 200:
+                return response
+            if response.status_code not in RETRY_CODES:
+                return response
+
+        if response is None:
+            record_pull_error(url, "Exception: {}".format(error))
+        return response
+
+    def chart_url(self, symb, minutes, start_date, end_date):
+        """
+        DESCR: url of a chart from one date through another
+        INPUT:
+            symb - str - stock designator
+            minutes - int - canclestick interval length
+            start_date - datetime - first day
+            end_date - datetime - last day
+        OUTPUT:
+            url - str
+        """
+        return build_chart_url(symb, minutes,
+                               start_date.month, start_date.day, start_date.year,
+                               end_date.month, end_date.day, end_date.year,
+                               base_url=self.base_url)
+
+    def fetch(self, symb, minutes, date_pair):
+        """
+        DESCR: one chart, same output as pull_chart.pull_one_chart
+        INPUT:
+            symb - str - stock designator
+            minutes - int - canclestick interval length
+            date_pair - tuple - (date_start, date_end)
+        OUTPUT:
+            (candles, meta) or -1 for bad response, -2 for to few candles
+        """
+        url = self.chart_url(symb, minutes, date_pair[0], date_pair[1])
+        response = self.get_page(url)
+
+        if response is None:
+            return -1
+        if response.status_code != 200:
+            record_pull_error(url, "Response code: {}".format(
+                              response.status_code))
+            return -1
+        return parse_or_record(parse_chart_page, response.text, url)
+
+    def fetch_window(self, symb, minutes, start_date, end_date):
+        """
+        DESCR: every day / next morning chart between two dates in one request,
+               same output per chart as pull_chart.pull_one_chart
+        INPUT:
+            symb - str - stock designator
+            minutes - int - canclestick interval length
+            start_date - datetime - first day
+            end_date - datetime - last day
+        OUTPUT:
+            charts - list of (candles, meta) or -1 for bad response
+        """
+        url = self.chart_url(symb, minutes, start_date, end_date)
+        response = self.get_page(url)
+
+        if response is None:
+            return -1
+        if response.status_code != 200:
+            record_pull_error(url, "Response code: {}".format(
+                              response.status_code))
+            return -1
+        return parse_or_record(parse_window_page, response.text, url)
+
+    def fetch_many(self, jobs):
+        """
+        DESCR: pull many charts at once, results come back as they finish
+        INPUT:
+            jobs - iterable of (symb, minutes, date_pair)
+        OUTPUT:
+            (job, result) - yielded per chart, result as from fetch
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = dict((executor.submit(self.fetch, *job), job)
+                           for job in jobs)
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print "ERROR: {} {}".format(job, e)
+                    record_pull_error(self.chart_url(job[0], job[1], *job[2]),
+                                      "Exception: {}".format(e))
+                    result = -1
+                yield job, result
+
+    def close(self):
+        """
+        DESCR: drop pooled connections
+        """
+        self.session.close()
+
+
+if __name__ == '__main__':
+    """
+    DESCR: Test pull of a few charts
+    """
+    import datetime
+
+    fetcher = ChartFetcher(concurrency=4, rate=2)
+    date_pair = (datetime.datetime(2014, 3, 6), datetime.datetime(2014, 3, 7))
+    jobs = [(symb, 5, date_pair) for symb in ['AAPL', 'MSFT', 'GOOG']]
+    for job, result in fetcher.fetch_many(jobs):
+        if isinstance(result, tuple):
+            print job[0], len(result[0]), result[1]
+        else:
+            print job[0], "failed with {}".format(result)
+    fetcher.close()
@@ -0,0 +1,151 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: chart_fixtures.py
+# USAGE: python chart_fixtures.py <fixture_dir>
+# DESCR: Makes fake barchart chart pages so parsing and pulling can be tested
+#        and timed without hitting the site. Candles are a random walk and
+#        each one is written as an <area onmousemove=...> in the same shape
+#        pull_chart expects (newest candle first inside center > map).
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, random walk days and page rendering
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+import datetime
+import random
+import os
+
+# CONSTANT SECTION
+CANDLES_IN_FULL_DAY = 79
+TOOLTIP = ("showOHLCTooltip(event, 'B', '[{day}, {year} {time}], '{symbol}', "
+           "O:{o:.4f}, H:{h:.4f}, L:{l:.4f}, C:{c:.4f}')")
+AREA = '<area shape="rect" coords="{x},10,{x2},200" onmousemove="{tip}">'
+PAGE = ("<html><head><title>{symbol} Chart</title></head><body>"
+        "<div id=\"header\"><a href=\"/\">Barchart</a></div>"
+        "<center><img src=\"/cache/chart.png\" usemap=\"#chart\">"
+        "<map name=\"chart\">{areas}</map></center>"
+        "<div id=\"footer\">Data delayed</div></body></html>")
+
+
+# FUNCTION SECTION
+def random_walk_day(rng, price, n_candles=CANDLES_IN_FULL_DAY, vol=0.002):
+    """
+    DESCR: one day of random walk candles
+    INPUT:
+        rng - random.Random - source of randomness
+        price - float - open of first candle
+        n_candles - int - candles in day
+        vol - float - std of each candle's return
+    OUTPUT:
+        candles - list [[o,h,l,c], ...]
+        price - float - close of last candle
+    """
+    candles = []
+    for _ in range(n_candles):
+        open_price = price
+        close_price = open_price * (1 + rng.gauss(0, vol))
+        high = max(open_price, close_price) * (1 + abs(rng.gauss(0, vol / 2)))
+        low = min(open_price, close_price) * (1 - abs(rng.gauss(0, vol / 2)))
+        candles.append([round(x, 4) for x in
+                        [open_price, high, low, close_price]])
+        price = close_price
+
+    return candles, price
+
+
+def render_chart_page(symbol, days, escape_quotes=False):
+    """
+    DESCR: html of a chart page holding the given days of candles
+    INPUT:
+        symbol - str - ie 'AAPL'
+        days - list of (datetime, candles) - in time order
+        escape_quotes - bool - write ' as &#39; like some pages do
+    OUTPUT:
+        page - str
+    """
+    areas = []
+    x = 0
+    for day, candles in days:
+        for ind, (o, h, l, c) in enumerate(candles):
+            minutes = 9 * 60 + 30 + 5 * ind
+            tip = TOOLTIP.format(day=day.strftime('%m/%d'), year=day.year,
+                                 time='{:02d}:{:02d}'.format(minutes // 60,
+                                                             minutes % 60),
+                                 symbol=symbol, o=o, h=h, l=l, c=c)
+            if escape_quotes:
+                tip = tip.replace("'", '&#39;')
+            areas.append(AREA.format(x=x, x2=x + 3, tip=tip))
+            x += 3
+
+    # Page lists newest candle first
+    areas.reverse()
+    return PAGE.format(symbol=symbol, areas=''.join(areas))
+
+
+def make_days(rng, start_date, n_days, price=100.0, short_day=None):
+    """
+    DESCR: consecutive weekdays of random walk candles
+    INPUT:
+        rng - random.Random
+        start_date - datetime - first day
+        n_days - int - weekdays wanted
+        price - float - starting price
+        short_day - int - index of a day missing its last candle, optional
+    OUTPUT:
+        days - list of (datetime, candles)
+    """
+    days = []
+    day = start_date
+    while len(days) < n_days:
+        if day.weekday() < 5:
+            candles, price = random_walk_day(rng, price)
+            if short_day == len(days):
+                candles = candles[:-1]
+            days.append((day, candles))
+        day += datetime.timedelta(days=1)
+
+    return days
+
+
+def make_fixture_pages(fixture_dir, seed=42):
+    """
+    DESCR: write the set of fixture pages used by bench_parse
+    INPUT:
+        fixture_dir - str - where to write .html files
+        seed - int
+    OUTPUT:
+        names - list of str - files written
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime(2014, 3, 6)
+    pages = {
+        'pair_full.html': render_chart_page('AAPL', make_days(rng, start, 2)),
+        'pair_short_day.html': render_chart_page(
+            'MSFT', make_days(rng, start, 2, price=40.0, short_day=0)),
+        'pair_escaped.html': render_chart_page(
+            'XOM', make_days(rng, start, 2, price=90.0), escape_quotes=True),
+        'too_few_candles.html': render_chart_page(
+            'GE', [(start, random_walk_day(rng, 25.0, 60)[0])]),
+        'window_week.html': render_chart_page(
+            'JNJ', make_days(rng, start, 6, price=95.0)),
+    }
+
+    if not os.path.isdir(fixture_dir):
+        os.makedirs(fixture_dir)
+    for name, page in sorted(pages.items()):
+        with open(os.path.join(fixture_dir, name), 'w') as f:
+            f.write(page)
+
+    return sorted(pages.keys())
+
+
+if __name__ == '__main__':
+    """
+    DESCR: Write fixture pages
+    """
+    import sys
+
+    fixture_dir = sys.argv[1] if len(sys.argv) > 1 else 'fixtures'
+    for name in make_fixture_pages(fixture_dir):
+        print "Wrote {}".format(os.path.join(fixture_dir, name))
@@ -8,16 +8,42 @@
 #           10/7/16 - Initiated a file to plot candlestick charts
 #           10/11/16 - Changed to plot candlestick objects instead of lists
 #           10/12/16 - Plot now excepts 3 different color pairs (prim, sec, ter)
+#           10/18/26 - build_candle_chart draws every body as one
+#                      PolyCollection and every wick as one LineCollection
+#                      straight from the ohlc array, charts can be given as
+#                      CandleSticks or arrays
+#                    - build_candle_charts overlays thousands of charts with
+#                      the same two collections, a few paths per chart
 ###--------------------------------------------------------------------------###
 
 # IMPORT SECTION
 from candlestick import CandleStick
+from chart_store import OPEN, HIGH, LOW, CLOSE, candles_to_ohlc
+from matplotlib.collections import PolyCollection, LineCollection
+from matplotlib.colors import to_rgba_array
+from matplotlib.path import Path
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
+import numpy as np
 import pandas as pd
 from ast import literal_eval
 
 # FUNCTION SECTION
+def candle_colors(color='prim'):
+    """
+    DESCR: up and down body colors of a color scheme
+    INPUT:
+        color - str - 'prim', 'sec' or anything else for 'ter'
+    OUTPUT:
+        colors - list of str - [up color, down color]
+    """
+    if color == 'prim':
+        return ['g', 'r']
+    elif color == 'sec':
+        return ['limegreen', 'deeppink']
+    return ['chartreuse', 'hotpink']
+
+
 def add_candle_to_plot(ax, open_price, high, low, close_price, x, color='prim', alpha=1):
     """
     DESCR: Add a single candle to a given axis
@@ -31,12 +57,7 @@ def add_candle_to_plot(ax, open_price, high, low, close_price, x, color='prim',
     OUTPUT: none
     """
 
-    if color == 'prim':
-        colors = ['g', 'r']
-    elif color == 'sec':
-        colors = ['limegreen', 'deeppink']
-    else:
-        colors = ['chartreuse', 'hotpink']
+    colors = candle_colors(color)
 
     if open_price < close_price:
         ax.add_patch(patches.Rectangle(xy=(x, open_price),
@@ -58,27 +79,109 @@ def add_candle_to_plot(ax, open_price, high, low, close_price, x, color='prim',
         ax.vlines(x=x+0.5, ymin=open_price, ymax=high,  linewidth=1, color='k', alpha=alpha)
         ax.vlines(x=x+0.5, ymin=low, ymax=close_price,  linewidth=1, color='k', alpha=alpha)
 
+
+def chart_to_ohlc(candles):
+    """
+    DESCR: prices of one or many charts however they come
+    INPUT:
+        candles - series / list of CandleSticks, (n_candles, 4) or
+                  (n_charts, n_candles, 4) array, or flat floats
+    OUTPUT:
+        ohlc - array - (n_charts, n_candles, 4)
+    """
+    if isinstance(candles, (pd.Series, pd.DataFrame)):
+        candles = candles.values
+    ohlc = np.asarray(candles)
+    if ohlc.dtype == object:
+        ohlc = candles_to_ohlc(ohlc)
+    ohlc = np.asarray(ohlc, dtype=np.float64)
+    if ohlc.ndim == 1:
+        ohlc = ohlc.reshape(1, -1, 4)
+    elif ohlc.ndim == 2 and ohlc.shape[1] == 4:
+        ohlc = ohlc[None]
+    elif ohlc.ndim == 2:
+        ohlc = ohlc.reshape(ohlc.shape[0], -1, 4)
+    return ohlc
+
+
+def build_candle_charts(fig, ax, charts, color='prim', alpha=1):
+    """
+    DESCR: Draw any number of charts on top of each other with one collection
+           of bodies and one of wicks. Each chart is two compound paths of
+           bodies (up and down colors) and one path of wicks, not an artist
+           or path per candle, so thousands stay quick to draw
+    INPUT:
+        fig - matplotlib figure object
+        ax - matplotlib axes object
+        charts - see chart_to_ohlc - (n_charts, n_candles, 4) ohlc or similar
+        color - str - 'prim', 'sec' or 'ter'
+        alpha - float
+    OUTPUT:
+        bodies - PolyCollection
+        wicks - LineCollection
+    """
+    ohlc = chart_to_ohlc(charts)
+    n_charts, n_candles = ohlc.shape[:2]
+    open_price, high = ohlc[:, :, OPEN], ohlc[:, :, HIGH]
+    low, close_price = ohlc[:, :, LOW], ohlc[:, :, CLOSE]
+    top = np.maximum(open_price, close_price)
+    bot = np.minimum(open_price, close_price)
+    x = np.broadcast_to(np.arange(n_candles, dtype=np.float64), top.shape)
+
+    # Rectangle corners (x, bot) (x+1, bot) (x+1, top) (x, top) then close
+    rects = np.empty(top.shape + (5, 2))
+    rects[..., [0, 3, 4], 0] = x[..., None]
+    rects[..., [1, 2], 0] = x[..., None] + 1
+    rects[..., [0, 1, 4], 1] = bot[..., None]
+    rects[..., [2, 3], 1] = top[..., None]
+    rect_codes = np.array([Path.MOVETO, Path.LINETO, Path.LINETO, Path.LINETO,
+                           Path.CLOSEPOLY], dtype=Path.code_type)
+
+    # Up candles of a chart make one path, down candles another
+    down = ~(open_price < close_price)
+    verts, codes = [], []
+    for chart_rects, chart_down in zip(rects, down):
+        for side in [False, True]:
+            side_rects = chart_rects[chart_down == side]
+            verts.append(side_rects.reshape(-1, 2))
+            codes.append(np.tile(rect_codes, len(side_rects)))
+    bodies = PolyCollection([], edgecolors='k', alpha=alpha, zorder=1)
+    bodies.set_verts_and_codes(verts, codes)
+    bodies.set_facecolors(np.tile(to_rgba_array(candle_colors(color)),
+                                  (n_charts, 1)))
+
+    # Upper then lower wick of every candle, nan between them breaks the line
+    wick_x = x[..., None] + 0.5
+    segments = np.full(top.shape + (2, 3, 2), np.nan)
+    segments[..., 0, :2, 0] = wick_x
+    segments[..., 1, :2, 0] = wick_x
+    segments[..., 0, 0, 1] = top
+    segments[..., 0, 1, 1] = high
+    segments[..., 1, 0, 1] = low
+    segments[..., 1, 1, 1] = bot
+    wicks = LineCollection(segments.reshape(n_charts, -1, 2), linewidths=1,
+                           colors='k', alpha=alpha, zorder=2)
+
+    ax.add_collection(bodies, autolim=False)
+    ax.add_collection(wicks, autolim=False)
+
+    # Data limits from the prices already in hand, no walk over artists
+    if np.isfinite(low).any():
+        ax.update_datalim([(0, np.nanmin(low)), (n_candles, np.nanmax(high))])
+    ax.autoscale_view()
+
+    return bodies, wicks
+
+
 def build_candle_chart(fig, ax, candles, color='prim', alpha=1):
     """
     DESCR: Takes a data series and fig/ax to place it on and adds all candles
     fig - matplotlib figure object
     ax - matplotibl axes object
-    data - pandas series - (89,) - all candles and some metadata
+    data - pandas series of CandleSticks or (n_candles, 4) ohlc array
     """
-    candles = candles.values.tolist()[:]
-
-    for ind, candle in enumerate(candles):
-        add_candle_to_plot(ax,
-                           candle.open_price,
-                           candle.high,
-                           candle.low,
-                           candle.close_price,
-                           ind,
-                           color,
-                           alpha)
-
-    ax.relim()
-    ax.autoscale_view()
+    return build_candle_charts(fig, ax, chart_to_ohlc(candles)[:1], color,
+                               alpha)
 
 # MAIN DRIVER CODE
 if  __name__ == '__main__':
@@ -0,0 +1,249 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: chart_reader.py
+# USAGE: from chart_reader import read_chart_csv, iter_chart_chunks
+# DESCR: Fast reader for the csv files pull_all_data writes. Every candle cell
+#        there looks like "[o, h, l, c]" and the last cell is a str(dict) of
+#        meta data, so instead of read_csv + literal_eval on every cell the
+#        brackets are stripped and a whole chunk of lines goes through one
+#        np.fromstring call. Memory is bounded by chunk size.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, chunked reader straight to ChartStore
+#                    - Can count charts in a file without parsing them
+#                    - Can read just a byte range of a file so several
+#                      processes can split one csv
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+from chart_store import ChartStore, CANDLES_IN_CHART, META_COLUMNS
+from chart_store import meta_from_dicts
+import numpy as np
+import os
+import re
+
+# CONSTANT SECTION
+DEFAULT_CHUNK_SIZE = 10000
+META_START = ',"{'
+META_ITEM_RE = re.compile(r"'(\w+)': '?([^',}]*)'?")
+
+
+# FUNCTION SECTION
+def parse_meta(text):
+    """
+    DESCR: pull the fields out of a meta cell like
+           "{'first_day': '03/06', 'year': '2014', 'symbol': 'AAPL', ...}"
+    INPUT:
+        text - str - meta cell with or without csv quotes
+    OUTPUT:
+        meta - dict - field name to str value
+    """
+    return dict(META_ITEM_RE.findall(text))
+
+
+def split_chart_line(line):
+    """
+    DESCR: split one csv row into its candle text and meta text
+    INPUT:
+        line - str - raw row as written by pull_all_data
+    OUTPUT:
+        candle_text - str - just the numbers separated by commas
+        meta_text - str - the meta dict cell
+    """
+    ind = line.rfind(META_START)
+    if ind == -1:
+        raise ValueError("no meta column found in row: {}".format(line[:80]))
+    candle_text = line[:ind].translate(None, '"[]')
+    meta_text = line[ind + 1:].strip()
+
+    return candle_text, meta_text
+
+
+def parse_chart_lines(lines, n_candles=CANDLES_IN_CHART):
+    """
+    DESCR: turn a batch of csv rows into a ChartStore
+    INPUT:
+        lines - list of str - raw rows, no header
+        n_candles - int - candles each row should have
+    OUTPUT:
+        store - ChartStore - one chart per line
+    """
+    candle_texts = []
+    metas = []
+    for line in lines:
+        candle_text, meta_text = split_chart_line(line)
+        candle_texts.append(candle_text)
+        metas.append(parse_meta(meta_text))
+
+    per_chart = n_candles * 4
+    values = np.fromstring(','.join(candle_texts), dtype=np.float64, sep=',')
+    if values.size != len(lines) * per_chart:
+        # Find the offending row so the error is useful
+        for num, candle_text in enumerate(candle_texts):
+            size = np.fromstring(candle_text, dtype=np.float64, sep=',').size
+            if size != per_chart:
+                raise ValueError("row {} of chunk has {} prices, expected {}"
+                                 .format(num, size, per_chart))
+        raise ValueError("chunk has {} prices, expected {}".format(
+                         values.size, len(lines) * per_chart))
+
+    ohlc = values.reshape(len(lines), n_candles, 4)
+    return ChartStore(ohlc, meta_from_dicts(metas))
+
+
+def check_header(f, file_name):
+    """
+    DESCR: read past the header row, making sure it is a chart csv
+    INPUT:
+        f - file - opened at start of csv
+        file_name - str - just for error message
+    OUTPUT:
+        pos - int - byte offset of first chart row
+    """
+    header = f.readline()
+    if not header.startswith('0,'):
+        raise ValueError("{} does not look like a chart csv".format(file_name))
+    return f.tell()
+
+
+def iter_lines(f, start, end=None):
+    """
+    DESCR: non blank lines beginning in byte range [start, end), readline is
+           used instead of iterating the file so positions stay exact
+    INPUT:
+        f - file - opened in 'rb'
+        start - int - offset of a line start
+        end - int - offset to stop at, None for end of file
+    OUTPUT:
+        line - str - yielded one at a time
+    """
+    f.seek(start)
+    pos = start
+    while end is None or pos < end:
+        line = f.readline()
+        if not line:
+            break
+        pos += len(line)
+        if line.strip():
+            yield line
+
+
+def split_byte_ranges(file_name, n_parts):
+    """
+    DESCR: cut the chart rows of a csv into about equal byte ranges that all
+           begin and end on a line boundary
+    INPUT:
+        file_name - str - csv written by pull_all_data
+        n_parts - int - number of ranges wanted
+    OUTPUT:
+        ranges - list of (int, int) - (start, end) byte offsets, in order
+    """
+    size = os.path.getsize(file_name)
+    with open(file_name, 'rb') as f:
+        first = check_header(f, file_name)
+        bounds = [first]
+        step = (size - first) / float(max(n_parts, 1))
+        for part in range(1, n_parts):
+            f.seek(int(first + part * step) - 1)
+            f.readline()
+            bounds.append(max(f.tell(), bounds[-1]))
+        bounds.append(size)
+
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:])
+            if end > start]
+
+
+def iter_chart_chunks(file_name, chunk_size=DEFAULT_CHUNK_SIZE,
+                      n_candles=CANDLES_IN_CHART, byte_range=None):
+    """
+    DESCR: read a chart csv a chunk at a time
+    INPUT:
+        file_name - str - csv written by pull_all_data
+        chunk_size - int - charts per chunk
+        n_candles - int - candles each row should have
+        byte_range - (int, int) - only rows starting in this range, from
+                     split_byte_ranges, None for whole file
+    OUTPUT:
+        store - ChartStore - yielded once per chunk
+    """
+    with open(file_name, 'rb') as f:
+        start = check_header(f, file_name)
+        end = None
+        if byte_range is not None:
+            start, end = byte_range
+
+        lines = []
+        for line in iter_lines(f, start, end):
+            lines.append(line)
+            if len(lines) == chunk_size:
+                yield parse_chart_lines(lines, n_candles)
+                lines = []
+        if lines:
+            yield parse_chart_lines(lines, n_candles)
+
+
+def count_chart_rows(file_name, byte_range=None):
+    """
+    DESCR: number of charts in a csv without parsing any of them
+    INPUT:
+        file_name - str - csv written by pull_all_data
+        byte_range - (int, int) - only count rows starting in this range
+    OUTPUT:
+        n_charts - int - non blank rows after the header
+    """
+    n_charts = 0
+    with open(file_name, 'rb') as f:
+        start = check_header(f, file_name)
+        end = None
+        if byte_range is not None:
+            start, end = byte_range
+        for line in iter_lines(f, start, end):
+            n_charts += 1
+
+    return n_charts
+
+
+def read_chart_csv(file_name, chunk_size=DEFAULT_CHUNK_SIZE,
+                   n_candles=CANDLES_IN_CHART):
+    """
+    DESCR: read a whole chart csv into one ChartStore
+    INPUT:
+        file_name - str - csv written by pull_all_data
+        chunk_size - int - charts parsed at a time
+        n_candles - int - candles each row should have
+    OUTPUT:
+        store - ChartStore - every chart in file
+    """
+    stores = list(iter_chart_chunks(file_name, chunk_size, n_candles))
+    if not stores:
+        return ChartStore(np.zeros((0, n_candles, 4)))
+    return ChartStore.concat(stores)
+
+
+if __name__ == '__main__':
+    """
+    DESCR: Test code, compare against the old read_csv + literal_eval path
+    """
+    import pandas as pd
+    from ast import literal_eval
+    from time import time
+    import sys
+
+    file_name = sys.argv[1] if len(sys.argv) > 1 else 'data/test_set.csv'
+
+    start_time = time()
+    store = read_chart_csv(file_name)
+    fast_time = time() - start_time
+    print "Fast reader: {} charts in {} seconds".format(len(store), fast_time)
+
+    start_time = time()
+    df = pd.read_csv(file_name)
+    meta = df.pop('meta')
+    df = df.applymap(literal_eval)
+    slow_time = time() - start_time
+    print "Old reader: {} charts in {} seconds".format(len(df), slow_time)
+
+    old = np.array(df.values.tolist(), dtype=np.float64)
+    print "Same prices: {}".format(np.array_equal(old, store.ohlc))
+    print "Same meta: {}".format(
+        meta_from_dicts(meta)[META_COLUMNS].equals(store.meta[META_COLUMNS]))
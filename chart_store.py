@@ -0,0 +1,550 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# CLASS FILE: chart_store.py
+# USAGE: from chart_store import ChartStore
+# DESCR: A dataframe full of CandleStick objects is 85 python objects per chart,
+#        which for the full 315,000 chart set is way to many objects to hold
+#        or pickle. This holds every chart in one (n_charts, 85, 4) float
+#        array of [open, high, low, close] plus a small typed meta table, and
+#        can still hand back CandleSticks when older code wants them.
+# CREATION DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, ChartStore class and meta parsing
+#                    - Can give back flattened float dataframe
+#                    - Save/open as memory mapped .npy plus meta sidecar, day
+#                      split views that never copy
+#                    - DatasetWriter to fill a dataset a chunk at a time
+#                    - ohlc_to_candles / candles_to_ohlc convert whole arrays
+#                      to and from CandleSticks in one pass
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+from candlestick import CandleStick
+from ast import literal_eval
+from operator import attrgetter
+import numpy as np
+import pandas as pd
+import json
+import gc
+import os
+
+# CONSTANT SECTION
+CANDLES_IN_DAY = 79
+NUM_OF_NEXT_DAY_TO_KEEP = 6
+CANDLES_IN_CHART = CANDLES_IN_DAY + NUM_OF_NEXT_DAY_TO_KEEP
+
+# Index of each price along the last axis of an ohlc array
+OPEN, HIGH, LOW, CLOSE = 0, 1, 2, 3
+FIELDS = ['open_price', 'high', 'low', 'close_price']
+
+# Meta table columns and the type each one is stored as
+META_COLUMNS = ['symbol', 'year', 'first_day', 'second_day']
+META_DTYPES = {'symbol': object, 'year': np.int64,
+               'first_day': object, 'second_day': object}
+
+# Dataset directory layout, ohlc array is memory mapped on open
+DATASET_EXT = '.charts'
+OHLC_FILE = 'ohlc.npy'
+META_FILE = 'meta.csv'
+INFO_FILE = 'info.json'
+
+
+# FUNCTION SECTION
+def float_columns(n_candles=CANDLES_IN_CHART):
+    """
+    DESCR: column names of a flattened chart, same as
+           flatten_candle_df_to_float_df makes ('0_o', '0_h', '0_l', '0_c', ...)
+    INPUT:
+        n_candles - int - candles in a chart
+    OUTPUT:
+        cols - list of str
+    """
+    suffixes = ['_o', '_h', '_l', '_c']
+    return [str(x) + suffix for x in range(n_candles) for suffix in suffixes]
+
+
+def empty_meta(n_charts):
+    """
+    DESCR: meta table with the proper columns but nothing filled in
+    INPUT:
+        n_charts - int - number of rows
+    OUTPUT:
+        meta - dataframe - (n_charts, 4) of missing values
+    """
+    meta = pd.DataFrame(index=range(n_charts), columns=META_COLUMNS)
+    meta['year'] = -1
+    return meta
+
+
+def meta_from_dicts(dicts):
+    """
+    DESCR: turn the meta dicts written by pull_all_data into a typed table
+    INPUT:
+        dicts - list like of dicts or their string form - one per chart
+    OUTPUT:
+        meta - dataframe - columns of META_COLUMNS
+    """
+    dicts = [literal_eval(d) if isinstance(d, basestring) else d for d in dicts]
+    meta = pd.DataFrame(list(dicts), columns=META_COLUMNS)
+    meta['year'] = pd.to_numeric(meta['year'], errors='coerce')
+    meta['year'] = meta['year'].fillna(-1).astype(META_DTYPES['year'])
+
+    return meta
+
+
+def ohlc_to_candles(ohlc):
+    """
+    DESCR: CandleStick for every candle of an ohlc array. Garbage collection
+           is paused while they are made, otherwise it rescans the growing
+           pile of new objects over and over and takes most of the time
+    INPUT:
+        ohlc - array - (..., 4) prices
+    OUTPUT:
+        candles - array - object array of CandleSticks, shape ohlc.shape[:-1]
+    """
+    ohlc = np.asarray(ohlc)
+    candles = np.empty(ohlc.shape[:-1], dtype=object)
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        candles.ravel()[:] = [CandleStick(*candle) for candle in
+                              ohlc.reshape(-1, 4).tolist()]
+    finally:
+        if enabled:
+            gc.enable()
+    return candles
+
+
+def candles_to_ohlc(candles):
+    """
+    DESCR: prices back out of an array like of CandleSticks, the reverse of
+           ohlc_to_candles
+    INPUT:
+        candles - array like - of CandleSticks, any shape
+    OUTPUT:
+        ohlc - array - float prices, shape candles.shape + (4,)
+    """
+    candles = np.asarray(candles, dtype=object)
+    prices = map(attrgetter(*FIELDS), candles.ravel())
+    return np.array(prices, dtype=np.float64).reshape(candles.shape + (4,))
+
+
+# CLASS SECTION
+class ChartStore(object):
+    """
+    DESCR: holds many charts as one contiguous float array. ohlc[i, j] is the
+           [open, high, low, close] of candle j in chart i, and meta.iloc[i] is
+           the info about chart i
+    """
+
+    def __init__(self, ohlc, meta=None):
+        """
+        DESCR: initialize a new store around an existing array
+        INPUT:
+            ohlc - array like - (n_charts, n_candles, 4) prices
+            meta - dataframe - one row per chart, optional
+        OUTPUT: None
+        """
+        ohlc = np.asarray(ohlc)
+        if ohlc.dtype != np.float64:
+            ohlc = ohlc.astype(np.float64)
+        if ohlc.ndim != 3 or ohlc.shape[2] != 4:
+            raise ValueError("ohlc should be shape (n_charts, n_candles, 4), "
+                             "got {}".format(ohlc.shape))
+        if meta is None:
+            meta = empty_meta(ohlc.shape[0])
+        if len(meta) != ohlc.shape[0]:
+            raise ValueError("meta has {} rows but there are {} charts".format(
+                             len(meta), ohlc.shape[0]))
+
+        self.ohlc = ohlc
+        self.meta = meta.reset_index(drop=True)
+
+    def __len__(self):
+        return self.ohlc.shape[0]
+
+    def __str__(self):
+        """
+        DESCR: Pretty representation of store
+        """
+        return "ChartStore: {} charts of {} candles".format(self.n_charts,
+                                                            self.n_candles)
+
+    def __getitem__(self, key):
+        """
+        DESCR: Allows store[5:10] or store[mask], slices give views of ohlc
+        """
+        if isinstance(key, (int, np.integer)):
+            key = slice(key, key + 1 if key != -1 else None)
+        if isinstance(key, slice):
+            meta = self.meta.iloc[key]
+        else:
+            meta = self.meta.iloc[np.arange(len(self))[key]]
+        return ChartStore(self.ohlc[key], meta)
+
+    @property
+    def n_charts(self):
+        return self.ohlc.shape[0]
+
+    @property
+    def n_candles(self):
+        return self.ohlc.shape[1]
+
+    @property
+    def opens(self):
+        return self.ohlc[:, :, OPEN]
+
+    @property
+    def highs(self):
+        return self.ohlc[:, :, HIGH]
+
+    @property
+    def lows(self):
+        return self.ohlc[:, :, LOW]
+
+    @property
+    def closes(self):
+        return self.ohlc[:, :, CLOSE]
+
+    def candle(self, row, ind):
+        """
+        DESCR: single candle as a CandleStick
+        INPUT:
+            row - int - chart number
+            ind - int - candle in the chart
+        OUTPUT:
+            candle - CandleStick
+        """
+        open_price, high, low, close_price = self.ohlc[row, ind].tolist()
+        return CandleStick(open_price, high, low, close_price)
+
+    def chart(self, row):
+        """
+        DESCR: one chart as a series of CandleSticks, same as a row of the old
+               candle dataframe so it can go straight to build_candle_chart
+        INPUT:
+            row - int - chart number
+        OUTPUT:
+            chart - series - n_candles CandleSticks
+        """
+        candles = [CandleStick(*candle) for candle in self.ohlc[row].tolist()]
+        return pd.Series(candles, index=[str(x) for x in range(len(candles))])
+
+    def to_candle_df(self):
+        """
+        DESCR: back to the old dataframe full of CandleSticks
+        INPUT: None
+        OUTPUT:
+            df - dataframe - (n_charts, n_candles) of CandleSticks
+        """
+        return pd.DataFrame(ohlc_to_candles(self.ohlc),
+                            columns=[str(x) for x in range(self.n_candles)])
+
+    def to_float_df(self):
+        """
+        DESCR: flattened dataframe with 4 float columns per candle, built
+               straight from the array so no CandleSticks are made
+        INPUT: None
+        OUTPUT:
+            df - dataframe - (n_charts, n_candles * 4) of floats
+        """
+        flat = self.ohlc.reshape(self.n_charts, -1)
+        return pd.DataFrame(flat, columns=float_columns(self.n_candles))
+
+    def first_day(self):
+        """
+        DESCR: view of the day candles, no copy made
+        OUTPUT:
+            ohlc - array - (n_charts, CANDLES_IN_DAY, 4)
+        """
+        return self.ohlc[:, :CANDLES_IN_DAY, :]
+
+    def next_morning(self):
+        """
+        DESCR: view of the next morning candles, no copy made
+        OUTPUT:
+            ohlc - array - (n_charts, NUM_OF_NEXT_DAY_TO_KEEP, 4)
+        """
+        return self.ohlc[:, CANDLES_IN_DAY:, :]
+
+    def flat(self, start=0, end=None):
+        """
+        DESCR: 2d float matrix of candles start to end, a view whenever ohlc
+               is c contiguous (always true for arrays this repo makes)
+        INPUT:
+            start - int - first candle
+            end - int - candle to stop before, None for all
+        OUTPUT:
+            X - array - (n_charts, (end - start) * 4)
+        """
+        chunk = self.ohlc[:, start:end, :]
+        return chunk.reshape(self.n_charts, -1)
+
+    def day_split(self):
+        """
+        DESCR: same split as helper_functions.day_split, first day as X and
+               next morning as y, both views of the store array
+        OUTPUT:
+            X - array - (n_charts, CANDLES_IN_DAY * 4)
+            y - array - (n_charts, NUM_OF_NEXT_DAY_TO_KEEP * 4)
+        """
+        return self.flat(0, CANDLES_IN_DAY), self.flat(CANDLES_IN_DAY)
+
+    def copy(self):
+        """
+        DESCR: deep copy, needed before in place transforms on a view
+        """
+        return ChartStore(self.ohlc.copy(), self.meta.copy())
+
+    @classmethod
+    def from_lists(cls, charts, meta=None):
+        """
+        DESCR: build from nested lists [[[o,h,l,c], ...], ...] like pull_chart
+               gives back
+        INPUT:
+            charts - list - one list of candles per chart
+            meta - list of dicts or dataframe - optional
+        OUTPUT:
+            store - ChartStore
+        """
+        ohlc = np.array(charts, dtype=np.float64)
+        if ohlc.ndim != 3:
+            ohlc = ohlc.reshape(len(charts), -1, 4)
+        if meta is not None and not isinstance(meta, pd.DataFrame):
+            meta = meta_from_dicts(meta)
+        return cls(ohlc, meta)
+
+    @classmethod
+    def from_candle_df(cls, df, meta=None):
+        """
+        DESCR: build from the old dataframe full of CandleSticks
+        INPUT:
+            df - dataframe - (n_charts, n_candles) of CandleSticks
+            meta - series of dicts or dataframe - optional
+        OUTPUT:
+            store - ChartStore
+        """
+        if meta is not None and not isinstance(meta, pd.DataFrame):
+            meta = meta_from_dicts(meta)
+        return cls(candles_to_ohlc(df.values), meta)
+
+    @classmethod
+    def concat(cls, stores):
+        """
+        DESCR: stack several stores into one
+        INPUT:
+            stores - list of ChartStore
+        OUTPUT:
+            store - ChartStore
+        """
+        ohlc = np.concatenate([store.ohlc for store in stores], axis=0)
+        meta = pd.concat([store.meta for store in stores], ignore_index=True)
+        return cls(ohlc, meta)
+
+
+# DATASET SECTION
+def save_dataset(store, path, flags=None):
+    """
+    DESCR: write a store to a dataset directory that open_dataset can map
+    INPUT:
+        store - ChartStore - charts to save
+        path - str - directory to write, DATASET_EXT added if missing
+        flags - list of str - transforms done to the charts, kept in info
+    OUTPUT:
+        path - str - directory written
+    """
+    if not path.endswith(DATASET_EXT):
+        path = path + DATASET_EXT
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    np.save(os.path.join(path, OHLC_FILE), np.ascontiguousarray(store.ohlc))
+    store.meta.to_csv(os.path.join(path, META_FILE), index=False)
+    write_info(path, store.n_charts, store.n_candles, flags)
+
+    return path
+
+
+def write_info(path, n_charts, n_candles, flags=None):
+    """
+    DESCR: write the small json of what is in a dataset directory
+    INPUT:
+        path - str - dataset directory
+        n_charts - int
+        n_candles - int
+        flags - list of str - transforms done to the charts
+    OUTPUT: None
+    """
+    info = {'n_charts': n_charts,
+            'n_candles': n_candles,
+            'flags': flags or []}
+    with open(os.path.join(path, INFO_FILE), 'w') as f:
+        json.dump(info, f)
+
+
+def read_info(path):
+    """
+    DESCR: read back the json written by write_info
+    """
+    with open(os.path.join(path, INFO_FILE), 'r') as f:
+        return json.load(f)
+
+
+def read_meta(path):
+    """
+    DESCR: read the meta sidecar of a dataset directory with proper types
+    """
+    dtypes = {'symbol': str, 'first_day': str, 'second_day': str,
+              'year': META_DTYPES['year']}
+    return pd.read_csv(os.path.join(path, META_FILE), dtype=dtypes,
+                       keep_default_na=False)
+
+
+def open_dataset(path, mmap_mode='r'):
+    """
+    DESCR: open a dataset directory, the ohlc array is memory mapped so this
+           is near instant and pages are shared between processes
+    INPUT:
+        path - str - directory written by save_dataset
+        mmap_mode - str - 'r', 'r+', 'c' or None to read fully into memory
+    OUTPUT:
+        store - ChartStore
+    """
+    if not os.path.isdir(path) and os.path.isdir(path + DATASET_EXT):
+        path = path + DATASET_EXT
+    ohlc = np.load(os.path.join(path, OHLC_FILE), mmap_mode=mmap_mode)
+
+    return ChartStore(ohlc, read_meta(path))
+
+
+class DatasetWriter(object):
+    """
+    DESCR: fills in a dataset directory a chunk at a time, the ohlc array is
+           created full size on disk up front so memory stays flat no matter
+           how many charts are written
+    """
+
+    def __init__(self, path, n_charts, n_candles=CANDLES_IN_CHART, flags=None):
+        """
+        DESCR: create the directory, empty ohlc file and meta header
+        INPUT:
+            path - str - directory to write, DATASET_EXT added if missing
+            n_charts - int - total charts that will be written
+            n_candles - int - candles per chart
+            flags - list of str - transforms done to the charts, kept in info
+        OUTPUT: None
+        """
+        if not path.endswith(DATASET_EXT):
+            path = path + DATASET_EXT
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.path = path
+        self.n_charts = n_charts
+        self.n_candles = n_candles
+        self.flags = flags
+        self.n_written = 0
+        self.ohlc = np.lib.format.open_memmap(os.path.join(path, OHLC_FILE),
+                                              mode='w+',
+                                              dtype=np.float64,
+                                              shape=(n_charts, n_candles, 4))
+        pd.DataFrame(columns=META_COLUMNS).to_csv(
+            os.path.join(path, META_FILE), index=False)
+
+    def write_ohlc(self, start, ohlc):
+        """
+        DESCR: put charts into the ohlc file at a given row, any order is fine
+        INPUT:
+            start - int - first row to fill
+            ohlc - array - (n, n_candles, 4) charts
+        OUTPUT: None
+        """
+        self.ohlc[start:start + ohlc.shape[0]] = ohlc
+        self.ohlc.flush()
+
+    def append_meta(self, meta):
+        """
+        DESCR: add rows to the meta sidecar, has to be called in row order
+        INPUT:
+            meta - dataframe - META_COLUMNS
+        OUTPUT: None
+        """
+        meta[META_COLUMNS].to_csv(os.path.join(self.path, META_FILE),
+                                  mode='a', header=False, index=False)
+
+    def write(self, store):
+        """
+        DESCR: add the next chunk of charts, ohlc and meta together
+        INPUT:
+            store - ChartStore - next charts in order
+        OUTPUT: None
+        """
+        if self.n_written + store.n_charts > self.n_charts:
+            raise ValueError("writing past the {} charts this dataset was "
+                             "made for".format(self.n_charts))
+        self.write_ohlc(self.n_written, store.ohlc)
+        self.append_meta(store.meta)
+        self.n_written += store.n_charts
+
+    def close(self):
+        """
+        DESCR: flush everything and write the info file
+        OUTPUT:
+            path - str - directory written
+        """
+        self.ohlc.flush()
+        del self.ohlc
+        write_info(self.path, self.n_charts, self.n_candles, self.flags)
+        return self.path
+
+
+def load_charts(path, mmap_mode='r'):
+    """
+    DESCR: load charts from either a dataset directory or an old dataframe
+           pickle (candles or flattened floats) made by clean_stock_stream
+    INPUT:
+        path - str - dataset directory or .pkl file
+        mmap_mode - str - passed to open_dataset
+    OUTPUT:
+        store - ChartStore
+    """
+    if os.path.isdir(path) or os.path.isdir(path + DATASET_EXT):
+        return open_dataset(path, mmap_mode)
+
+    df = pd.read_pickle(path)
+    if df.values.dtype == object:
+        return ChartStore.from_candle_df(df)
+    return ChartStore(df.values.reshape(df.shape[0], -1, 4))
+
+
+if __name__ == '__main__':
+    """
+    DESCR: Test code of chart store
+    """
+    charts = [[[10., 12., 9., 11.], [11., 11.5, 10., 10.5]],
+              [[20., 21., 19., 19.5], [19.5, 22., 19., 21.]]]
+    meta = ["{'first_day': '03/06', 'year': '2014', 'symbol': 'AAPL', "
+            "'second_day': '03/07'}",
+            {'first_day': '03/07', 'year': '2014', 'symbol': 'AAPL',
+             'second_day': '03/10'}]
+
+    store = ChartStore.from_lists(charts, meta)
+    print store
+    print store.meta
+    print store.meta.dtypes
+    print store.candle(1, 1)
+    print store.chart(0)
+
+    df = store.to_candle_df()
+    back = ChartStore.from_candle_df(df, store.meta)
+    print "Round trip equal: {}".format(np.array_equal(back.ohlc, store.ohlc))
+    print "Slice is view: {}".format(store[1:].ohlc.base is not None)
+
+    print "Dataset Test"
+    path = save_dataset(store, 'pickle_pile/store_test', flags=['-norm'])
+    opened = open_dataset(path)
+    print "Opened equal: {}".format(np.array_equal(opened.ohlc, store.ohlc))
+    print "Opened is memmap: {}".format(isinstance(opened.ohlc.base, np.memmap))
+    X, y = opened.day_split()
+    print "Split X is view: {}".format(np.may_share_memory(X, opened.ohlc))
+    print read_info(path)
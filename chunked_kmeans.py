@@ -0,0 +1,195 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: chunked_kmeans.py
+# USAGE: from chunked_kmeans import fit_minibatch, predict_chunked
+#        python chunked_kmeans.py <dataset> <num_clusters> [sample_size]
+# DESCR: Full KMeans on all 315k charts with 1000 clusters was being left to
+#        aws. This streams a memory mapped X through MiniBatchKMeans one chunk
+#        at a time, so X is never copied or even fully read into memory, and
+#        checks on a sample that the inertia is close to what full KMeans gets.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, chunked partial_fit, predict and inertia
+#                      parity check
+#                    - fit_minibatch can start from given centers
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.utils import check_random_state
+from time import time
+import numpy as np
+import sys
+
+# CONSTANT SECTION
+RANDOM_STATE = 42
+CHUNK_SIZE = 10000
+N_EPOCHS = 3
+INIT_SIZE_PER_CLUSTER = 3
+PARITY_SAMPLE = 20000
+
+
+# FUNCTION SECTION
+def iter_chunks(X, chunk_size=CHUNK_SIZE, order=None, transform=None):
+    """
+    DESCR: walk X a block of rows at a time, each block is a view
+    INPUT:
+        X - array - (n, n_features), usually memory mapped
+        chunk_size - int - rows per block
+        order - list of int - block numbers in the order wanted, default all
+        transform - function - applied to each block, ie weight_features
+    OUTPUT:
+        (start, chunk) - yielded - first row of block and the block
+    """
+    n_chunks = int(np.ceil(X.shape[0] / float(chunk_size)))
+    if order is None:
+        order = range(n_chunks)
+    for ind in order:
+        start = ind * chunk_size
+        chunk = X[start:start + chunk_size]
+        if transform is not None:
+            chunk = transform(chunk)
+        yield start, chunk
+
+
+def sample_rows(X, sample_size, random_state=RANDOM_STATE, transform=None):
+    """
+    DESCR: random rows of X, only the sample is read and copied
+    INPUT:
+        X - array - (n, n_features)
+        sample_size - int - rows wanted, all of X if bigger than X
+        random_state - int or RandomState
+        transform - function - applied to the sample
+    OUTPUT:
+        sample - array - (sample_size, n_features)
+        inds - array - rows taken, sorted
+    """
+    rng = check_random_state(random_state)
+    if sample_size >= X.shape[0]:
+        inds = np.arange(X.shape[0])
+    else:
+        inds = np.sort(rng.choice(X.shape[0], sample_size, replace=False))
+    sample = np.asarray(X[inds], dtype=np.float64)
+    if transform is not None:
+        sample = transform(sample)
+    return sample, inds
+
+
+def fit_minibatch(X, n_clusters, chunk_size=CHUNK_SIZE, n_epochs=N_EPOCHS,
+                  random_state=RANDOM_STATE, transform=None, verbose=0,
+                  init=None):
+    """
+    DESCR: MiniBatchKMeans fit by partial_fit over chunks of X. Centers start
+           from k-means++ on a random sample so the first chunk (often one
+           symbol) does not decide them, chunk order is shuffled every epoch
+    INPUT:
+        X - array - (n, n_features), memory mapped is fine
+        n_clusters - int
+        chunk_size - int - rows per partial_fit
+        n_epochs - int - passes over X
+        random_state - int
+        transform - function - applied to every chunk, ie weight_features
+        verbose - int - print progress if > 0
+        init - array - (n_clusters, n_features) starting centers, optional
+    OUTPUT:
+        cluster - MiniBatchKMeans - fitted, no labels_ yet
+    """
+    rng = check_random_state(random_state)
+    if init is None:
+        init_size = min(X.shape[0], max(INIT_SIZE_PER_CLUSTER * n_clusters,
+                                        chunk_size))
+        init_sample, _ = sample_rows(X, init_size, rng, transform)
+        init = KMeans(n_clusters=n_clusters, init='k-means++', n_init=1,
+                      max_iter=1,
+                      random_state=rng).fit(init_sample).cluster_centers_
+
+    cluster = MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=1,
+                              batch_size=chunk_size, compute_labels=False,
+                              random_state=rng)
+    n_chunks = int(np.ceil(X.shape[0] / float(chunk_size)))
+    for epoch in range(n_epochs):
+        start_time = time()
+        order = rng.permutation(n_chunks)
+        for _, chunk in iter_chunks(X, chunk_size, order, transform):
+            cluster.partial_fit(chunk)
+        if verbose:
+            print "   Epoch {} of {} in {:.1f}s".format(epoch + 1, n_epochs,
+                                                        time() - start_time)
+    return cluster
+
+
+def predict_chunked(cluster, X, chunk_size=CHUNK_SIZE, transform=None):
+    """
+    DESCR: nearest center of every row of X, a chunk at a time
+    INPUT:
+        cluster - fitted model with cluster_centers_
+        X - array - (n, n_features)
+        chunk_size - int
+        transform - function - applied to every chunk
+    OUTPUT:
+        labels - array - (n,) int32
+        inertia - float - sum of squared distances to nearest center
+    """
+    centers = cluster.cluster_centers_
+    center_norms = (centers ** 2).sum(axis=1)
+    labels = np.empty(X.shape[0], dtype=np.int32)
+    inertia = 0.0
+    for start, chunk in iter_chunks(X, chunk_size, transform=transform):
+        dists = euclidean_distances(chunk, centers, Y_norm_squared=center_norms,
+                                    squared=True)
+        chunk_labels = dists.argmin(axis=1)
+        labels[start:start + len(chunk)] = chunk_labels
+        inertia += dists[np.arange(len(chunk)), chunk_labels].sum()
+    return labels, inertia
+
+
+def inertia_parity(cluster, X, sample_size=PARITY_SAMPLE,
+                   random_state=RANDOM_STATE, transform=None, n_init=3):
+    """
+    DESCR: compare the streamed model against full KMeans fit on a sample of
+           X, both scored on that same sample
+    INPUT:
+        cluster - fitted model with cluster_centers_
+        X - array - (n, n_features)
+        sample_size - int - rows to compare on, at least 10 per cluster
+        random_state - int
+        transform - function - same one used to fit cluster
+        n_init - int - runs of full KMeans
+    OUTPUT:
+        parity - dict - 'minibatch', 'full' inertia, 'ratio' and 'sample_size'
+    """
+    n_clusters = cluster.cluster_centers_.shape[0]
+    sample, _ = sample_rows(X, max(sample_size, 10 * n_clusters), random_state,
+                            transform)
+    full = KMeans(n_clusters=n_clusters, init='k-means++', n_init=n_init,
+                  random_state=random_state).fit(sample)
+    _, streamed = predict_chunked(cluster, sample)
+    return {'minibatch': streamed, 'full': full.inertia_,
+            'ratio': streamed / full.inertia_, 'sample_size': len(sample)}
+
+
+if __name__ == '__main__':
+    """
+    DESCR: Fit a dataset in chunks and check parity
+    """
+    from chart_store import load_charts
+
+    store = load_charts(sys.argv[1])
+    num_clusters = int(sys.argv[2])
+    sample_size = int(sys.argv[3]) if len(sys.argv) > 3 else PARITY_SAMPLE
+    X, y = store.day_split()
+    print "X has shape {}".format(X.shape)
+
+    start_time = time()
+    cluster = fit_minibatch(X, num_clusters, verbose=1)
+    labels, inertia = predict_chunked(cluster, X)
+    print "Streamed fit and predict in {:.1f}s, inertia {:.4g}".format(
+          time() - start_time, inertia)
+
+    start_time = time()
+    parity = inertia_parity(cluster, X, sample_size)
+    print "Parity on {} rows in {:.1f}s: minibatch {:.4g}, full {:.4g}, " \
+          "ratio {:.3f}".format(parity['sample_size'], time() - start_time,
+                                parity['minibatch'], parity['full'],
+                                parity['ratio'])
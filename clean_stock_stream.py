@@ -3,7 +3,8 @@
 # FILE: clean_stock_streams.py
 # USAGE: python clean_stock_streams.py <data_path> <save_path> <norm_flag>
 #                                      <zero_flag> <lower_flag> <flatten>
-#                                      <meta_flag>
+#                                      <meta_flag> <pickle_flag>
+#                                      [--chunk-size N] [--workers N]
 # DESCR: Will perform desired alterations to conver csv stock data into a more
 #             usable format for modeling algorithms
 # START DATE: 10/9/16
@@ -16,22 +17,190 @@
 #           10/15/16 - Will load in given csv file and convert string data into
 #                      candles, then adjust end of day candle. Other processing
 #                      steps occur only if given flag is pass in command line
+#           10/18/26 - Charts held in a ChartStore and all transforms done as
+#                      batch array math instead of apply/applymap per cell
+#                    - csv read with chart_reader instead of literal_eval on
+#                      every cell
+#                    - Saves a memory mapped dataset directory by default,
+#                      old dataframe pickle only with -pickle
+#                    - --chunk-size N streams the csv through in chunks so
+#                      memory stays flat for any size input
+#                    - --workers N splits csv by byte range over a process
+#                      pool, each writing straight into the mapped output
 ###--------------------------------------------------------------------------###
 
 # IMPORT SECTION
 import pandas as pd
-from ast import literal_eval
 import cPickle as pickle
-from candlestick import CandleStick
+from chart_reader import read_chart_csv, iter_chart_chunks, count_chart_rows
+from chart_reader import split_byte_ranges, DEFAULT_CHUNK_SIZE
+from chart_store import save_dataset, DatasetWriter, DATASET_EXT, OHLC_FILE
+from multiprocessing import Pool
+import numpy as np
+import os
 import sys
-from helper_functions import end_of_day_adjust, zero_chart, normalize_chart
-from helper_functions import flatten_candle_df_to_float_df
+from helper_functions import end_of_day_adjust_batch, zero_charts
+from helper_functions import normalize_charts, shift_candles_to_zero
 from time import time
 
 # CONSTANT SECTION
-RECOGNIZED_FLAGS = ["-norm", "-zero", "-lower", "-flatten", "-meta"]
+RECOGNIZED_FLAGS = ["-norm", "-zero", "-lower", "-flatten", "-meta", "-pickle"]
+RECOGNIZED_OPTIONS = ["--chunk-size", "--workers"]
 
 # FUNCTION SECTION
+def parse_options(args):
+    """
+    DESCR: split command line args into plain flags and options with a value
+    INPUT:
+        args - list of str - everything after the data and save paths
+    OUTPUT:
+        flags - list of str - ie ["-norm", "-zero"]
+        options - dict - ie {"--chunk-size": 10000}
+    """
+    flags = []
+    options = {}
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in RECOGNIZED_OPTIONS:
+            options[arg] = int(args.pop(0))
+        else:
+            if arg not in RECOGNIZED_FLAGS:
+                print "{} not recognized".format(arg)
+            flags.append(arg)
+
+    return flags, options
+
+
+def clean_in_chunks(data_file, save_file, flags, chunk_size):
+    """
+    DESCR: read, transform and save a chunk of charts at a time so only one
+           chunk is ever held in memory
+    INPUT:
+        data_file - str - csv written by pull_all_data
+        save_file - str - dataset path to write
+        flags - list of str - command line flags
+        chunk_size - int - charts per chunk
+    OUTPUT:
+        n_charts - int - charts written
+    """
+    n_charts = count_chart_rows(data_file)
+    print "   {} charts to clean in chunks of {}".format(n_charts, chunk_size)
+
+    writer = DatasetWriter(save_file, n_charts, flags=flags)
+    for store in iter_chart_chunks(data_file, chunk_size):
+        writer.write(clean_charts(store, flags))
+        print "   Cleaned {} of {} charts".format(writer.n_written, n_charts)
+    writer.close()
+
+    return n_charts
+
+def clean_charts(store, flags):
+    """
+    DESCR: perform end of day adjust and any flagged transforms on a store,
+           the store array is altered in place
+    INPUT:
+        store - ChartStore - charts straight from csv
+        flags - list of str - command line flags
+    OUTPUT:
+        store - ChartStore - transformed charts
+    """
+    ohlc = store.ohlc
+
+    # Adjust end of day
+    end_of_day_adjust_batch(ohlc, in_place=True)
+
+    # Zero (Whole chart lowered by min(chart))
+    if "-zero" in flags:
+        zero_charts(ohlc, in_place=True)
+
+    # Normalize (Whole chart shifted from min-max to 0-100 scale)
+    if "-norm" in flags:
+        normalize_charts(ohlc, in_place=True)
+
+    # Lower (all candles low point moved to 0)
+    if "-lower" in flags:
+        shift_candles_to_zero(ohlc, in_place=True)
+
+    return store
+
+def count_byte_range(args):
+    """
+    DESCR: pool helper, charts in one byte range of the csv
+    INPUT:
+        args - tuple - (data_file, byte_range)
+    OUTPUT:
+        n_charts - int
+    """
+    data_file, byte_range = args
+    return count_chart_rows(data_file, byte_range)
+
+
+def clean_byte_range(args):
+    """
+    DESCR: pool helper, clean one byte range of the csv and write the charts
+           straight into the shared ohlc file at the given row
+    INPUT:
+        args - tuple - (data_file, dataset_path, byte_range, row, flags,
+                        chunk_size)
+    OUTPUT:
+        meta - dataframe - meta rows for this range, in order
+    """
+    data_file, dataset_path, byte_range, row, flags, chunk_size = args
+    ohlc = np.load(os.path.join(dataset_path, OHLC_FILE), mmap_mode='r+')
+
+    metas = []
+    for store in iter_chart_chunks(data_file, chunk_size, byte_range=byte_range):
+        store = clean_charts(store, flags)
+        ohlc[row:row + store.n_charts] = store.ohlc
+        row += store.n_charts
+        metas.append(store.meta)
+    ohlc.flush()
+
+    if not metas:
+        return None
+    return pd.concat(metas, ignore_index=True)
+
+
+def clean_in_parallel(data_file, save_file, flags, workers, chunk_size):
+    """
+    DESCR: split csv into byte ranges and clean them over a process pool, the
+           result is row for row the same as a single process run
+    INPUT:
+        data_file - str - csv written by pull_all_data
+        save_file - str - dataset path to write
+        flags - list of str - command line flags
+        workers - int - processes to use
+        chunk_size - int - charts per chunk within each process
+    OUTPUT:
+        n_charts - int - charts written
+    """
+    byte_ranges = split_byte_ranges(data_file, workers)
+    pool = Pool(processes=workers)
+    try:
+        # Count first so each range knows which row it starts at
+        counts = pool.map(count_byte_range,
+                          [(data_file, byte_range) for byte_range in byte_ranges])
+        rows = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(int)
+        n_charts = int(sum(counts))
+        print "   {} charts to clean over {} workers".format(n_charts, workers)
+
+        writer = DatasetWriter(save_file, n_charts, flags=flags)
+        jobs = [(data_file, writer.path, byte_range, row, flags, chunk_size)
+                for byte_range, row in zip(byte_ranges, rows)]
+        metas = pool.map(clean_byte_range, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    for meta in metas:
+        if meta is not None:
+            writer.append_meta(meta)
+    writer.n_written = n_charts
+    writer.close()
+
+    return n_charts
+
 
 # MAIN DRIVER CODE
 if __name__ == '__main__':
@@ -41,68 +210,84 @@ if __name__ == '__main__':
     try:
         data_file = sys.argv[1]
         save_file = sys.argv[2]
-        flags = []
-        if len(sys.argv) > 3:
-            flags = sys.argv[3:]
-            for flag in flags:
-                if flag not in RECOGNIZED_FLAGS:
-                    print "{} not recognized".format(flag)
+        flags, options = parse_options(sys.argv[3:])
     except Exception as e:
-        print "ERROR: Usage python clean_stock_streams.py <file_path> <save_path> <norm_flag> <zero_flag> <lower_flag> <flatten> <meta_flag>"
+        print "ERROR: Usage python clean_stock_streams.py <file_path> <save_path> <norm_flag> <zero_flag> <lower_flag> <flatten> <meta_flag> <pickle_flag> [--chunk-size N] [--workers N]"
         print "Exception: {}".format(e)
         sys.exit(-1)
 
+    # Split over processes, each streaming its own piece of the csv
+    if "--workers" in options:
+        if "-pickle" in flags:
+            print "-pickle needs whole data set in memory, ignored with --workers"
+        print "CLEANING WITH {} WORKERS.....".format(options["--workers"])
+        try:
+            clean_in_parallel(data_file, save_file, flags, options["--workers"],
+                              options.get("--chunk-size", DEFAULT_CHUNK_SIZE))
+        except Exception as e:
+            print "ERROR: problem cleaning with workers"
+            print "EXCEPTION: {}".format(e)
+            sys.exit(-2)
+        print "Saved altered charts as {}".format(save_file + DATASET_EXT)
+        print "Conversion time: {} seconds".format(time()-start_time)
+        sys.exit(0)
+
+    # Stream through in chunks, whole data set never in memory
+    if "--chunk-size" in options:
+        if "-pickle" in flags:
+            print "-pickle needs whole data set in memory, ignored with --chunk-size"
+        print "CLEANING IN CHUNKS....."
+        try:
+            clean_in_chunks(data_file, save_file, flags, options["--chunk-size"])
+        except Exception as e:
+            print "ERROR: problem cleaning in chunks"
+            print "EXCEPTION: {}".format(e)
+            sys.exit(-2)
+        print "Saved altered charts as {}".format(save_file + DATASET_EXT)
+        print "Conversion time: {} seconds".format(time()-start_time)
+        sys.exit(0)
+
     try:
         print "READING IN DATA....."
-        df = pd.read_csv(data_file)
-        print "   READ IN {} rows and {} columns".format(df.shape[0], df.shape[1])
+        store = read_chart_csv(data_file)
+        print "   READ IN {} charts of {} candles".format(store.n_charts,
+                                                        store.n_candles)
 
     except Exception as e:
         print "ERROR: problem on file open"
         print "EXCEPTION: {}".format(e)
         sys.exit(-2)
 
-    # Pop off the meta data column
-    print "Meta data column removed..."
-    meta = df.pop('meta')
-
-    # Convert to candles
-    print "Converting String data to candles..."
-    df = df.applymap(literal_eval)
-    df = df.applymap(lambda x: CandleStick(x[0], x[1], x[2], x[3]))
+    # Meta data kept apart from the chart array
+    meta = store.meta
 
-    # Adjust end of day and reshow
+    # Adjust end of day candle plus flagged transforms
     print "Adjusting end of candle..."
-    df = df.apply(func=end_of_day_adjust, axis=1)
+    for flag in ["-zero", "-norm", "-lower"]:
+        if flag in flags:
+            print "Applying {} to all charts...".format(flag)
+    store = clean_charts(store, flags)
 
-    # Zero (Whole chart lowered by min(chart))
-    if "-zero" in flags:
-        print "Zeroing all charts..."
-        df = df.apply(func=zero_chart, axis=1)
+    # Save as memory mappable dataset
+    print "Saving altered charts as {}".format(save_file + DATASET_EXT)
+    save_dataset(store, save_file, flags)
 
-    # Normalize (Whole chart shifted from min-max to 0-100 scale)
-    if "-norm" in flags:
-        print "Normalizing all charts..."
-        df = df.apply(func=normalize_chart, axis=1)
+    # Pickle altered data frame the old way
+    if "-pickle" in flags:
+        # Flatten (each candle o, h, l, c attributes expanded to own columns)
+        if "-flatten" in flags:
+            print "Flattening all columns to many colums..."
+            df = store.to_float_df()
+        else:
+            df = store.to_candle_df()
 
-    # Lower (all candles low point moved to 0)
-    if "-lower" in flags:
-        print "Lower all candles to zero..."
-        df = df.applymap(lambda x: x.shift_to_zero())
-
-    # Flatten (each candle o, h, l, c attributes expanded to own columns)
-    if "-flatten" in flags:
-        print "Flattening all columns to many colums..."
-        df = flatten_candle_df_to_float_df(df)
-
-    # Pickle altered data frame
-    print "Saving altered dataframe as {}".format(save_file + ".pkl")
-    df.to_pickle(save_file + ".pkl")
-
-    # Save meta data
-    if "-meta" in flags:
-        print "Saving metadata as {}".format(save_file + "_meta.pkl")
-        meta.to_pickle(save_file + "_meta.pkl")
+        print "Saving altered dataframe as {}".format(save_file + ".pkl")
+        df.to_pickle(save_file + ".pkl")
+
+        # Save meta data
+        if "-meta" in flags:
+            print "Saving metadata as {}".format(save_file + "_meta.pkl")
+            meta.to_pickle(save_file + "_meta.pkl")
 
     # Conversion time
     end_time = time()
@@ -7,6 +7,19 @@
 # CHANGE LOG: python cluster_attempt.py <data_pickle> <cluster_save_path>
 #                                       <num_clusters> -flags
 #           10/15/16 - initial attempt to try and cluster 340 feature data set
+#           10/18/26 - data loaded with load_charts so a memory mapped dataset
+#                      directory or an old pickle both work
+#                    - no extra copy of X after the split
+#                    - -minibatch streams mapped chunks through MiniBatchKMeans
+#                      and checks inertia against full KMeans on a sample
+#                    - metrics from cluster_metrics, rows grouped by label
+#                      once instead of twelve masked pdist passes
+#                    - -all runs a warm started K sweep over a process pool
+#                      and writes a results csv to <cluster_save_path>
+#                    - -dtw clusters by k-medoids under dynamic time warping
+#                      so patterns a candle or two apart still match
+#                    - -linkage builds a ward tree over micro clusters, saved
+#                      next to the pickle so any K can be cut later
 ###--------------------------------------------------------------------------###
 
 # IMPORT SECTION
@@ -16,14 +29,17 @@ import numpy as np
 import warnings
 import cPickle as pickle
 import sys
-from helper_functions import day_split
-from scipy.spatial.distance import pdist, cosine, euclidean
-from copy import copy
-from collections import Counter
+from chart_store import load_charts
+from chunked_kmeans import fit_minibatch, predict_chunked, inertia_parity
+from cluster_metrics import cluster_metrics, summarize_metrics
+from k_sweep import run_sweep
+from dtw import DTWKMedoids
+from linkage_clustering import LinkageClustering
+import os
 
 # CONSANT SECTION
 RANDOM_STATE = 42
-RECOGNIZED_FLAGS = ["-weight", "-all"]
+RECOGNIZED_FLAGS = ["-weight", "-all", "-minibatch", "-dtw", "-linkage"]
 
 # FUNCTION SECTION
 def weight_features(X, adjust=0.03):
@@ -40,7 +56,24 @@ def weight_features(X, adjust=0.03):
     weights.reverse()
     weights = np.array(weights)
 
-    return X.apply(axis=1, func=lambda x: x * weights)
+    return X * weights
+
+
+def print_summary(summary):
+    """
+    DESCR: print cluster quality numbers from cluster_metrics.summarize_metrics
+    """
+    print "                      SUMMARY                             "
+    print "      X_min    X_max    X_mean    y_min   y_max    x_mean"
+    print "euc:  {:8.4f} {:8.4f} {:8.4f} {:8.4f} {:8.4f} {:8.4f}    ".format(
+          summary['X_min_distance'], summary['X_max_distance'],
+          summary['X_mean_distance'], summary['y_min_distance'],
+          summary['y_max_distance'], summary['y_mean_distance'])
+    print "sim:  {:8.4f} {:8.4f} {:8.4f} {:8.4f} {:8.4f} {:8.4f}    ".format(
+          summary['X_min_sim'], summary['X_max_sim'], summary['X_mean_sim'],
+          summary['y_min_sim'], summary['y_max_sim'], summary['y_mean_sim'])
+    print "mean size: {}, min_size: {}, max_size: {}".format(
+          summary['mean_size'], summary['min_size'], summary['max_size'])
 
 
 if __name__ == '__main__':
@@ -63,19 +96,76 @@ if __name__ == '__main__':
 
     # Load in data
     print "Loading in data..."
-    df = pd.read_pickle(data_pickle)
-    print "   Data has shape: {}".format(df.shape)
+    store = load_charts(data_pickle)
+    print "   Data has shape: {}".format(store.ohlc.shape)
 
     # Split into cluster features and target day
     print "Data split to X and y"
-    X, y = day_split(df)
-    X_old = copy(X)
-
-    if "-weight" in flags:
+    X, y = store.day_split()
+
+    # Streamed fit weights a chunk at a time so X stays a mapped view, the
+    # sweep weights inside each worker
+    transform = None
+    if "-weight" in flags and "-minibatch" in flags:
+        transform = weight_features
+    elif "-weight" in flags and "-all" not in flags:
         print "Weighting Feature Matrix..."
         X = weight_features(X)
 
-    if "-all" not in flags:
+    if "-dtw" in flags and "-all" not in flags:
+        # Warping compares candles, so works on the unweighted charts
+        print "DTW k-medoids on candles..."
+        cluster = DTWKMedoids(n_clusters=num_clusters,
+                              random_state=RANDOM_STATE,
+                              verbose=1).fit(store.first_day())
+        print "   Cost: {:.4f}".format(cluster.inertia_)
+
+        print_summary(summarize_metrics(cluster_metrics(
+            X, y, cluster.labels_, num_clusters, large='sample',
+            transform=transform)))
+
+        # Save
+        pickle.dump(cluster, open(cluster_save_path, 'wb') )
+
+    elif "-linkage" in flags and "-all" not in flags:
+        print "Micro clusters then ward linkage..."
+        cluster = LinkageClustering(n_clusters=num_clusters,
+                                    random_state=RANDOM_STATE,
+                                    verbose=1).fit(X, transform=transform)
+
+        print_summary(summarize_metrics(cluster_metrics(
+            X, y, cluster.labels_, num_clusters, large='sample',
+            transform=transform)))
+
+        # Save, the tree can be cut at other K with LinkageClustering.load
+        tree_path = os.path.splitext(cluster_save_path)[0] + "_linkage.npz"
+        cluster.save(tree_path)
+        print "   Tree saved as {}".format(tree_path)
+        pickle.dump(cluster, open(cluster_save_path, 'wb') )
+
+    elif "-minibatch" in flags and "-all" not in flags:
+        print "Streaming chunks through MiniBatchKMeans..."
+        cluster = fit_minibatch(X, num_clusters, random_state=RANDOM_STATE,
+                                transform=transform, verbose=1)
+        cluster.labels_, cluster.inertia_ = predict_chunked(cluster, X,
+                                                            transform=transform)
+        print "   Inertia: {:.4f}".format(cluster.inertia_)
+
+        parity = inertia_parity(cluster, X, random_state=RANDOM_STATE,
+                                transform=transform)
+        print "   Parity on {} row sample: minibatch {:.4f}, full {:.4f}, " \
+              "ratio {:.3f}".format(parity['sample_size'], parity['minibatch'],
+                                    parity['full'], parity['ratio'])
+
+        # Big clusters are sampled so metrics stay cheaper than the fit
+        print_summary(summarize_metrics(cluster_metrics(
+            X, y, cluster.labels_, num_clusters, large='sample',
+            transform=transform)))
+
+        # Save
+        pickle.dump(cluster, open(cluster_save_path, 'wb') )
+
+    elif "-all" not in flags:
         # Initialize cluster object
         cluster = KMeans(n_clusters=num_clusters, init='k-means++', n_init=10,
                          max_iter=300, tol=0.0001, precompute_distances=True,
@@ -86,84 +176,19 @@ if __name__ == '__main__':
         cluster.fit(X)
 
         # Calc metrics
-        sizes = Counter(cluster.labels_)
-
-        X_mean_distance = np.mean([np.mean(pdist(X[cluster.labels_==i],euclidean)) if sizes[i] > 1 else 0 for i in range(num_clusters)])
-        X_max_distance = np.mean([max(pdist(X[cluster.labels_==i],euclidean)) if sizes[i] > 1 else 0 for i in range(num_clusters)])
-        X_min_distance = np.mean([np.min(pdist(X[cluster.labels_==i],euclidean)) if sizes[i] > 1 else 0 for i in range(num_clusters)])
-
-        X_mean_sim = np.mean([np.mean(pdist(X[cluster.labels_==i],cosine)) if sizes[i] > 1 else 0 for i in range(num_clusters)])
-        X_max_sim = np.mean([max(pdist(X[cluster.labels_==i],cosine)) if sizes[i] > 1 else 0 for i in range(num_clusters)])
-        X_min_sim = np.mean([min(pdist(X[cluster.labels_==i],cosine)) if sizes[i] > 1 else 0 for i in range(num_clusters)])
-
-        y_mean_distance = np.mean([np.mean(pdist(y[cluster.labels_==i],euclidean)) if sizes[i] > 1 else 0 for i in range(num_clusters)])
-        y_max_distance = np.mean([max(pdist(y[cluster.labels_==i],euclidean)) if sizes[i] > 1 else 0 for i in range(num_clusters)])
-        y_min_distance = np.mean([np.min(pdist(y[cluster.labels_==i],euclidean)) if sizes[i] > 1 else 0 for i in range(num_clusters)])
-
-        y_mean_sim = np.mean([np.mean(pdist(y[cluster.labels_==i],cosine)) if sizes[i] > 1 else 0 for i in range(num_clusters)])
-        y_max_sim = np.mean([max(pdist(y[cluster.labels_==i],cosine)) if sizes[i] > 1 else 0 for i in range(num_clusters)])
-        y_min_sim = np.mean([min(pdist(y[cluster.labels_==i],cosine)) if sizes[i] > 1 else 0 for i in range(num_clusters)])
-
-        min_size = min(sizes.values())
-        max_size = max(sizes.values())
-        mean_size = np.mean(sizes.values())
-
-        print "                      SUMMARY                             "
-        print "      X_min    X_max    X_mean    y_min   y_max    x_mean"
-        print "euc:  {:8.4f} {:8.4f} {:8.4f} {:8.4f} {:8.4f} {:8.4f}    ".format(X_min_distance, X_max_distance, X_mean_distance, y_min_distance, y_max_distance, y_mean_distance)
-        print "sim:  {:8.4f} {:8.4f} {:8.4f} {:8.4f} {:8.4f} {:8.4f}    ".format(X_min_sim, X_max_sim, X_mean_sim, y_min_sim, y_max_sim, y_mean_sim)
-        print "mean size: {}, min_size: {}, max_size: {}".format(mean_size, min_size, max_size)
+        summary = summarize_metrics(cluster_metrics(X, y, cluster.labels_,
+                                                    num_clusters))
+        print_summary(summary)
 
         # Save
         pickle.dump(cluster, open(cluster_save_path, 'wb') )
 
     else:
-        X_mean_distances = []
-        X_max_distances = []
-        X_min_distances = []
-        X_mean_sims = []
-        X_max_sims = []
-        X_min_sims = []
-        y_mean_distances = []
-        y_max_distances = []
-        y_min_distances = []
-        y_mean_sims = []
-        y_max_sims = []
-        y_min_sims = []
-        min_sizes = []
-        max_sizes = []
-        mean_sizes = []
-
-        for i in range(25,num_clusters,25):
-            # Initialize cluster object
-            print "K = {}".format(i)
-            cluster = KMeans(n_clusters=i, init='k-means++', n_init=10,
-                             max_iter=300, tol=0.0001, precompute_distances=True,
-                             verbose=0,random_state=RANDOM_STATE, copy_x=True,
-                             n_jobs=-1)
-
-            # Fit to feature matrix
-            cluster.fit(X)
-
-            # Calc metrics
-            sizes = Counter(cluster.labels_)
-
-            X_mean_distances.append(np.mean([np.mean(pdist(X[cluster.labels_==i],euclidean)) if sizes[i] > 1 else 0 for i in range(num_clusters)]))
-            X_max_distances.append(np.mean([max(pdist(X[cluster.labels_==i],euclidean)) if sizes[i] > 1 else 0 for i in range(num_clusters)]))
-            X_min_distances.append(np.mean([np.min(pdist(X[cluster.labels_==i],euclidean)) if sizes[i] > 1 else 0 for i in range(num_clusters)]))
-
-            X_mean_sims.append(np.mean([np.mean(pdist(X[cluster.labels_==i],cosine)) if sizes[i] > 1 else 0 for i in range(num_clusters)]))
-            X_max_sims.append(np.mean([max(pdist(X[cluster.labels_==i],cosine)) if sizes[i] > 1 else 0 for i in range(num_clusters)]))
-            X_min_sims.append(np.mean([min(pdist(X[cluster.labels_==i],cosine)) if sizes[i] > 1 else 0 for i in range(num_clusters)]))
-
-            y_mean_distances.append(np.mean([np.mean(pdist(y[cluster.labels_==i],euclidean)) if sizes[i] > 1 else 0 for i in range(num_clusters)]))
-            y_max_distances.append(np.mean([max(pdist(y[cluster.labels_==i],euclidean)) if sizes[i] > 1 else 0 for i in range(num_clusters)]))
-            y_min_distances.append(np.mean([np.min(pdist(y[cluster.labels_==i],euclidean)) if sizes[i] > 1 else 0 for i in range(num_clusters)]))
-
-            y_mean_sims.append(np.mean([np.mean(pdist(y[cluster.labels_==i],cosine)) if sizes[i] > 1 else 0 for i in range(num_clusters)]))
-            y_max_sims.append(np.mean([max(pdist(y[cluster.labels_==i],cosine)) if sizes[i] > 1 else 0 for i in range(num_clusters)]))
-            y_min_sims.append(np.mean([min(pdist(y[cluster.labels_==i],cosine)) if sizes[i] > 1 else 0 for i in range(num_clusters)]))
-
-            min_sizes.append(min(sizes.values()))
-            max_sizes.append(max(sizes.values()))
-            mean_sizes.append(np.mean(sizes.values()))
+        # Workers map the data themselves, nothing big is sent to them
+        ks = range(25, num_clusters, 25)
+        results = run_sweep(data_pickle, ks, cluster_save_path,
+                            weight="-weight" in flags,
+                            minibatch="-minibatch" in flags,
+                            random_state=RANDOM_STATE)
+        print "Results for {} K values in {}".format(len(results),
+                                                     cluster_save_path)
@@ -0,0 +1,199 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: cluster_metrics.py
+# USAGE: from cluster_metrics import cluster_metrics, summarize_metrics
+# DESCR: Quality numbers of a clustering, the mean / min / max euclidean and
+#        cosine distance between charts in the same cluster, for both the
+#        first day (X) and next morning (y). Rows are grouped by label once
+#        and every cluster's rows are gathered once for all twelve numbers.
+#        Clusters too big for one pdist are done in blocks (exact) or on a
+#        random sample (estimate).
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, grouped metrics with blocked / sampled
+#                      fall back for big clusters
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+from scipy.spatial.distance import pdist, cdist
+from sklearn.utils import check_random_state
+import pandas as pd
+import numpy as np
+
+# CONSTANT SECTION
+RANDOM_STATE = 42
+METRICS = [('distance', 'euclidean'), ('sim', 'cosine')]
+STATS = ['mean', 'max', 'min']
+METRIC_COLUMNS = ['{}_{}_{}'.format(part, stat, name) for part in ['X', 'y']
+                  for name, _ in METRICS for stat in STATS]
+MAX_EXACT_SIZE = 2000
+BLOCK_SIZE = 500
+SAMPLE_SIZE = 2000
+LARGE_MODES = ['blocked', 'sample']
+
+
+# FUNCTION SECTION
+def group_rows(labels, n_clusters=None):
+    """
+    DESCR: row numbers of every cluster from one sort of the labels
+    INPUT:
+        labels - array - (n,) cluster of each row
+        n_clusters - int - clusters expected, default max label + 1
+    OUTPUT:
+        groups - list of arrays - sorted row numbers of cluster i at [i]
+    """
+    labels = np.asarray(labels)
+    if n_clusters is None:
+        n_clusters = labels.max() + 1 if len(labels) else 0
+    order = np.argsort(labels, kind='mergesort')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(labels,
+                                                        minlength=n_clusters))])
+    return [order[bounds[i]:bounds[i + 1]] for i in range(n_clusters)]
+
+
+def pair_stats(rows, metric):
+    """
+    DESCR: mean, max and min distance over every pair of rows
+    INPUT:
+        rows - array - (m, n_features), m > 1
+        metric - str - scipy metric name, ie 'euclidean'
+    OUTPUT:
+        (mean, max, min) - floats
+    """
+    dists = pdist(rows, metric)
+    return dists.mean(), dists.max(), dists.min()
+
+
+def blocked_pair_stats(rows, metric, block_size=BLOCK_SIZE):
+    """
+    DESCR: same numbers as pair_stats without holding every pair at once,
+           block_size rows against the rest at a time
+    INPUT:
+        rows - array - (m, n_features), m > 1
+        metric - str - scipy metric name
+        block_size - int - rows per block
+    OUTPUT:
+        (mean, max, min) - floats
+    """
+    total = 0.0
+    count = 0
+    high = -np.inf
+    low = np.inf
+    for start in range(0, len(rows) - 1, block_size):
+        end = min(start + block_size, len(rows))
+        dists = cdist(rows[start:end], rows[start + 1:], metric)
+
+        # Only pairs (a, b) with b after a, dists[a, c] is pair (a, start+1+c)
+        cols = np.arange(dists.shape[1])
+        dists = dists[cols[None, :] >= np.arange(end - start)[:, None]]
+        total += dists.sum()
+        count += len(dists)
+        high = max(high, dists.max())
+        low = min(low, dists.min())
+    return total / count, high, low
+
+
+def cluster_pair_stats(rows, metric, large='blocked', max_exact=MAX_EXACT_SIZE,
+                       sample_size=SAMPLE_SIZE, rng=None):
+    """
+    DESCR: pair stats of one cluster, picking how to do it by its size
+    INPUT:
+        rows - array - (m, n_features) rows of one cluster
+        metric - str - scipy metric name
+        large - str - 'blocked' for exact or 'sample' for an estimate when
+                m > max_exact
+        max_exact - int - biggest cluster done with a single pdist
+        sample_size - int - rows used by 'sample'
+        rng - RandomState - for 'sample'
+    OUTPUT:
+        (mean, max, min) - floats, all 0 for clusters of one or none
+    """
+    if len(rows) < 2:
+        return 0.0, 0.0, 0.0
+    if len(rows) <= max_exact:
+        return pair_stats(rows, metric)
+    if large == 'sample':
+        inds = rng.choice(len(rows), min(sample_size, len(rows)), replace=False)
+        return pair_stats(rows[np.sort(inds)], metric)
+    return blocked_pair_stats(rows, metric)
+
+
+def cluster_metrics(X, y, labels, n_clusters=None, large='blocked',
+                    max_exact=MAX_EXACT_SIZE, sample_size=SAMPLE_SIZE,
+                    random_state=RANDOM_STATE, transform=None):
+    """
+    DESCR: every quality number for every cluster
+    INPUT:
+        X - array - (n, n_x_features) first day
+        y - array - (n, n_y_features) next morning
+        labels - array - (n,) cluster of each row
+        n_clusters - int - default max label + 1
+        large - str - 'blocked' or 'sample', see cluster_pair_stats
+        max_exact - int - biggest cluster done with a single pdist
+        sample_size - int - rows per big cluster when sampling
+        random_state - int
+        transform - function - applied to each cluster's X rows, for when X
+                    was weighted a chunk at a time during the fit
+    OUTPUT:
+        metrics - dataframe - one row per cluster, 'size' and METRIC_COLUMNS
+    """
+    if large not in LARGE_MODES:
+        raise ValueError("large should be one of {}, got {}".format(
+                         LARGE_MODES, large))
+    rng = check_random_state(random_state)
+    X = np.asarray(X)
+    y = np.asarray(y)
+
+    rows = []
+    for inds in group_rows(labels, n_clusters):
+        row = [len(inds)]
+        for part in [X, y]:
+            part_rows = part[inds]
+            if transform is not None and part is X:
+                part_rows = transform(part_rows)
+            for _, metric in METRICS:
+                row.extend(cluster_pair_stats(part_rows, metric, large,
+                                              max_exact, sample_size, rng))
+        rows.append(row)
+
+    return pd.DataFrame(rows, columns=['size'] + METRIC_COLUMNS)
+
+
+def summarize_metrics(metrics):
+    """
+    DESCR: average every number over the clusters like cluster_attempt always
+           has (clusters of one count as 0), plus the cluster sizes
+    INPUT:
+        metrics - dataframe - from cluster_metrics
+    OUTPUT:
+        summary - dict - METRIC_COLUMNS plus mean_size, min_size, max_size
+    """
+    summary = metrics[METRIC_COLUMNS].mean().to_dict()
+    sizes = metrics['size'][metrics['size'] > 0]
+    summary['mean_size'] = sizes.mean()
+    summary['min_size'] = sizes.min()
+    summary['max_size'] = sizes.max()
+    return summary
+
+
+if __name__ == '__main__':
+    """
+    DESCR: Test code, blocked and sampled against a plain pdist
+    """
+    from time import time
+
+    rng = np.random.RandomState(0)
+    X = rng.rand(6000, 316)
+    y = rng.rand(6000, 24)
+    labels = np.concatenate([np.zeros(4000, int), rng.randint(1, 20, 2000)])
+
+    for large in LARGE_MODES:
+        start_time = time()
+        metrics = cluster_metrics(X, y, labels, large=large)
+        print "{}: {:.2f}s".format(large, time() - start_time)
+        print metrics.iloc[0][['size', 'X_mean_distance', 'X_max_distance',
+                               'X_min_distance', 'y_mean_sim']]
+
+    print "Plain pdist of cluster 0:"
+    print pair_stats(X[labels == 0], 'euclidean')
+    print summarize_metrics(metrics)
@@ -0,0 +1,325 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: cluster_report.py
+# USAGE: from cluster_report import run_report
+#        python cluster_report.py <dataset> <cluster_pickle> <out_dir>
+#                                 [-weight] [members] [workers]
+# DESCR: Batch version of visualize_clusters. Every cluster of a fitted model
+#        is drawn to its own png, no windows: the mean chart of the cluster
+#        on top of a handful of sampled members, with its size and what the
+#        next morning did (mean move from the prior close, gap fill rate).
+#        Labels and summaries are worked out once, then clusters go in
+#        batches to a process pool where each worker maps the dataset itself
+#        and draws with the Agg backend on one reused figure. An index.html
+#        contact sheet of every cluster, biggest first, links to the pngs.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, pooled Agg pngs of every cluster and an
+#                      html index
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.offsetbox import AnchoredText
+from chart_store import load_charts, read_info, DATASET_EXT
+from chart_store import CLOSE, CANDLES_IN_DAY
+from chart_plotter import build_candle_charts
+from chunked_kmeans import iter_chunks, CHUNK_SIZE
+from cluster_metrics import group_rows
+from forecaster import fit_labels, summarize_clusters
+from multiprocessing import Pool, cpu_count
+from scipy import sparse
+from time import time
+import cPickle as pickle
+import numpy as np
+import os
+import sys
+
+# CONSTANT SECTION
+RANDOM_STATE = 42
+N_MEMBERS = 10
+MEMBER_ALPHA = 0.25
+BATCH_SIZE = 25
+FIG_SIZE = (6, 4)
+DPI = 80
+THUMB_WIDTH = 240
+PNG_NAME = 'cluster_{:05d}.png'
+INDEX_NAME = 'index.html'
+
+# Filled once per pool worker by init_worker
+WORKER = {}
+
+
+# FUNCTION SECTION
+def dataset_flags(data_path):
+    """
+    DESCR: flags a dataset was made with, none for old pickles
+    INPUT:
+        data_path - str - dataset directory, with or without .charts
+    OUTPUT:
+        flags - list of str
+    """
+    for path in [data_path, data_path + DATASET_EXT]:
+        if os.path.isdir(path):
+            return read_info(path)['flags']
+    return []
+
+
+def model_labels(store, model, weight=False):
+    """
+    DESCR: cluster of every chart in the dataset the model was fit on
+    INPUT:
+        store - ChartStore
+        model - fitted cluster model
+        weight - bool - model was fit with cluster_attempt -weight
+    OUTPUT:
+        labels - array - (n,)
+        n_clusters - int
+    """
+    from cluster_attempt import weight_features
+
+    n_clusters = len(model.cluster_centers_)
+    if hasattr(model, 'cluster_features_'):
+        return fit_labels(model, store.first_day()), n_clusters
+    X, _ = store.day_split()
+    transform = weight_features if weight else None
+    return fit_labels(model, X, transform), n_clusters
+
+
+def mean_charts(ohlc, labels, n_clusters, chunk_size=CHUNK_SIZE):
+    """
+    DESCR: average chart of every cluster in one pass, in price space no
+           matter how the model weighted its features
+    INPUT:
+        ohlc - array - (n, n_candles, 4), memory mapped is fine
+        labels - array - (n,)
+        n_clusters - int
+        chunk_size - int
+    OUTPUT:
+        means - array - (n_clusters, n_candles, 4), nan for empty clusters
+    """
+    flat = ohlc.reshape(len(ohlc), -1)
+    sums = np.zeros((n_clusters, flat.shape[1]))
+    for start, chunk in iter_chunks(flat, chunk_size):
+        chunk_labels = labels[start:start + len(chunk)]
+        members = sparse.csr_matrix((np.ones(len(chunk)), (chunk_labels,
+                                     np.arange(len(chunk)))),
+                                    shape=(n_clusters, len(chunk)))
+        sums += members.dot(chunk)
+
+    sizes = np.bincount(labels, minlength=n_clusters).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / sizes[:, None]
+    return means.reshape((n_clusters,) + ohlc.shape[1:])
+
+
+def sample_members(labels, n_clusters, n_members=N_MEMBERS,
+                   random_state=RANDOM_STATE):
+    """
+    DESCR: a few random charts of every cluster
+    INPUT:
+        labels - array - (n,)
+        n_clusters - int
+        n_members - int - charts per cluster, all of a smaller cluster
+        random_state - int
+    OUTPUT:
+        members - list of arrays - chart rows of each cluster, sorted
+    """
+    rng = np.random.RandomState(random_state)
+    members = []
+    for inds in group_rows(labels, n_clusters):
+        if len(inds) > n_members:
+            inds = np.sort(rng.choice(inds, n_members, replace=False))
+        members.append(inds)
+    return members
+
+
+def cluster_text(cluster, size, move, n_gaps, fill_rate):
+    """
+    DESCR: caption of one cluster's chart
+    INPUT:
+        cluster - int
+        size - int - charts in the cluster
+        move - float - mean last kept close minus prior close
+        n_gaps - int - charts whose next open gapped
+        fill_rate - float - share of those gaps filled, nan if none
+    OUTPUT:
+        text - str
+    """
+    text = "Cluster {}, Size: {}\nNext morning move: {:+.2f}".format(
+           cluster, size, move)
+    if n_gaps:
+        text += "\nGaps filled: {:.0%} of {}".format(fill_rate, n_gaps)
+    return text
+
+
+def init_worker(data_path):
+    """
+    DESCR: pool initializer, map the dataset and make the one figure this
+           worker draws every cluster on
+    INPUT:
+        data_path - str - dataset directory or pickle
+    OUTPUT: none
+    """
+    WORKER['store'] = load_charts(data_path)
+    fig = Figure(figsize=FIG_SIZE)
+    FigureCanvasAgg(fig)
+    WORKER['fig'] = fig
+    WORKER['ax'] = fig.add_subplot(111)
+
+
+def draw_cluster(fig, ax, center, members, text, path):
+    """
+    DESCR: draw one cluster and save it, then take its artists back off so
+           the figure and its axis ticks can be reused for the next one
+    INPUT:
+        fig - matplotlib figure with an Agg canvas
+        ax - matplotlib axes object
+        center - array - (n_candles, 4) mean chart
+        members - array - (m, n_candles, 4) sampled member charts
+        text - str - caption
+        path - str - png to write
+    OUTPUT: none
+    """
+    # Limits start over from this cluster's prices, not the last one's
+    ax.ignore_existing_data_limits = True
+    artists = []
+    if len(members):
+        artists.extend(build_candle_charts(fig, ax, members, color='sec',
+                                           alpha=MEMBER_ALPHA))
+    artists.extend(build_candle_charts(fig, ax, center))
+    artists.append(ax.axvline(CANDLES_IN_DAY, color='gray', linestyle='--',
+                              linewidth=1))
+    artists.append(ax.add_artist(AnchoredText(text, loc=2,
+                                              prop={'size': 8})))
+    fig.savefig(path, dpi=DPI)
+    for artist in artists:
+        artist.remove()
+
+
+def draw_batch(job):
+    """
+    DESCR: pool worker, draw a batch of clusters to pngs
+    INPUT:
+        job - tuple - (out_dir, clusters) where clusters is a list of
+              (cluster, center, member rows, text)
+    OUTPUT:
+        done - list of int - clusters drawn
+    """
+    out_dir, clusters = job
+    store, fig, ax = WORKER['store'], WORKER['fig'], WORKER['ax']
+    done = []
+    for cluster, center, rows, text in clusters:
+        members = np.asarray(store.ohlc[rows])
+        draw_cluster(fig, ax, center, members, text,
+                     os.path.join(out_dir, PNG_NAME.format(cluster)))
+        done.append(cluster)
+    return done
+
+
+def write_index(out_dir, order, texts, title):
+    """
+    DESCR: contact sheet of every cluster as thumbnails linking to the pngs
+    INPUT:
+        out_dir - str
+        order - list of int - clusters in the order shown
+        texts - list of str - caption of every cluster
+        title - str
+    OUTPUT:
+        path - str - index written
+    """
+    cells = []
+    for cluster in order:
+        name = PNG_NAME.format(cluster)
+        caption = texts[cluster].replace("\n", "<br>")
+        cells.append('<div class="cell"><a href="{0}"><img src="{0}" '
+                     'width="{1}"></a><br>{2}</div>'.format(name, THUMB_WIDTH,
+                                                          caption))
+    path = os.path.join(out_dir, INDEX_NAME)
+    with open(path, 'w') as f:
+        f.write('<html><head><title>{0}</title><style>.cell {{display: '
+                'inline-block; vertical-align: top; margin: 4px; font: 11px '
+                'monospace;}}</style></head>\n<body><h3>{0}</h3>\n'
+                .format(title))
+        f.write("\n".join(cells))
+        f.write('\n</body></html>\n')
+    return path
+
+
+def run_report(data_path, model, out_dir, weight=False, n_members=N_MEMBERS,
+               workers=None, random_state=RANDOM_STATE):
+    """
+    DESCR: png of every cluster of a fitted model plus an index page
+    INPUT:
+        data_path - str - dataset directory (or old pickle) used in the fit
+        model - fitted cluster model with cluster_centers_
+        out_dir - str - directory for the pngs and index.html, made if needed
+        weight - bool - model was fit with cluster_attempt -weight
+        n_members - int - sampled member charts drawn under each mean
+        workers - int - processes, default cpu count
+        random_state - int
+    OUTPUT:
+        index_path - str
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    store = load_charts(data_path)
+    labels, n_clusters = model_labels(store, model, weight)
+    summary = summarize_clusters(store.ohlc, labels, n_clusters,
+                                 gaps="-lower" not in dataset_flags(data_path))
+    centers = mean_charts(store.ohlc, labels, n_clusters)
+    members = sample_members(labels, n_clusters, n_members, random_state)
+
+    texts = [cluster_text(i, summary['size'][i],
+                          summary['mean_move'][i, -1, CLOSE],
+                          summary['n_gaps'][i], summary['gap_fill_rate'][i])
+             for i in range(n_clusters)]
+    order = [i for i in np.argsort(-summary['size'], kind='mergesort')
+             if summary['size'][i]]
+    jobs = [(out_dir, [(i, centers[i], members[i], texts[i])
+                       for i in order[start:start + BATCH_SIZE]])
+            for start in range(0, len(order), BATCH_SIZE)]
+
+    workers = min(workers or cpu_count(), max(len(jobs), 1))
+    print "Drawing {} clusters in {} batches over {} workers".format(
+          len(order), len(jobs), workers)
+    if workers == 1:
+        init_worker(data_path)
+        for job in jobs:
+            draw_batch(job)
+    else:
+        pool = Pool(workers, init_worker, (data_path,))
+        try:
+            for _ in pool.imap_unordered(draw_batch, jobs):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+
+    title = "{} clusters of {} charts".format(len(order), len(labels))
+    return write_index(out_dir, order, texts, title)
+
+
+if __name__ == '__main__':
+    try:
+        data_path = sys.argv[1]
+        cluster_pickle = sys.argv[2]
+        out_dir = sys.argv[3]
+        weight = "-weight" in sys.argv[4:]
+        numbers = [int(arg) for arg in sys.argv[4:] if arg != "-weight"]
+    except:
+        print "ERROR Usage: python cluster_report.py <dataset> " \
+              "<cluster_pickle> <out_dir> [-weight] [members] [workers]"
+        sys.exit(-1)
+    n_members = numbers[0] if numbers else N_MEMBERS
+    workers = numbers[1] if len(numbers) > 1 else None
+
+    start_time = time()
+    model = pickle.load(open(cluster_pickle, 'rb'))
+    index_path = run_report(data_path, model, out_dir, weight, n_members,
+                            workers)
+    print "Report done in {:.1f}s, open {}".format(time() - start_time,
+                                                   index_path)
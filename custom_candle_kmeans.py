@@ -1,20 +1,33 @@
 ###--------------------------------------------------------------------------###
 # FILE: custom_candle_kmeans.py
 # AUTHOR: Robert Ranney
-# USAGE: tbd
+# USAGE: from custom_candle_kmeans import kmeans
+#        python custom_candle_kmeans.py <dataset> <num_clusters> [n_jobs]
 # DESCR: Attempt to create kmeans algorithm using candle stick objects as
 #        features.
 # START DATE: 10/15/16
 # CHANGE LOG:
 #           10/15/16 - File initiated, using sklearn kmeans as roadmap
+#           10/18/26 - fit implemented. Charts come in as (n, n_candles, 4)
+#                      ohlc and every candle is turned into level, body,
+#                      upper wick and lower wick, weighted per term and per
+#                      time of day, so distance is about candle shape instead
+#                      of 340 anonymous floats. Lloyd and a Hamerly bounded
+#                      'elkan', distances done in chunks over a thread pool
 ###--------------------------------------------------------------------------###
 
 # IMPORT SECTION
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+from scipy import sparse
 import numpy as np
 import numbers
 
 # CONSTANTS
-
+CHUNK_SIZE = 4096
+FEATURES = ['level', 'body', 'upper_wick', 'lower_wick']
+LEVEL, BODY, UPPER_WICK, LOWER_WICK = 0, 1, 2, 3
+ALGORITHMS = ['auto', 'full', 'elkan']
 
 
 # functions
@@ -34,11 +47,388 @@ def check_random_state(seed):
     raise ValueError('%r cannot be used to seed a numpy.random.RandomState'
                      ' instance' % seed)
 
+
+def to_ohlc(X):
+    """
+    DESCR: accept charts as (n, n_candles, 4) or flat (n, n_candles * 4)
+    INPUT:
+        X - array like
+    OUTPUT:
+        ohlc - array - (n, n_candles, 4) float64, a view when possible
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 2 and X.shape[1] % 4 == 0:
+        X = X.reshape(X.shape[0], -1, 4)
+    if X.ndim != 3 or X.shape[2] != 4:
+        raise ValueError("X should be (n, n_candles, 4) or (n, n_candles * 4), "
+                         "got {}".format(X.shape))
+    return X
+
+
+def candle_features(ohlc):
+    """
+    DESCR: every candle as [level, body, upper wick, lower wick]. Level is
+           the body middle, body is close - open (signed), wicks are how far
+           high / low reach past the body
+    INPUT:
+        ohlc - array - (..., 4) prices
+    OUTPUT:
+        features - array - (..., 4)
+    """
+    open_price = ohlc[..., 0]
+    high = ohlc[..., 1]
+    low = ohlc[..., 2]
+    close_price = ohlc[..., 3]
+    top = np.maximum(open_price, close_price)
+    bot = np.minimum(open_price, close_price)
+
+    features = np.empty(ohlc.shape, dtype=np.float64)
+    features[..., LEVEL] = (open_price + close_price) / 2
+    features[..., BODY] = close_price - open_price
+    features[..., UPPER_WICK] = high - top
+    features[..., LOWER_WICK] = bot - low
+    return features
+
+
+def candle_features_inverse(features):
+    """
+    DESCR: back to ohlc from candle_features, used for cluster centers
+    INPUT:
+        features - array - (..., 4)
+    OUTPUT:
+        ohlc - array - (..., 4)
+    """
+    open_price = features[..., LEVEL] - features[..., BODY] / 2
+    close_price = features[..., LEVEL] + features[..., BODY] / 2
+
+    ohlc = np.empty(features.shape, dtype=np.float64)
+    ohlc[..., 0] = open_price
+    ohlc[..., 1] = np.maximum(open_price, close_price) + features[..., UPPER_WICK]
+    ohlc[..., 2] = np.minimum(open_price, close_price) - features[..., LOWER_WICK]
+    ohlc[..., 3] = close_price
+    return ohlc
+
+
+def feature_scale(n_candles, level_weight=1.0, body_weight=1.0,
+                  wick_weight=1.0, time_weights=None):
+    """
+    DESCR: sqrt of the weights, so plain euclidean distance on scaled
+           features is the weighted candle distance
+               sum_t time_w[t] * (level_w dLevel^2 + body_w dBody^2 +
+                                  wick_w (dUpper^2 + dLower^2))
+    INPUT:
+        n_candles - int
+        level_weight, body_weight, wick_weight - float - per term weights
+        time_weights - array like - (n_candles,) weight of each candle,
+                       None for all the same
+    OUTPUT:
+        scale - array - (n_candles, 4)
+    """
+    terms = np.array([level_weight, body_weight, wick_weight, wick_weight],
+                     dtype=np.float64)
+    if time_weights is None:
+        time_weights = np.ones(n_candles)
+    time_weights = np.asarray(time_weights, dtype=np.float64)
+    if time_weights.shape != (n_candles,):
+        raise ValueError("time_weights should have {} values, got {}".format(
+                         n_candles, time_weights.shape))
+    if (terms < 0).any() or (time_weights < 0).any():
+        raise ValueError("weights can not be negative")
+    return np.sqrt(time_weights[:, None] * terms[None, :])
+
+
+def chunk_slices(n_rows, chunk_size=CHUNK_SIZE):
+    """
+    DESCR: row slices covering n_rows, chunk_size rows each
+    """
+    return [slice(start, min(start + chunk_size, n_rows))
+            for start in range(0, n_rows, chunk_size)]
+
+
+def squared_distances(Z, z_norms, centers, c_norms):
+    """
+    DESCR: squared euclidean distance of every row to every center
+    INPUT:
+        Z - array - (m, d) rows
+        z_norms - array - (m,) squared norms of rows
+        centers - array - (k, d)
+        c_norms - array - (k,) squared norms of centers
+    OUTPUT:
+        dists - array - (m, k), never below 0
+    """
+    dists = np.dot(Z, centers.T)
+    dists *= -2
+    dists += z_norms[:, None]
+    dists += c_norms[None, :]
+    np.maximum(dists, 0, out=dists)
+    return dists
+
+
+def map_chunks(func, n_rows, executor, chunk_size=CHUNK_SIZE):
+    """
+    DESCR: run func(slice) over chunks of rows, on the thread pool if given.
+           numpy lets go of the GIL in dot so threads do run at once
+    INPUT:
+        func - function - takes a row slice
+        n_rows - int
+        executor - ThreadPoolExecutor or None
+        chunk_size - int
+    OUTPUT:
+        results - list - func output per chunk in row order
+    """
+    slices = chunk_slices(n_rows, chunk_size)
+    if executor is None or len(slices) == 1:
+        return [func(rows) for rows in slices]
+    return list(executor.map(func, slices))
+
+
+def assign_labels(Z, z_norms, centers, executor=None, chunk_size=CHUNK_SIZE,
+                  second=False):
+    """
+    DESCR: closest center of every row, a chunk at a time so at most
+           chunk_size * k distances are held per thread
+    INPUT:
+        Z - array - (n, d)
+        z_norms - array - (n,)
+        centers - array - (k, d)
+        executor - ThreadPoolExecutor or None
+        chunk_size - int
+        second - bool - also give distance to second closest center
+    OUTPUT:
+        labels - array - (n,) int32
+        closest - array - (n,) squared distance to closest center
+        runner_up - array - (n,) squared distance to second closest, only
+                    when second is True
+    """
+    c_norms = (centers ** 2).sum(axis=1)
+
+    def assign_chunk(rows):
+        dists = squared_distances(Z[rows], z_norms[rows], centers, c_norms)
+        labels = dists.argmin(axis=1)
+        inds = np.arange(len(labels))
+        closest = dists[inds, labels]
+        if not second:
+            return labels, closest, None
+        if dists.shape[1] == 1:
+            return labels, closest, np.full(len(labels), np.inf)
+        dists[inds, labels] = np.inf
+        return labels, closest, dists.min(axis=1)
+
+    parts = map_chunks(assign_chunk, Z.shape[0], executor, chunk_size)
+    labels = np.concatenate([part[0] for part in parts]).astype(np.int32)
+    closest = np.concatenate([part[1] for part in parts])
+    if not second:
+        return labels, closest
+    return labels, closest, np.concatenate([part[2] for part in parts])
+
+
+def update_centers(Z, labels, n_clusters, closest):
+    """
+    DESCR: mean of every cluster's rows, an empty cluster takes the row that
+           is farthest from its center
+    INPUT:
+        Z - array - (n, d)
+        labels - array - (n,)
+        n_clusters - int
+        closest - array - (n,) distance of each row to its center, used to
+                  pick rows for empty clusters
+    OUTPUT:
+        centers - array - (n_clusters, d)
+        counts - array - (n_clusters,) rows per cluster
+    """
+    n_rows = Z.shape[0]
+    counts = np.bincount(labels, minlength=n_clusters)
+    members = sparse.csr_matrix((np.ones(n_rows), (labels, np.arange(n_rows))),
+                                shape=(n_clusters, n_rows))
+    centers = np.asarray(members.dot(Z))
+
+    empty = np.where(counts == 0)[0]
+    if len(empty):
+        far = np.argsort(closest)[::-1][:len(empty)]
+        centers[empty] = Z[far]
+        counts[empty] = 1
+        nonempty = np.setdiff1d(np.arange(n_clusters), empty)
+    else:
+        nonempty = slice(None)
+    centers[nonempty] /= counts[nonempty][:, None]
+    return centers, counts
+
+
+def kmeans_plusplus(Z, z_norms, n_clusters, rng, n_local_trials=None):
+    """
+    DESCR: greedy k-means++ seeding like sklearn, each new center is the best
+           of a few rows picked with probability of their distance squared
+    INPUT:
+        Z - array - (n, d)
+        z_norms - array - (n,)
+        n_clusters - int
+        rng - RandomState
+        n_local_trials - int - candidates per center, default 2 + log(k)
+    OUTPUT:
+        centers - array - (n_clusters, d)
+    """
+    n_rows = Z.shape[0]
+    if n_local_trials is None:
+        n_local_trials = 2 + int(np.log(n_clusters))
+
+    centers = np.empty((n_clusters, Z.shape[1]), dtype=np.float64)
+    first = rng.randint(n_rows)
+    centers[0] = Z[first]
+    closest = squared_distances(Z, z_norms, Z[first:first + 1],
+                                z_norms[first:first + 1])[:, 0]
+    potential = closest.sum()
+
+    for ind in range(1, n_clusters):
+        picks = rng.random_sample(n_local_trials) * potential
+        candidates = np.searchsorted(np.cumsum(closest), picks)
+        candidates = np.minimum(candidates, n_rows - 1)
+        dists = squared_distances(Z, z_norms, Z[candidates],
+                                  z_norms[candidates])
+        dists = np.minimum(dists, closest[:, None])
+        potentials = dists.sum(axis=0)
+        best = potentials.argmin()
+
+        centers[ind] = Z[candidates[best]]
+        closest = dists[:, best]
+        potential = potentials[best]
+    return centers
+
+
+def lloyd(Z, z_norms, centers, max_iter, tol, executor, chunk_size, verbose):
+    """
+    DESCR: plain Lloyd iterations, full distance pass every iteration
+    INPUT:
+        Z - array - (n, d) scaled features
+        z_norms - array - (n,)
+        centers - array - (k, d) starting centers
+        max_iter - int
+        tol - float - stop when total squared center shift is below
+        executor - ThreadPoolExecutor or None
+        chunk_size - int
+        verbose - int
+    OUTPUT:
+        centers - array - (k, d)
+        n_iter - int
+    """
+    n_clusters = centers.shape[0]
+    for n_iter in range(1, max_iter + 1):
+        labels, closest = assign_labels(Z, z_norms, centers, executor,
+                                        chunk_size)
+        new_centers, _ = update_centers(Z, labels, n_clusters, closest)
+        shift = ((new_centers - centers) ** 2).sum()
+        centers = new_centers
+        if verbose:
+            print "Iteration {}, inertia {}, shift {}".format(
+                  n_iter, closest.sum(), shift)
+        if shift <= tol:
+            break
+    return centers, n_iter
+
+
+def hamerly(Z, z_norms, centers, max_iter, tol, executor, chunk_size,
+            verbose):
+    """
+    DESCR: Lloyd with Hamerly's bounds (the cheap one bound cousin of Elkan).
+           Each row keeps an upper bound to its center and a lower bound to
+           every other center, and only rows whose bounds overlap get their
+           distances recomputed, which after the first few iterations is a
+           small part of the data
+    INPUT / OUTPUT: same as lloyd
+    """
+    n_clusters = centers.shape[0]
+    labels, upper, lower = assign_labels(Z, z_norms, centers, executor,
+                                         chunk_size, second=True)
+    upper = np.sqrt(upper)
+    lower = np.sqrt(lower)
+
+    for n_iter in range(1, max_iter + 1):
+        new_centers, _ = update_centers(Z, labels, n_clusters, upper ** 2)
+        moved = np.sqrt(((new_centers - centers) ** 2).sum(axis=1))
+        shift = (moved ** 2).sum()
+        centers = new_centers
+        if verbose:
+            print "Iteration {}, shift {}".format(n_iter, shift)
+        if shift <= tol:
+            break
+
+        # Centers moved, loosen bounds by how far. The lower bound is for
+        # other centers, so a row whose own center moved most uses the
+        # second biggest move
+        upper += moved[labels]
+        if n_clusters > 1:
+            order = np.argsort(moved)
+            other_moved = np.where(labels == order[-1], moved[order[-2]],
+                                   moved[order[-1]])
+            lower -= other_moved
+
+        # Half the distance to the nearest other center
+        c_norms = (centers ** 2).sum(axis=1)
+        between = np.sqrt(squared_distances(centers, c_norms, centers, c_norms))
+        np.fill_diagonal(between, np.inf)
+        half_gap = between.min(axis=1) / 2
+
+        bound = np.maximum(half_gap[labels], lower)
+        check = np.where(upper > bound)[0]
+        if not len(check):
+            continue
+
+        # Tighten upper bound, only rows still overlapping get a full pass
+        own = centers[labels[check]]
+        upper[check] = np.sqrt(np.maximum(
+            ((Z[check] - own) ** 2).sum(axis=1), 0))
+        check = check[upper[check] > bound[check]]
+        if not len(check):
+            continue
+        sub_labels, sub_upper, sub_lower = assign_labels(
+            Z[check], z_norms[check], centers, executor, chunk_size,
+            second=True)
+        labels[check] = sub_labels
+        upper[check] = np.sqrt(sub_upper)
+        lower[check] = np.sqrt(sub_lower)
+        if verbose:
+            print "   {} of {} rows recomputed".format(len(check), len(Z))
+    return centers, n_iter
+
+
 # class
 class kmeans(object):
+    """
+    DESCR: KMeans on candle shape. Takes charts as (n, n_candles, 4) ohlc (or
+           flat), works on weighted level / body / wick features and gives
+           back cluster_centers_ as ohlc candles
+    """
+
     def __init__(self, n_clusters=8, init='k-means++', n_init=10, max_iter=300,
                  tol=1e-4, precompute_distances='auto', verbose=0,
-                 random_state=None, copy_x=True, n_jobs=1, algorithm='auto'):
+                 random_state=None, copy_x=True, n_jobs=1, algorithm='auto',
+                 level_weight=1.0, body_weight=1.0, wick_weight=1.0,
+                 time_weights=None, chunk_size=CHUNK_SIZE):
+        """
+        DESCR: same arguments as sklearn KMeans plus the candle weights
+        INPUT:
+            n_clusters - int
+            init - 'k-means++', 'random' or array of starting centers as
+                   ohlc (n_clusters, n_candles, 4)
+            n_init - int - runs with different seeds, best inertia kept
+            max_iter - int - iterations per run
+            tol - float - relative to mean feature variance, like sklearn
+            precompute_distances - kept for sklearn compatibility, row norms
+                                   are always cached and distances always
+                                   done in chunks
+            verbose - int
+            random_state - int or RandomState
+            copy_x - kept for sklearn compatibility, X is never changed
+            n_jobs - int - threads for distance chunks, -1 for every cpu
+            algorithm - 'auto', 'full' (Lloyd) or 'elkan' (Hamerly bounds),
+                        auto picks elkan
+            level_weight - float - weight on where the candle sits
+            body_weight - float - weight on open to close
+            wick_weight - float - weight on each wick
+            time_weights - array like - (n_candles,) weight per candle,
+                           None for all the same
+            chunk_size - int - rows per distance block
+        OUTPUT: None
+        """
         self.n_clusters = n_clusters
         self.init = init
         self.max_iter = max_iter
@@ -50,33 +440,200 @@ class kmeans(object):
         self.copy_x = copy_x
         self.n_jobs = n_jobs
         self.algorithm = algorithm
+        self.level_weight = level_weight
+        self.body_weight = body_weight
+        self.wick_weight = wick_weight
+        self.time_weights = time_weights
+        self.chunk_size = chunk_size
 
     def _check_fit_data(self, X):
         """verfiy we have enough data ie samples > k"""
-        #** skleanr checks array here, will not do
+        X = to_ohlc(X)
         if X.shape[0] < self.n_clusters:
             raise ValueError("n_samples={} should be >= n_clusers={}".format(
                               X.shape[0], self.n_clusters))
+        if self.algorithm not in ALGORITHMS:
+            raise ValueError("algorithm should be one of {}, got {}".format(
+                             ALGORITHMS, self.algorithm))
         return X
 
     def _check_test_data(self, X):
-        #** skipping check array portion
-        n_samples, n_features = X.shape
-        expected_n_features = self.cluster_centers_.shape[1]
-        if  not n_features == expected_n_features:
-            raise ValueError("Incorrect number of features. "
-                             "Got {} features, expected {}".format(
-                             n_features, expected_n_features))
+        X = to_ohlc(X)
+        n_candles = X.shape[1]
+        expected_n_candles = self.cluster_centers_.shape[1]
+        if  not n_candles == expected_n_candles:
+            raise ValueError("Incorrect number of candles. "
+                             "Got {} candles, expected {}".format(
+                             n_candles, expected_n_candles))
         return X
 
+    def _scaled_features(self, X):
+        """
+        DESCR: weighted candle features of ohlc charts, flat and their norms
+        """
+        Z = candle_features(X)
+        Z *= self.scale_
+        Z = Z.reshape(X.shape[0], -1)
+        return Z, (Z ** 2).sum(axis=1)
+
+    def _executor(self):
+        """
+        DESCR: thread pool for n_jobs, None when running on one thread
+        """
+        n_jobs = cpu_count() if self.n_jobs in (None, -1) else self.n_jobs
+        if n_jobs < 0:
+            n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+        return ThreadPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+
+    def _init_centers(self, Z, z_norms, rng):
+        """
+        DESCR: starting centers in scaled feature space
+        """
+        if isinstance(self.init, basestring) and self.init == 'k-means++':
+            return kmeans_plusplus(Z, z_norms, self.n_clusters, rng)
+        if isinstance(self.init, basestring) and self.init == 'random':
+            rows = rng.choice(Z.shape[0], self.n_clusters, replace=False)
+            return Z[rows].copy()
+
+        init = to_ohlc(self.init)
+        if init.shape[0] != self.n_clusters:
+            raise ValueError("init has {} centers, n_clusters is {}".format(
+                             init.shape[0], self.n_clusters))
+        return (candle_features(init) * self.scale_).reshape(self.n_clusters, -1)
+
     def fit(self, X, y=None):
         """ Compute custom candle k_means clustering
-        X: array-like, shape=(n_samples, n_features)
+        X: array-like, shape=(n_samples, n_candles, 4) or
+           (n_samples, n_candles * 4)
         """
+        X = self._check_fit_data(X)
+        rng = check_random_state(self.random_state)
+        self.scale_ = feature_scale(X.shape[1], self.level_weight,
+                                    self.body_weight, self.wick_weight,
+                                    self.time_weights)
+        Z, z_norms = self._scaled_features(X)
+        tol = self.tol * Z.var(axis=0).mean()
+        run = lloyd if self.algorithm == 'full' else hamerly
+
+        # An array init is one fixed start, more runs would all be the same
+        n_init = self.n_init
+        if not isinstance(self.init, basestring):
+            n_init = 1
 
+        executor = self._executor()
+        try:
+            best = None
+            for _ in range(n_init):
+                centers = self._init_centers(Z, z_norms, rng)
+                centers, n_iter = run(Z, z_norms, centers, self.max_iter, tol,
+                                      executor, self.chunk_size, self.verbose)
+                labels, closest = assign_labels(Z, z_norms, centers, executor,
+                                                self.chunk_size)
+                inertia = closest.sum()
+                if best is None or inertia < best[2]:
+                    best = (centers, labels, inertia, n_iter)
+        finally:
+            if executor is not None:
+                executor.shutdown()
 
+        self.cluster_features_, self.labels_, self.inertia_, self.n_iter_ = best
+        self.cluster_centers_ = self._centers_to_ohlc(self.cluster_features_)
+        return self
+
+    def _centers_to_ohlc(self, centers):
+        """
+        DESCR: undo the scaling and candle features of centers
+        """
+        features = centers.reshape(self.n_clusters, -1, 4)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            features = np.where(self.scale_ > 0, features / self.scale_, 0)
+        return candle_features_inverse(features)
+
+    def _distances(self, X):
+        """
+        DESCR: squared distances of X to every center, chunked
+        """
+        X = self._check_test_data(X)
+        Z, z_norms = self._scaled_features(X)
+        c_norms = (self.cluster_features_ ** 2).sum(axis=1)
+        executor = self._executor()
+        try:
+            parts = map_chunks(lambda rows: squared_distances(
+                                   Z[rows], z_norms[rows],
+                                   self.cluster_features_, c_norms),
+                               Z.shape[0], executor, self.chunk_size)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return np.vstack(parts)
+
+    def predict(self, X):
+        """
+        DESCR: closest cluster of each chart
+        INPUT:
+            X - array - (n, n_candles, 4) or flat
+        OUTPUT:
+            labels - array - (n,)
+        """
+        X = self._check_test_data(X)
+        Z, z_norms = self._scaled_features(X)
+        executor = self._executor()
+        try:
+            labels, _ = assign_labels(Z, z_norms, self.cluster_features_,
+                                      executor, self.chunk_size)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return labels
+
+    def transform(self, X):
+        """
+        DESCR: candle distance of each chart to every cluster center
+        INPUT:
+            X - array - (n, n_candles, 4) or flat
+        OUTPUT:
+            dists - array - (n, n_clusters)
+        """
+        return np.sqrt(self._distances(X))
+
+    def fit_predict(self, X, y=None):
+        """
+        DESCR: fit and give back labels_
+        """
+        return self.fit(X).labels_
+
+    def fit_transform(self, X, y=None):
+        """
+        DESCR: fit and give back distances to every center
+        """
+        return self.fit(X).transform(X)
+
+    def score(self, X, y=None):
+        """
+        DESCR: minus the inertia of X on the fitted centers, like sklearn
+        """
+        return -self._distances(X).min(axis=1).sum()
 
 
 # DRIVER CODE
 if __name__ == '__main__':
-    pass
+    import sys
+    from time import time
+    from chart_store import load_charts
+
+    store = load_charts(sys.argv[1])
+    num_clusters = int(sys.argv[2])
+    n_jobs = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    X = store.first_day()
+    print "Clustering {} charts of {} candles".format(X.shape[0], X.shape[1])
+
+    # Later candles count more, like cluster_attempt -weight
+    time_weights = np.linspace(0.25, 1, X.shape[1])
+    for algorithm in ['full', 'elkan']:
+        start_time = time()
+        cluster = kmeans(n_clusters=num_clusters, n_init=1, random_state=42,
+                         algorithm=algorithm, n_jobs=n_jobs,
+                         time_weights=time_weights).fit(X)
+        print "{}: {:.2f}s, {} iterations, inertia {:.6g}".format(
+              algorithm, time() - start_time, cluster.n_iter_, cluster.inertia_)
+    print "Centers as candles: {}".format(cluster.cluster_centers_.shape)
@@ -0,0 +1,546 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: dtw.py
+# USAGE: from dtw import dtw, dtw_top_k, DTWKMedoids
+#        python dtw.py <dataset> [num_neighbours] [window] [num_candles]
+# DESCR: Dynamic time warping between candle charts, so a pattern that comes
+#        a candle or two early still matches. Charts are (n_candles, 4) ohlc,
+#        the cost of matching two candles is their squared ohlc distance and
+#        paths stay within a Sakoe-Chiba band of +- window candles. Many
+#        candidates are warped against one chart at once with numpy, and the
+#        cheap LB_Kim / LB_Keogh lower bounds plus early abandoning skip most
+#        of the work in top k search and in k-medoids assignment.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, banded batch dtw, lower bounds, top k
+#                      search and k-medoids
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+from sklearn.utils import check_random_state
+from chunked_kmeans import sample_rows
+from time import time
+import numpy as np
+import sys
+
+# CONSTANT SECTION
+RANDOM_STATE = 42
+WINDOW = 2
+BATCH_SIZE = 512
+CHUNK_SIZE = 4096
+MAX_ITER = 10
+SAMPLE_SIZE = 500
+N_CANDIDATES = 8
+
+
+# FUNCTION SECTION
+def to_charts(X):
+    """
+    DESCR: accept one chart or many, as ohlc or flat floats
+    INPUT:
+        X - array like - (n_candles, 4), (n, n_candles, 4) or (n, n_candles*4)
+    OUTPUT:
+        ohlc - array - (n, n_candles, 4) float64, a view when possible
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 2 and X.shape[1] == 4:
+        X = X[None]
+    elif X.ndim == 2:
+        X = X.reshape(X.shape[0], -1, 4)
+    if X.ndim != 3 or X.shape[2] != 4:
+        raise ValueError("charts should be (n, n_candles, 4), got "
+                         "{}".format(X.shape))
+    return X
+
+
+def envelope(chart, window=WINDOW):
+    """
+    DESCR: highest and lowest of every price within +- window candles, what
+           any banded path can line a candle up against
+    INPUT:
+        chart - array - (..., n_candles, 4)
+        window - int
+    OUTPUT:
+        upper, lower - arrays - same shape as chart
+    """
+    size = 2 * window + 1
+    axis = chart.ndim - 2
+    return maximum_filter1d(chart, size, axis=axis, mode='nearest'), \
+           minimum_filter1d(chart, size, axis=axis, mode='nearest')
+
+
+def lb_kim(X, chart):
+    """
+    DESCR: LB_Kim, every path starts on the first candles and ends on the
+           last ones so their costs are a lower bound
+    INPUT:
+        X - array - (n, n_candles, 4) candidates
+        chart - array - (n_candles, 4)
+    OUTPUT:
+        lb - array - (n,) squared
+    """
+    first = X[:, 0] - chart[0]
+    last = X[:, -1] - chart[-1]
+    return np.einsum('ij,ij->i', first, first) + \
+           np.einsum('ij,ij->i', last, last)
+
+
+def lb_keogh_rows(X, upper, lower):
+    """
+    DESCR: LB_Keogh for ohlc candles (LB_MV), how far each candidate candle
+           sits outside the chart's envelope, per candle
+    INPUT:
+        X - array - (n, n_candles, 4) candidates
+        upper, lower - arrays - (n_candles, 4) envelope of the chart
+    OUTPUT:
+        rows - array - (n, n_candles) squared, sum over candles is LB_Keogh
+    """
+    outside = np.maximum(X - upper, 0) + np.maximum(lower - X, 0)
+    return np.einsum('ijk,ijk->ij', outside, outside)
+
+
+def lower_bounds(X, chart, window=WINDOW, thresholds=None):
+    """
+    DESCR: LB_Kim then LB_Keogh of every candidate, Keogh only worked out for
+           candidates Kim did not already rule out
+    INPUT:
+        X - array - (n, n_candles, 4) candidates
+        chart - array - (n_candles, 4)
+        window - int
+        thresholds - float or array - (n,) candidates with a bound at or past
+                     this are ruled out, None to keep all
+    OUTPUT:
+        lb - array - (n,) squared, inf where ruled out by Kim
+        tails - array - (n, n_candles + 1) Keogh of candles i on, for early
+                abandoning, rows of ruled out candidates are 0
+    """
+    lb = lb_kim(X, chart)
+    keep = np.ones(len(X), dtype=bool) if thresholds is None else \
+           lb < thresholds
+    tails = np.zeros((len(X), X.shape[1] + 1))
+    if keep.any():
+        upper, lower = envelope(chart, window)
+        rows = lb_keogh_rows(X[keep], upper, lower)
+        tails[keep, :-1] = np.cumsum(rows[:, ::-1], axis=1)[:, ::-1]
+        lb[keep] = np.maximum(lb[keep], tails[keep, 0])
+    lb[~keep] = np.inf
+    return lb, tails
+
+
+def band_costs(X, chart, window=WINDOW):
+    """
+    DESCR: cost of lining candle i of every candidate with candle i + offset
+           of the chart, for every offset in the band
+    INPUT:
+        X - array - (n, n_candles, 4) candidates
+        chart - array - (n_candles, 4)
+        window - int
+    OUTPUT:
+        costs - array - (n, n_candles, 2 * window + 1) squared, offset -window
+                first, inf where i + offset is off the chart or a price is nan
+    """
+    n_candles = X.shape[1]
+    padded = np.full((n_candles + 2 * window, 4), np.inf)
+    padded[window:window + n_candles] = chart
+
+    costs = np.empty((X.shape[0], n_candles, 2 * window + 1))
+    with np.errstate(invalid='ignore'):
+        for offset in range(2 * window + 1):
+            diff = X - padded[offset:offset + n_candles]
+            costs[:, :, offset] = np.einsum('ijk,ijk->ij', diff, diff)
+    costs[np.isnan(costs)] = np.inf
+    return costs
+
+
+def dtw_batch(X, chart, window=WINDOW, thresholds=None, tails=None):
+    """
+    DESCR: banded dtw of many candidates against one chart at once. Row i of
+           the warping table is filled for every candidate together, and a
+           candidate is dropped as soon as its best cell in the row plus the
+           bound on its remaining candles reaches its threshold
+    INPUT:
+        X - array - (n, n_candles, 4) candidates
+        chart - array - (n_candles, 4)
+        window - int - Sakoe-Chiba band in candles
+        thresholds - float or array - (n,) give up on a candidate once it can
+                     not come in under this, None to never give up
+        tails - array - (n, n_candles + 1) from lower_bounds, tightens when
+                to give up
+    OUTPUT:
+        dists - array - (n,) squared dtw, inf for candidates given up on
+    """
+    n, n_candles = X.shape[:2]
+    width = 2 * window + 1
+    dists = np.full(n, np.inf)
+    if n == 0:
+        return dists
+    costs = band_costs(X, chart, window)
+    alive = np.arange(n)
+    if thresholds is not None:
+        thresholds = np.broadcast_to(np.asarray(thresholds, np.float64),
+                                     (n,)).copy()
+    if tails is None:
+        tails = np.zeros((n, n_candles + 1))
+
+    inf_col = np.full((n, 1), np.inf)
+    row = np.full((n, width), np.inf)
+    for i in range(n_candles):
+        cost = costs[:, i]
+        if i == 0:
+            # Every path starts on candle 0 of both, offset window
+            step = np.full(row.shape, np.inf)
+            step[:, window] = 0
+        else:
+            # Diagonal is the same offset a row up, up is one offset over
+            step = np.minimum(row, np.hstack([row[:, 1:], inf_col[:len(row)]]))
+        row = np.empty(row.shape)
+        row[:, 0] = cost[:, 0] + step[:, 0]
+        for offset in range(1, width):
+            row[:, offset] = cost[:, offset] + np.minimum(step[:, offset],
+                                                          row[:, offset - 1])
+
+        if thresholds is not None and i < n_candles - 1:
+            keep = row.min(axis=1) + tails[:, i + 1] < thresholds
+            if not keep.all():
+                alive, costs, row = alive[keep], costs[keep], row[keep]
+                thresholds, tails = thresholds[keep], tails[keep]
+                if not len(alive):
+                    return dists
+
+    dists[alive] = row[:, window]
+    return dists
+
+
+def dtw(a, b, window=WINDOW):
+    """
+    DESCR: banded dtw distance between two charts
+    INPUT:
+        a, b - arrays - (n_candles, 4) ohlc, same length
+        window - int
+    OUTPUT:
+        dist - float - square root of the summed squared candle costs
+    """
+    return np.sqrt(dtw_batch(to_charts(a), to_charts(b)[0], window)[0])
+
+
+def merge_top_k(best_d, best_i, dists, ids, k):
+    """
+    DESCR: keep the k smallest of two sets of (distance, id)
+    """
+    dists = np.concatenate([best_d, dists])
+    ids = np.concatenate([best_i, ids])
+    order = np.argsort(dists, kind='mergesort')[:k]
+    return dists[order], ids[order]
+
+
+def dtw_top_k(X, chart, k=10, window=WINDOW, chunk_size=CHUNK_SIZE,
+              batch_size=BATCH_SIZE, exclude=None):
+    """
+    DESCR: k charts of X closest to chart by dtw. X is read a chunk at a
+           time, candidates whose lower bound can not beat the current kth
+           best are skipped and the rest are warped in order of their bound
+    INPUT:
+        X - array - (n, n_candles, 4) or flat, memory mapped is fine
+        chart - array - (n_candles, 4)
+        k - int
+        window - int
+        chunk_size - int - rows of X read at once
+        batch_size - int - candidates warped together
+        exclude - int - row of X to leave out, ie chart's own row
+    OUTPUT:
+        dists - array - (k,) dtw distances, closest first
+        ids - array - (k,) rows of X
+        counts - dict - candidates 'total', 'kim' and 'keogh' ruled out,
+                 'warped' and 'abandoned'
+    """
+    chart = to_charts(chart)[0]
+    best_d = np.empty(0)
+    best_i = np.empty(0, dtype=np.int64)
+    counts = dict.fromkeys(['total', 'kim', 'keogh', 'warped', 'abandoned'], 0)
+
+    for start in range(0, len(X), chunk_size):
+        chunk = to_charts(X[start:start + chunk_size])
+        ids = np.arange(start, start + len(chunk))
+        if exclude is not None:
+            chunk, ids = chunk[ids != exclude], ids[ids != exclude]
+        kth = best_d[-1] if len(best_d) == k else np.inf
+        lb, tails = lower_bounds(chunk, chart, window, kth)
+        counts['total'] += len(chunk)
+        counts['kim'] += np.isinf(lb).sum()
+
+        order = np.argsort(lb, kind='mergesort')
+        order = order[np.isfinite(lb[order])]
+        for bstart in range(0, len(order), batch_size):
+            batch = order[bstart:bstart + batch_size]
+            kth = best_d[-1] if len(best_d) == k else np.inf
+            batch = batch[lb[batch] < kth]
+            if not len(batch):
+                break
+            dists = dtw_batch(chunk[batch], chart, window, kth, tails[batch])
+            counts['warped'] += len(batch)
+            counts['abandoned'] += np.isinf(dists).sum()
+            done = np.isfinite(dists)
+            best_d, best_i = merge_top_k(best_d, best_i, dists[done],
+                                         ids[batch][done], k)
+    counts['keogh'] = counts['total'] - counts['kim'] - counts['warped']
+    return np.sqrt(best_d), best_i, counts
+
+
+def dtw_to_medoids(X, medoids, window=WINDOW, batch_size=BATCH_SIZE):
+    """
+    DESCR: closest medoid of every chart by dtw. Each chart is first warped
+           against the medoid with its smallest lower bound, then only
+           against medoids whose bound beats its best so far, abandoning
+           early at that best
+    INPUT:
+        X - array - (n, n_candles, 4) charts
+        medoids - array - (k, n_candles, 4)
+        window - int
+        batch_size - int - charts warped together
+    OUTPUT:
+        labels - array - (n,) closest medoid
+        dists - array - (n,) squared dtw to it
+    """
+    X = to_charts(X)
+    lbs = np.empty((len(X), len(medoids)))
+    tails = []
+    for m, medoid in enumerate(medoids):
+        lbs[:, m], medoid_tails = lower_bounds(X, medoid, window)
+        tails.append(medoid_tails)
+
+    labels = lbs.argmin(axis=1)
+    best = np.full(len(X), np.inf)
+    for first in [True, False]:
+        for m, medoid in enumerate(medoids):
+            if first:
+                rows = np.where(labels == m)[0]
+            else:
+                rows = np.where((lbs[:, m] < best) & (labels != m))[0]
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                dists = dtw_batch(X[batch], medoid, window,
+                                  None if first else best[batch],
+                                  tails[m][batch])
+                better = dists < best[batch]
+                best[batch[better]] = dists[better]
+                labels[batch[better]] = m
+    return labels, best
+
+
+def assign_chunked(X, medoids, window=WINDOW, chunk_size=CHUNK_SIZE):
+    """
+    DESCR: dtw_to_medoids a chunk of X at a time so bounds stay small
+    """
+    labels = np.empty(len(X), dtype=np.int64)
+    dists = np.empty(len(X))
+    for start in range(0, len(X), chunk_size):
+        labels[start:start + chunk_size], dists[start:start + chunk_size] = \
+            dtw_to_medoids(X[start:start + chunk_size], medoids, window)
+    return labels, dists
+
+
+def init_medoids(X, n_clusters, window, rng, sample_size=SAMPLE_SIZE):
+    """
+    DESCR: k-medoids++ on a sample, each new medoid picked with chance
+           proportional to its squared dtw from the closest one so far
+    INPUT:
+        X - array - (n, n_candles, 4) charts
+        n_clusters - int
+        window - int
+        rng - RandomState
+        sample_size - int - rows picked from, at least 10 per cluster
+    OUTPUT:
+        medoids - array - (n_clusters,) rows of X
+    """
+    sample, inds = sample_rows(X, max(sample_size, 10 * n_clusters), rng)
+    sample = to_charts(sample)
+    chosen = [rng.randint(len(sample))]
+    closest = dtw_batch(sample, sample[chosen[0]], window)
+    for _ in range(1, n_clusters):
+        weights = np.where(np.isfinite(closest), closest, 0)
+        if weights.sum() > 0:
+            ind = np.searchsorted(np.cumsum(weights), rng.rand() *
+                                  weights.sum())
+            ind = min(ind, len(sample) - 1)
+        else:
+            ind = rng.randint(len(sample))
+        chosen.append(ind)
+        closest = np.minimum(closest, dtw_batch(sample, sample[ind], window))
+    return inds[chosen]
+
+
+def update_medoid(X, members, medoid, window, rng, sample_size=SAMPLE_SIZE,
+                  n_candidates=N_CANDIDATES):
+    """
+    DESCR: new medoid of one cluster. Candidates are the current medoid and
+           the members closest to the cluster mean, the one with the least
+           total dtw to (a sample of) the members wins
+    INPUT:
+        X - array - (n, n_candles, 4) charts
+        members - array - rows of X in the cluster
+        medoid - int - current medoid row
+        window - int
+        rng - RandomState
+        sample_size - int - members scored against
+        n_candidates - int
+    OUTPUT:
+        medoid - int - row of X
+    """
+    if len(members) < 2:
+        return medoid
+    charts = to_charts(X[members])
+    flat = charts.reshape(len(members), -1)
+    to_mean = ((flat - flat.mean(axis=0)) ** 2).sum(axis=1)
+    candidates = members[np.argsort(to_mean)[:n_candidates]]
+    candidates = np.union1d(candidates, [medoid])
+
+    scored = charts
+    if len(members) > sample_size:
+        scored = charts[np.sort(rng.choice(len(members), sample_size,
+                                           replace=False))]
+    totals = [dtw_batch(scored, to_charts(X[c])[0], window).sum()
+              for c in candidates]
+    return candidates[int(np.argmin(totals))]
+
+
+# CLASS SECTION
+class DTWKMedoids(object):
+    """
+    DESCR: k-medoids under banded dtw. Same fitted attributes as sklearn
+           KMeans (cluster_centers_ are the medoid charts flattened) so the
+           rest of the repo can use it, plus medoid_indices_
+    """
+
+    def __init__(self, n_clusters=8, window=WINDOW, max_iter=MAX_ITER,
+                 sample_size=SAMPLE_SIZE, n_candidates=N_CANDIDATES,
+                 random_state=None, verbose=0):
+        """
+        DESCR: store parameters, nothing is fit
+        INPUT:
+            n_clusters - int
+            window - int - Sakoe-Chiba band in candles
+            max_iter - int - assign / update rounds
+            sample_size - int - charts used to pick starting medoids and to
+                          score medoid candidates
+            n_candidates - int - members tried as each new medoid
+            random_state - int or RandomState
+            verbose - int
+        OUTPUT: None
+        """
+        self.n_clusters = n_clusters
+        self.window = window
+        self.max_iter = max_iter
+        self.sample_size = sample_size
+        self.n_candidates = n_candidates
+        self.random_state = random_state
+        self.verbose = verbose
+
+    def fit(self, X, y=None):
+        """
+        DESCR: alternate dtw assignment and medoid updates until the medoids
+               stop changing
+        INPUT:
+            X - array - (n, n_candles, 4) or flat, memory mapped is fine
+        OUTPUT:
+            self
+        """
+        rng = check_random_state(self.random_state)
+        medoids = init_medoids(X, self.n_clusters, self.window, rng,
+                               self.sample_size)
+        converged = False
+        for n_iter in range(1, self.max_iter + 1):
+            start_time = time()
+            labels, dists = assign_chunked(X, to_charts(X[medoids]),
+                                           self.window)
+            groups = [np.where(labels == m)[0] for m in range(len(medoids))]
+            new_medoids = np.array([update_medoid(X, members, medoid,
+                                                  self.window, rng,
+                                                  self.sample_size,
+                                                  self.n_candidates)
+                                    for members, medoid in zip(groups,
+                                                               medoids)])
+            if self.verbose:
+                print "   Iteration {}: cost {:.6g}, {} medoids moved, " \
+                      "{:.1f}s".format(n_iter, dists.sum(),
+                                       (new_medoids != medoids).sum(),
+                                       time() - start_time)
+            converged = np.array_equal(new_medoids, medoids)
+            if converged:
+                break
+            medoids = new_medoids
+
+        # Labels are of the medoids before the last update unless converged
+        if not converged:
+            labels, dists = assign_chunked(X, to_charts(X[medoids]),
+                                           self.window)
+        self.medoid_indices_ = medoids
+        self.cluster_centers_ = to_charts(X[medoids]).reshape(len(medoids), -1)
+        self.labels_ = labels
+        self.inertia_ = dists.sum()
+        self.n_iter_ = n_iter
+        return self
+
+    def predict(self, X):
+        """
+        DESCR: closest medoid of each chart by dtw
+        """
+        medoids = self.cluster_centers_.reshape(len(self.cluster_centers_),
+                                                -1, 4)
+        return assign_chunked(X, medoids, self.window)[0]
+
+    def fit_predict(self, X, y=None):
+        """
+        DESCR: fit and give back labels_
+        """
+        return self.fit(X).labels_
+
+
+if __name__ == '__main__':
+    """
+    DESCR: Test code, bounds and batch dtw against a plain dtw, then top k
+           search over a dataset
+    """
+    from chart_store import load_charts
+
+    def plain_dtw(a, b, window):
+        n = len(a)
+        table = np.full((n + 1, n + 1), np.inf)
+        table[0, 0] = 0
+        for i in range(1, n + 1):
+            for j in range(max(1, i - window), min(n, i + window) + 1):
+                cost = ((a[i - 1] - b[j - 1]) ** 2).sum()
+                table[i, j] = cost + min(table[i - 1, j - 1], table[i - 1, j],
+                                         table[i, j - 1])
+        return table[n, n]
+
+    rng = np.random.RandomState(0)
+    charts = np.cumsum(rng.randn(200, 30, 4), axis=1)
+    plain = np.array([plain_dtw(chart, charts[0], 3) for chart in charts])
+    batch = dtw_batch(charts, charts[0], 3)
+    lb, _ = lower_bounds(charts, charts[0], 3)
+    print "Batch equals plain: {}".format(np.allclose(plain, batch))
+    print "Bounds below dtw: {}".format(np.all(lb <= plain + 1e-9))
+    abandoned = dtw_batch(charts, charts[0], 3, np.median(plain))
+    print "Early abandon keeps all under threshold: {}".format(
+          np.allclose(abandoned[plain < np.median(plain)],
+                      plain[plain < np.median(plain)]))
+
+    store = load_charts(sys.argv[1])
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    window = int(sys.argv[3]) if len(sys.argv) > 3 else WINDOW
+    num_candles = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    X = store.first_day()[:, :num_candles]
+
+    start_time = time()
+    dists, ids, counts = dtw_top_k(X, X[0], k, window, exclude=0)
+    print "Top {} of {} charts in {:.2f}s".format(k, len(X), time() - start_time)
+    print "   ruled out by Kim {kim}, by Keogh {keogh}, warped {warped}, " \
+          "abandoned {abandoned}".format(**counts)
+
+    start_time = time()
+    full = dtw_batch(to_charts(X[1:]), to_charts(X[0])[0], window)
+    order = np.argsort(full, kind='mergesort')[:k] + 1
+    print "Brute force in {:.2f}s, same answer: {}".format(
+          time() - start_time, np.allclose(np.sqrt(full[order - 1]), dists))
+    print ids
@@ -0,0 +1,421 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: forecaster.py
+# USAGE: from forecaster import Forecaster
+#        python forecaster.py <dataset> <cluster_pickle> <save_path> [-weight]
+#                             [raw_csv]
+# DESCR: Scores new charts. A fitted cluster model and the dataset it was fit
+#        on are turned once into a small Forecaster that holds the centers
+#        plus a summary of every cluster's next morning (mean path, spread,
+#        gap fill rate). Today's 79 raw candles for one symbol or all of them
+#        are cleaned with the same flags the dataset was made with (read from
+#        its info.json) and scored with one matrix product.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, per cluster next morning summaries and
+#                      batched scoring of raw 79 candle days
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+from chart_store import load_charts, read_info, DATASET_EXT
+from chart_store import OPEN, HIGH, LOW, CLOSE
+from chart_store import CANDLES_IN_DAY, NUM_OF_NEXT_DAY_TO_KEEP
+from chunked_kmeans import iter_chunks, CHUNK_SIZE
+from helper_functions import zero_charts, normalize_charts
+from helper_functions import shift_candles_to_zero
+from cluster_metrics import group_rows
+from time import time
+import cPickle as pickle
+import numpy as np
+import os
+import sys
+
+# CONSTANT SECTION
+END_OF_DAY = CANDLES_IN_DAY - 1
+TRANSFORM_FLAGS = ["-zero", "-norm", "-lower"]
+
+
+# FUNCTION SECTION
+def to_day_ohlc(charts):
+    """
+    DESCR: accept one day or many as ohlc or flat floats, charts with the
+           next morning still on (85 candles) are cut to the first day
+    INPUT:
+        charts - array like - (79, 4), (n, 79, 4), (n, 316) or 85 candle forms
+    OUTPUT:
+        ohlc - array - (n, 79, 4) float64
+    """
+    ohlc = np.asarray(charts, dtype=np.float64)
+    if ohlc.ndim == 2 and ohlc.shape[1] == 4:
+        ohlc = ohlc[None]
+    elif ohlc.ndim == 2:
+        ohlc = ohlc.reshape(ohlc.shape[0], -1, 4)
+    if ohlc.ndim != 3 or ohlc.shape[2] != 4 or \
+       ohlc.shape[1] < CANDLES_IN_DAY:
+        raise ValueError("charts should be (n, {0}, 4) or (n, {1}), got "
+                         "{2}".format(CANDLES_IN_DAY, CANDLES_IN_DAY * 4,
+                                      ohlc.shape))
+    return ohlc[:, :CANDLES_IN_DAY, :]
+
+
+def clean_day(ohlc, flags):
+    """
+    DESCR: clean_stock_stream.clean_charts for days with no next morning yet.
+           The end of day candle closes at the next open in the dataset,
+           which is not known at the close, so it ends at its own close (no
+           gap). -zero and -norm scale by the day's 79 candles, not the 85 the
+           dataset charts were scaled by
+    INPUT:
+        ohlc - array - (n, 79, 4) raw prices, not altered
+        flags - list of str - flags the dataset was cleaned with
+    OUTPUT:
+        ohlc - array - (n, 79, 4) cleaned copy
+    """
+    ohlc = ohlc.copy()
+    open_price = ohlc[:, END_OF_DAY, OPEN]
+    close_price = ohlc[:, END_OF_DAY, CLOSE]
+    ohlc[:, END_OF_DAY, HIGH] = np.maximum(open_price, close_price)
+    ohlc[:, END_OF_DAY, LOW] = np.minimum(open_price, close_price)
+
+    if "-zero" in flags:
+        zero_charts(ohlc, in_place=True)
+    if "-norm" in flags:
+        normalize_charts(ohlc, in_place=True)
+    if "-lower" in flags:
+        shift_candles_to_zero(ohlc, in_place=True)
+    return ohlc
+
+
+def price_scale(ohlc, flags):
+    """
+    DESCR: how many dollars one unit of the cleaned chart is, for turning a
+           forecast move back into prices. nan with -lower since every candle
+           is moved on its own
+    INPUT:
+        ohlc - array - (n, 79, 4) raw prices
+        flags - list of str - flags the dataset was cleaned with
+    OUTPUT:
+        scale - array - (n,)
+    """
+    if "-lower" in flags:
+        return np.full(len(ohlc), np.nan)
+    if "-norm" in flags:
+        top = ohlc[:, :, HIGH].max(axis=1)
+        bot = ohlc[:, :, LOW].min(axis=1)
+        with np.errstate(invalid='ignore'):
+            return np.where(top > bot, (top - bot) / 100., np.nan)
+    return np.ones(len(ohlc))
+
+
+def gap_fills(ohlc):
+    """
+    DESCR: did the next morning trade back to the prior close. The prior close
+           is the open of the end of day candle (its close is overwritten by
+           the next open when the dataset is cleaned)
+    INPUT:
+        ohlc - array - (n, 85, 4) cleaned charts, not -lower
+    OUTPUT:
+        gapped - array - (n,) bool, next open away from the prior close
+        filled - array - (n,) bool, gapped and traded back to it
+    """
+    prior_close = ohlc[:, END_OF_DAY, OPEN]
+    next_open = ohlc[:, CANDLES_IN_DAY, OPEN]
+    morning = ohlc[:, CANDLES_IN_DAY:, :]
+    gap_up = next_open > prior_close
+    gap_down = next_open < prior_close
+    filled = (gap_up & (morning[:, :, LOW].min(axis=1) <= prior_close)) | \
+             (gap_down & (morning[:, :, HIGH].max(axis=1) >= prior_close))
+    return gap_up | gap_down, filled
+
+
+def fit_labels(model, X, transform=None, chunk_size=CHUNK_SIZE):
+    """
+    DESCR: cluster of every dataset chart, the fitted labels_ when they cover
+           the dataset, otherwise predicted a chunk at a time
+    INPUT:
+        model - fitted cluster model
+        X - array - (n, n_features) or (n, n_candles, 4) first days
+        transform - function - applied to every chunk, ie weight_features
+        chunk_size - int
+    OUTPUT:
+        labels - array - (n,)
+    """
+    labels = getattr(model, 'labels_', None)
+    if labels is not None and len(labels) == len(X):
+        return np.asarray(labels)
+    labels = np.empty(len(X), dtype=np.int64)
+    for start, chunk in iter_chunks(X, chunk_size, transform=transform):
+        labels[start:start + len(chunk)] = model.predict(chunk)
+    return labels
+
+
+def summarize_clusters(ohlc, labels, n_clusters, gaps=True):
+    """
+    DESCR: next morning summary of every cluster, one pass over the charts
+           grouped by label
+    INPUT:
+        ohlc - array - (n, 85, 4) cleaned charts
+        labels - array - (n,) cluster of each chart
+        n_clusters - int
+        gaps - bool - work out gap fills, off for -lower charts
+    OUTPUT:
+        summary - dict of arrays, first axis is the cluster
+            size - (k,) charts in cluster
+            mean_path - (k, 6, 4) average next morning candles
+            path_std - (k, 6, 4) spread of next morning candles
+            mean_move - (k, 6, 4) average next morning minus the prior close
+            move_std - (k, 6, 4) spread of that move
+            n_gaps - (k,) charts whose next open gapped
+            gap_fill_rate - (k,) share of gaps filled in the next morning
+    """
+    shape = (n_clusters, NUM_OF_NEXT_DAY_TO_KEEP, 4)
+    summary = {'size': np.zeros(n_clusters, dtype=np.int64),
+               'mean_path': np.full(shape, np.nan),
+               'path_std': np.full(shape, np.nan),
+               'mean_move': np.full(shape, np.nan),
+               'move_std': np.full(shape, np.nan),
+               'n_gaps': np.zeros(n_clusters, dtype=np.int64),
+               'gap_fill_rate': np.full(n_clusters, np.nan)}
+
+    for i, inds in enumerate(group_rows(labels, n_clusters)):
+        if not len(inds):
+            continue
+        charts = np.asarray(ohlc[inds])
+        morning = charts[:, CANDLES_IN_DAY:, :]
+        move = morning - charts[:, END_OF_DAY, OPEN][:, None, None]
+        summary['size'][i] = len(inds)
+        summary['mean_path'][i] = morning.mean(axis=0)
+        summary['path_std'][i] = morning.std(axis=0)
+        summary['mean_move'][i] = move.mean(axis=0)
+        summary['move_std'][i] = move.std(axis=0)
+        if gaps:
+            gapped, filled = gap_fills(charts)
+            summary['n_gaps'][i] = gapped.sum()
+            if gapped.any():
+                summary['gap_fill_rate'][i] = filled.sum() / float(gapped.sum())
+    return summary
+
+
+# CLASS SECTION
+class Forecaster(object):
+    """
+    DESCR: fitted clusters plus what each cluster's next morning looked like.
+           Build once with from_model, save, then load and score days with
+           forecast
+    """
+
+    def __init__(self, centers, summary, flags, weights=None, model=None):
+        """
+        DESCR: initialize from already worked out pieces, see from_model
+        INPUT:
+            centers - array - (k, 316) cluster centers in feature space
+            summary - dict - from summarize_clusters
+            flags - list of str - transforms the dataset was cleaned with
+            weights - array - (316,) feature weights used in the fit, optional
+            model - fitted model that predicts on ohlc itself (ie
+                    custom_candle_kmeans.kmeans), used instead of centers
+        OUTPUT: None
+        """
+        self.centers = np.ascontiguousarray(centers, dtype=np.float64)
+        self.center_norms = (self.centers ** 2).sum(axis=1)
+        self.summary = summary
+        self.flags = [flag for flag in flags if flag in TRANSFORM_FLAGS]
+        self.weights = weights
+        self.model = model
+
+    def __str__(self):
+        """
+        DESCR: Pretty representation of forecaster
+        """
+        return "Forecaster: {} clusters, flags {}, weighted {}".format(
+               self.n_clusters, self.flags, self.weights is not None)
+
+    @property
+    def n_clusters(self):
+        return len(self.summary['size'])
+
+    @classmethod
+    def from_model(cls, data_path, model, weight=False):
+        """
+        DESCR: summarize every cluster of a fitted model over the dataset it
+               was fit on
+        INPUT:
+            data_path - str - dataset directory (or old pickle) used in the fit
+            model - fitted model with cluster_centers_
+            weight - bool - model was fit with cluster_attempt -weight
+        OUTPUT:
+            forecaster - Forecaster
+        """
+        from cluster_attempt import weight_features
+
+        store = load_charts(data_path)
+        flags = []
+        if os.path.isdir(data_path) or os.path.isdir(data_path + DATASET_EXT):
+            path = data_path if os.path.isdir(data_path) else \
+                   data_path + DATASET_EXT
+            flags = read_info(path)['flags']
+
+        if hasattr(model, 'cluster_features_'):
+            labels = fit_labels(model, store.first_day())
+            centers = model.cluster_centers_.reshape(model.n_clusters, -1)
+            weights = None
+        else:
+            X, _ = store.day_split()
+            transform = weight_features if weight else None
+            labels = fit_labels(model, X, transform)
+            centers = model.cluster_centers_
+            weights = weight_features(np.ones((1, X.shape[1])))[0] \
+                      if weight else None
+            model = None
+
+        summary = summarize_clusters(store.ohlc, labels, len(centers),
+                                     gaps="-lower" not in flags)
+        return cls(centers, summary, flags, weights, model)
+
+    def save(self, path):
+        """
+        DESCR: pickle to path
+        """
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """
+        DESCR: read back a pickle written by save
+        """
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def features(self, ohlc):
+        """
+        DESCR: cleaned days flattened and weighted like the fit features
+        INPUT:
+            ohlc - array - (n, 79, 4) raw days
+        OUTPUT:
+            X - array - (n, 316)
+        """
+        X = clean_day(ohlc, self.flags).reshape(len(ohlc), -1)
+        if self.weights is not None:
+            X *= self.weights
+        return X
+
+    def predict(self, charts):
+        """
+        DESCR: closest cluster of each raw day, -1 when a day can not be
+               scored (ie flat day under -norm)
+        INPUT:
+            charts - array like - see to_day_ohlc
+        OUTPUT:
+            labels - array - (n,)
+            dists - array - (n,) euclidean distance to that center
+        """
+        ohlc = to_day_ohlc(charts)
+        if self.model is not None:
+            dists = self.model.transform(clean_day(ohlc, self.flags))
+            labels = dists.argmin(axis=1)
+            closest = dists[np.arange(len(labels)), labels]
+            labels[~np.isfinite(closest)] = -1
+            return labels, closest
+
+        X = self.features(ohlc)
+        dists = np.dot(X, self.centers.T)
+        dists *= -2
+        dists += self.center_norms
+        labels = dists.argmin(axis=1)
+        closest = dists[np.arange(len(labels)), labels]
+        closest += (X ** 2).sum(axis=1)
+
+        bad = ~np.isfinite(closest)
+        labels[bad] = -1
+        return labels, np.sqrt(np.maximum(closest, 0))
+
+    def forecast(self, charts):
+        """
+        DESCR: cluster and next morning forecast of each raw day
+        INPUT:
+            charts - array like - see to_day_ohlc
+        OUTPUT:
+            forecast - dict of arrays, first axis is the day
+                cluster, distance - from predict
+                size, n_gaps, gap_fill_rate - cluster's summary
+                mean_path, path_std - (n, 6, 4) in cleaned chart units
+                mean_move, move_std - (n, 6, 4) cleaned units past the close
+                price_path - (n, 6, 4) mean move put back in dollars from
+                             the open of the day's last candle, the same
+                             prior close the move was measured from, nan
+                             with -lower
+        """
+        ohlc = to_day_ohlc(charts)
+        labels, dists = self.predict(ohlc)
+        good = labels >= 0
+        inds = np.where(good, labels, 0)
+
+        forecast = {'cluster': labels, 'distance': dists}
+        for name, values in self.summary.items():
+            values = values[inds]
+            if values.dtype.kind == 'f':
+                values[~good] = np.nan
+            forecast[name] = values
+
+        scale = price_scale(ohlc, self.flags)[:, None, None]
+        prior_close = ohlc[:, END_OF_DAY, OPEN][:, None, None]
+        forecast['price_path'] = prior_close + forecast['mean_move'] * scale
+        return forecast
+
+
+if __name__ == '__main__':
+    """
+    DESCR: Build and save a forecaster, time single and batched scoring and
+           check raw days land where the cleaned dataset charts did
+    """
+    import warnings
+    from chart_reader import read_chart_csv
+    warnings.filterwarnings("ignore")
+
+    try:
+        data_path = sys.argv[1]
+        cluster_pickle = sys.argv[2]
+        save_path = sys.argv[3]
+        weight = "-weight" in sys.argv[4:]
+        raw_csvs = [arg for arg in sys.argv[4:] if arg != "-weight"]
+    except:
+        print "ERROR Usage: python forecaster.py <dataset> <cluster_pickle> " \
+              "<save_path> [-weight] [raw_csv]"
+        sys.exit(-1)
+
+    model = pickle.load(open(cluster_pickle, 'rb'))
+    start_time = time()
+    forecaster = Forecaster.from_model(data_path, model, weight)
+    forecaster.save(save_path)
+    print "{} built in {:.1f}s".format(forecaster, time() - start_time)
+    forecaster = Forecaster.load(save_path)
+
+    if raw_csvs:
+        raw = read_chart_csv(raw_csvs[0])
+    else:
+        raw = load_charts(data_path)
+    days = np.asarray(raw.first_day()[:500])
+
+    start_time = time()
+    for day in days[:100]:
+        forecaster.forecast(day)
+    print "One day at a time: {:.3f}ms per day".format(
+          (time() - start_time) * 1000 / min(100, len(days)))
+
+    start_time = time()
+    forecast = forecaster.forecast(days)
+    print "{} days at once: {:.3f}ms".format(len(days),
+                                             (time() - start_time) * 1000)
+
+    if raw_csvs:
+        from cluster_attempt import weight_features
+        X, _ = load_charts(data_path).day_split()
+        labels = fit_labels(model, X, weight_features if weight else None)
+        print "Raw days in the same cluster as their cleaned chart: " \
+              "{:.1%}".format(np.mean(forecast['cluster'] ==
+                                      labels[:len(days)]))
+    print "First day: cluster {}, gap fill rate {:.2f} of {} gaps".format(
+          forecast['cluster'][0], forecast['gap_fill_rate'][0],
+          forecast['n_gaps'][0])
+    print forecast['price_path'][0]
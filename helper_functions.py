@@ -13,6 +13,11 @@
 #           10/15/16 - Can flatten a recreate candles in df -- should help
 #                      if only want to use built in ML algs
 #           10/16/16 -
+#           10/18/26 - Batch versions of the chart transforms that work on a
+#                      whole (n_charts, n_candles, 4) ohlc array at once
+#                    - Flatten and merge are reshapes of one float array,
+#                      no per column lambdas or applymap
+#                    - day_split gives views using precomputed columns
 ###--------------------------------------------------------------------------###
 
 # IMPORT SECTION
@@ -21,13 +26,23 @@ from candlestick import CandleStick
 import pandas as pd
 from ast import literal_eval
 from chart_plotter import build_candle_chart
+from chart_store import OPEN, HIGH, LOW, CLOSE, float_columns
+from chart_store import CANDLES_IN_DAY, CANDLES_IN_CHART
+from chart_store import ohlc_to_candles, candles_to_ohlc
 import matplotlib.pyplot as plt
+import numpy as np
 
 # CONSTANT SECTION
 TEST_CHART1 = 333
 TEST_CHART2 = 888
 TEST_CHART3 = 1234
 
+# Flat float columns of the first day and of the next morning
+X_COLS = float_columns(CANDLES_IN_DAY)
+Y_COLS = float_columns(CANDLES_IN_CHART)[len(X_COLS):]
+X_SLICE = slice(0, len(X_COLS))
+Y_SLICE = slice(len(X_COLS), len(X_COLS) + len(Y_COLS))
+
 # FUNCTION SECTION
 def end_of_day_adjust(row, ind=78):
     """
@@ -80,6 +95,81 @@ def zero_chart(row):
     return row
 
 
+def end_of_day_adjust_batch(ohlc, ind=78, in_place=False):
+    """
+    DESCR: end_of_day_adjust for every chart at once
+    INPUT:
+        ohlc - array - (n_charts, n_candles, 4) un adjusted charts
+        ind - int - end of day candle needing adjustment
+        in_place - bool - alter given array instead of a copy
+    OUTPUT:
+        ohlc - array - (n_charts, n_candles, 4) end of day adjusted charts
+    """
+    if not in_place:
+        ohlc = ohlc.copy()
+    open_price = ohlc[:, ind, OPEN]
+    close_price = ohlc[:, ind + 1, OPEN]
+    ohlc[:, ind, HIGH] = np.maximum(open_price, close_price)
+    ohlc[:, ind, LOW] = np.minimum(open_price, close_price)
+    ohlc[:, ind, CLOSE] = close_price
+
+    return ohlc
+
+
+def zero_charts(ohlc, in_place=False):
+    """
+    DESCR: zero_chart for every chart at once
+    INPUT:
+        ohlc - array - (n_charts, n_candles, 4) raw magnitudes
+        in_place - bool - alter given array instead of a copy
+    OUTPUT:
+        ohlc - array - (n_charts, n_candles, 4) charts minus min of chart
+    """
+    bot = ohlc[:, :, LOW].min(axis=1)[:, None, None]
+    if in_place:
+        ohlc -= bot
+        return ohlc
+    return ohlc - bot
+
+
+def normalize_charts(ohlc, in_place=False):
+    """
+    DESCR: normalize_chart for every chart at once, flat charts (top == bot)
+           come out as nan instead of raising ZeroDivisionError
+    INPUT:
+        ohlc - array - (n_charts, n_candles, 4) raw magnitudes
+        in_place - bool - alter given array instead of a copy
+    OUTPUT:
+        ohlc - array - (n_charts, n_candles, 4) charts on a 0-100 scale
+    """
+    top = ohlc[:, :, HIGH].max(axis=1)[:, None, None]
+    bot = ohlc[:, :, LOW].min(axis=1)[:, None, None]
+    if not in_place:
+        ohlc = ohlc.copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ohlc -= bot
+        ohlc *= 100
+        ohlc /= (top - bot)
+
+    return ohlc
+
+
+def shift_candles_to_zero(ohlc, in_place=False):
+    """
+    DESCR: CandleStick.shift_to_zero for every candle of every chart at once
+    INPUT:
+        ohlc - array - (n_charts, n_candles, 4) charts
+        in_place - bool - alter given array instead of a copy
+    OUTPUT:
+        ohlc - array - (n_charts, n_candles, 4) each candle low moved to zero
+    """
+    low = ohlc[:, :, LOW:LOW + 1]
+    if in_place:
+        ohlc -= low.copy()
+        return ohlc
+    return ohlc - low
+
+
 def average_candles(candles):
     """
     DESCR: can take a list of candles and return a single candle
@@ -108,6 +198,41 @@ def average_charts(charts):
     return charts.apply(average_candles, axis=0)
 
 
+def ohlc_to_float_df(ohlc, index=None, candle_names=None):
+    """
+    DESCR: wrap a (n_charts, n_candles, 4) array as a flat float dataframe,
+           no copy when ohlc is c contiguous
+    INPUT:
+        ohlc - array - (n_charts, n_candles, 4)
+        index - list like - row labels, optional
+        candle_names - list of str - name of each candle, defaults to '0'...
+    OUTPUT:
+        df - dataframe - (n_charts, n_candles * 4) with '<i>_o/_h/_l/_c' cols
+    """
+    n_charts, n_candles = ohlc.shape[:2]
+    if candle_names is None:
+        cols = float_columns(n_candles)
+    else:
+        cols = [str(name) + suffix for name in candle_names
+                for suffix in ['_o', '_h', '_l', '_c']]
+    return pd.DataFrame(ohlc.reshape(n_charts, n_candles * 4), index=index,
+                        columns=cols, copy=False)
+
+
+def float_df_to_ohlc(df):
+    """
+    DESCR: view a flat float dataframe (or 2d array) as candles, no copy when
+           the frame is a single float block
+    INPUT:
+        df - dataframe or array - (n_charts, n_candles * 4)
+    OUTPUT:
+        ohlc - array - (n_charts, n_candles, 4)
+    """
+    flat = np.asarray(df.values if isinstance(df, pd.DataFrame) else df,
+                      dtype=np.float64)
+    return flat.reshape(flat.shape[0], -1, 4)
+
+
 def flatten_candle_df_to_float_df(df):
     """
     DESCR: Will take a dataframe of candles and turn it into a df of floats
@@ -116,59 +241,60 @@ def flatten_candle_df_to_float_df(df):
     OUTPUT:
         df - dataframe, full of floats
     """
-    original_cols = df.columns.tolist()
-
-    for col in original_cols:
-        name = col + '_' + 'o'
-        df[name] = df[col].apply(lambda x: x.open_price)
-        name = col + '_' + 'h'
-        df[name] = df[col].apply(lambda x: x.high)
-        name = col + '_' + 'l'
-        df[name] = df[col].apply(lambda x: x.low)
-        name = col + '_' + 'c'
-        df[name] = df[col].apply(lambda x: x.close_price)
-
-    df = df.drop(original_cols, axis=1)
-    return df
+    return ohlc_to_float_df(candles_to_ohlc(df.values), index=df.index,
+                            candle_names=df.columns)
 
 def merge_float_df_to_candles(df):
     """
     DESCR: Will recombine 4 columns into one candle
     """
-    original_cols = df.columns.tolist()
-    new_cols = [str(col) for col in range(int(len(df.columns)/4))]
-
-    for ind, col in enumerate(new_cols):
-        df[col] = zip(df.iloc[:,ind*4],
-                   df.iloc[:,(ind*4)+1],
-                   df.iloc[:,(ind*4)+2],
-                   df.iloc[:,(ind*4)+3])
-
-    df = df.drop(original_cols, axis=1)
-    df = df.applymap(func=lambda x: CandleStick(x[0],x[1], x[2], x[3]))
+    candles = ohlc_to_candles(float_df_to_ohlc(df))
 
-    return df
+    return pd.DataFrame(candles, index=df.index,
+                        columns=[str(col) for col in range(candles.shape[1])])
 
 def day_split(df):
     """
-    DESCR: takes dataframe and returns first day as X, and second as y
+    DESCR: takes dataframe and returns first day as X, and second as y. Both
+           are views of the same float block, nothing is copied when the
+           columns are in the usual order
+    INPUT:
+        df - dataframe (n, 340) of floats, array (n, 340) or array (n, 85, 4)
+    OUTPUT:
+        X - same kind as given - first day, (n, 316)
+        y - same kind as given - next morning, (n, 24)
     """
-    suffixes = ['_o', '_h', '_l', '_c']
-    x_cols = [[str(x)+suffix for suffix in suffixes] for x in range(0,79,1)]
-    x_cols = [col for sublist in x_cols for col in sublist]
-    y_cols = [[str(x)+suffix for suffix in suffixes] for x in range(79,85,1)]
-    y_cols = [col for sublist in y_cols for col in sublist]
+    if not isinstance(df, pd.DataFrame):
+        flat = np.asarray(df)
+        if flat.ndim == 3:
+            flat = flat.reshape(flat.shape[0], -1)
+        return flat[:, X_SLICE], flat[:, Y_SLICE]
+
+    # Usual column order is one slice each, anything else has to be gathered
+    positions = df.columns.get_indexer(X_COLS + Y_COLS)
+    if (positions < 0).any():
+        missing = [col for col, pos in zip(X_COLS + Y_COLS, positions)
+                   if pos < 0]
+        raise KeyError("Columns not in dataframe: {}".format(missing))
+    if (positions == np.arange(len(X_COLS) + len(Y_COLS))).all():
+        values = df.values
+        X = values[:, X_SLICE]
+        y = values[:, Y_SLICE]
+    else:
+        values = df.values[:, positions]
+        X = values[:, :len(X_COLS)]
+        y = values[:, len(X_COLS):]
 
-    X = df.drop(y_cols, axis=1)
-    y = df.drop(x_cols, axis=1)
+    X = pd.DataFrame(X, index=df.index, columns=X_COLS, copy=False)
+    y = pd.DataFrame(y, index=df.index, columns=Y_COLS, copy=False)
     return X, y
 
 def float_chart_to_candle_chart(chart):
     """
     DESCR: Take a single chart (series) of floats and merge them to candles
     """
-    candles = [chart[x:x+4] for x in range(0,len(chart),4)]
-    candles = pd.Series([CandleStick(x[0], x[1], x[2], x[3]) for x in candles])
+    candles = np.asarray(chart, dtype=np.float64).reshape(-1, 4)
+    candles = pd.Series(ohlc_to_candles(candles))
     return candles
 
 if __name__ == '__main__':
@@ -0,0 +1,312 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: k_sweep.py
+# USAGE: from k_sweep import run_sweep
+#        python k_sweep.py <dataset> <results_csv> <k_start> <k_end> <k_step>
+#                          [workers]
+# DESCR: Fits KMeans for many K so an elbow can be picked. K values are split
+#        into runs of neighbouring K that go to a process pool, each worker
+#        maps the dataset itself and starts every fit from the centers of the
+#        K before it plus new centers picked by greedy k-means++, so only the
+#        first K of a run pays for a full k-means++ with n_init restarts. The
+#        warm fit races a couple of cold restarts and the lower inertia wins,
+#        which keeps every K within about half a percent of a full cold fit.
+#        Every K's inertia, sizes, distance metrics and time land in a csv
+#        as soon as its run is done.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, chained warm start sweep over a pool
+#                    - Empty K range gives no runs and an empty results csv
+#                    - New centers picked greedily, lonely centers moved to
+#                      the farthest rows and refit, warm fit kept only when
+#                      it beats WARM_COLD_INIT cold restarts
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+from sklearn.cluster import KMeans
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.utils import check_random_state
+from chart_store import load_charts
+from chunked_kmeans import fit_minibatch, predict_chunked, sample_rows
+from chunked_kmeans import N_EPOCHS
+from cluster_metrics import cluster_metrics, summarize_metrics, METRIC_COLUMNS
+from multiprocessing import Pool, cpu_count
+from time import time
+import numpy as np
+import warnings
+import csv
+import sys
+
+# CONSTANT SECTION
+RANDOM_STATE = 42
+N_INIT = 10
+MAX_ITER = 300
+TOL = 0.0001
+SEED_SAMPLE_SIZE = 20000
+# Cold restarts each warm fit has to beat
+WARM_COLD_INIT = 2
+RESULT_COLUMNS = ['k', 'inertia', 'n_iter', 'seconds', 'warm_start',
+                  'mean_size', 'min_size', 'max_size'] + METRIC_COLUMNS
+
+
+# FUNCTION SECTION
+def split_chains(ks, n_chains):
+    """
+    DESCR: cut sorted K values into runs of neighbours with about the same
+           total work each, fit time grows with K so big K runs are shorter
+    INPUT:
+        ks - list of int
+        n_chains - int - runs wanted
+    OUTPUT:
+        chains - list of lists of int
+    """
+    ks = sorted(ks)
+    if not ks:
+        return []
+    n_chains = max(1, min(n_chains, len(ks)))
+    work = np.cumsum(ks, dtype=np.float64)
+    cuts = np.searchsorted(work, work[-1] * np.arange(1, n_chains) / n_chains)
+
+    bounds = [0] + sorted(set(cuts) - set([0, len(ks)])) + [len(ks)]
+    chains = [ks[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    return chains
+
+
+def grow_centers(X, centers, n_clusters, rng, sample_size=SEED_SAMPLE_SIZE,
+                 n_local_trials=None):
+    """
+    DESCR: add centers by greedy k-means++ until there are n_clusters, so a
+           fit can start from the previous K's answer. Each new center is the
+           best of a few rows picked by D^2 sampling, the one that lowers the
+           sample's total distance most, so lone outliers are rarely taken
+    INPUT:
+        X - array - (n, n_features) rows to pick from
+        centers - array - (m, n_features) current centers, m <= n_clusters
+        n_clusters - int - centers wanted
+        rng - RandomState
+        sample_size - int - rows the new centers are picked from
+        n_local_trials - int - candidates per center, default 2 + log(k)
+    OUTPUT:
+        centers - array - (n_clusters, n_features)
+    """
+    if len(centers) >= n_clusters:
+        return centers[:n_clusters]
+    if n_local_trials is None:
+        n_local_trials = 2 + int(np.log(n_clusters))
+    sample, _ = sample_rows(X, sample_size, rng)
+    closest = euclidean_distances(sample, centers, squared=True).min(axis=1)
+
+    new_centers = [centers]
+    for _ in range(n_clusters - len(centers)):
+        total = closest.sum()
+        if total > 0:
+            candidates = np.searchsorted(np.cumsum(closest),
+                                         rng.rand(n_local_trials) * total)
+            candidates = np.minimum(candidates, len(sample) - 1)
+        else:
+            candidates = rng.randint(len(sample), size=n_local_trials)
+        dists = np.minimum(euclidean_distances(sample, sample[candidates],
+                                               squared=True),
+                           closest[:, None])
+        best = dists.sum(axis=0).argmin()
+        new_centers.append(sample[candidates[best]:candidates[best] + 1])
+        closest = dists[:, best]
+    return np.vstack(new_centers)
+
+
+def reseed_lonely(X, cluster, rng, sample_size=SEED_SAMPLE_SIZE):
+    """
+    DESCR: starting centers for a refit when a fit left clusters of one chart
+           or none, those centers move to the rows farthest from the center
+           they are closest to
+    INPUT:
+        X - array - (n, n_features) rows to pick from
+        cluster - fitted model with labels_ and cluster_centers_
+        rng - RandomState
+        sample_size - int
+    OUTPUT:
+        centers - array - (k, n_features), None when no cluster is that small
+    """
+    centers = cluster.cluster_centers_.copy()
+    lonely = np.where(np.bincount(cluster.labels_,
+                                  minlength=len(centers)) <= 1)[0]
+    if not len(lonely):
+        return None
+    sample, _ = sample_rows(X, sample_size, rng)
+    closest = euclidean_distances(sample, centers, squared=True).min(axis=1)
+    farthest = np.argsort(-closest, kind='mergesort')[:len(lonely)]
+    centers[lonely[:len(farthest)]] = sample[farthest]
+    return centers
+
+
+def warm_fit(X, seed_X, centers, n_clusters, rng, minibatch=False,
+             transform=None, random_state=RANDOM_STATE):
+    """
+    DESCR: fit K starting from the centers of the K before it. Lonely centers
+           are moved and refit once, and a cold k-means++ fit with
+           WARM_COLD_INIT restarts runs beside it, the lower inertia is kept
+           so a bad warm start costs only those restarts
+    INPUT:
+        X - array - (n, n_features)
+        seed_X - array - rows new centers are picked from, weighted like X
+        centers - array - (m, n_features) centers of the K before
+        n_clusters - int
+        rng - RandomState
+        minibatch - bool
+        transform - function - per chunk weighting for minibatch
+        random_state - int
+    OUTPUT:
+        cluster - fitted model with labels_ and inertia_
+        warm - bool - True if the warm started fit was kept
+    """
+    init = grow_centers(seed_X, centers, n_clusters, rng)
+    cluster = fit_k(X, n_clusters, init, minibatch, transform, random_state)
+    init = reseed_lonely(seed_X, cluster, rng)
+    if init is not None:
+        refit = fit_k(X, n_clusters, init, minibatch, transform, random_state)
+        if refit.inertia_ < cluster.inertia_:
+            cluster = refit
+
+    cold = fit_k(X, n_clusters, minibatch=minibatch, transform=transform,
+                 random_state=random_state, n_init=WARM_COLD_INIT)
+    if cold.inertia_ < cluster.inertia_:
+        return cold, False
+    return cluster, True
+
+
+def fit_k(X, n_clusters, init=None, minibatch=False, transform=None,
+          random_state=RANDOM_STATE, n_init=N_INIT):
+    """
+    DESCR: one fit of the sweep
+    INPUT:
+        X - array - (n, n_features)
+        n_clusters - int
+        init - array - starting centers, None for k-means++ with n_init runs
+        minibatch - bool - stream chunks through MiniBatchKMeans instead
+        transform - function - per chunk weighting for minibatch
+        random_state - int
+        n_init - int - k-means++ restarts when no init is given
+    OUTPUT:
+        cluster - fitted model with labels_ and inertia_
+    """
+    if minibatch:
+        cluster = fit_minibatch(X, n_clusters, random_state=random_state,
+                                transform=transform, init=init)
+        cluster.labels_, cluster.inertia_ = predict_chunked(cluster, X,
+                                                            transform=transform)
+        cluster.n_iter_ = N_EPOCHS
+        return cluster
+
+    if init is None:
+        cluster = KMeans(n_clusters=n_clusters, init='k-means++',
+                         n_init=n_init, max_iter=MAX_ITER, tol=TOL, precompute_distances=True,
+                         random_state=random_state, n_jobs=1)
+    else:
+        cluster = KMeans(n_clusters=n_clusters, init=init, n_init=1,
+                         max_iter=MAX_ITER, tol=TOL, precompute_distances=True,
+                         random_state=random_state, n_jobs=1)
+    return cluster.fit(X)
+
+
+def sweep_chain(args):
+    """
+    DESCR: pool worker, map the dataset and fit each K of one run in order,
+           every K warm started from the one before
+    INPUT:
+        args - tuple - (data_path, ks, weight, minibatch, random_state)
+    OUTPUT:
+        results - list of dicts - RESULT_COLUMNS per K
+    """
+    # cluster_attempt imports this file, so pull in its weighting lazily
+    from cluster_attempt import weight_features
+    data_path, ks, weight, minibatch, random_state = args
+    warnings.filterwarnings("ignore")
+
+    X, y = load_charts(data_path).day_split()
+    transform = None
+    if weight and minibatch:
+        transform = weight_features
+    elif weight:
+        X = weight_features(X)
+
+    rng = check_random_state(random_state)
+    results = []
+    centers = None
+    for k in ks:
+        start_time = time()
+        warm = False
+        if centers is None:
+            cluster = fit_k(X, k, minibatch=minibatch, transform=transform,
+                            random_state=random_state)
+        else:
+            seed_X = X if transform is None else transform(
+                     sample_rows(X, SEED_SAMPLE_SIZE, rng)[0])
+            cluster, warm = warm_fit(X, seed_X, centers, k, rng, minibatch,
+                                     transform, random_state)
+        seconds = time() - start_time
+        centers = cluster.cluster_centers_
+
+        result = summarize_metrics(cluster_metrics(
+            X, y, cluster.labels_, k, large='sample', transform=transform))
+        result.update({'k': k, 'inertia': cluster.inertia_,
+                       'n_iter': cluster.n_iter_, 'seconds': seconds,
+                       'warm_start': warm})
+        results.append(result)
+    return results
+
+
+def run_sweep(data_path, ks, results_path, workers=None, weight=False,
+              minibatch=False, random_state=RANDOM_STATE):
+    """
+    DESCR: fit every K over a pool, writing each run's rows to the results
+           csv as soon as the run is done
+    INPUT:
+        data_path - str - dataset directory or pickle, opened by each worker
+        ks - list of int - K values to fit
+        results_path - str - csv to write
+        workers - int - processes, default cpu count
+        weight - bool - weight features like -weight
+        minibatch - bool - streamed fits like -minibatch
+        random_state - int
+    OUTPUT:
+        results - list of dicts - one per K sorted by K
+    """
+    workers = workers or cpu_count()
+    chains = split_chains(ks, workers)
+    jobs = [(data_path, chain, weight, minibatch, random_state)
+            for chain in chains]
+    print "Sweeping {} K values in {} runs over {} workers".format(
+          len(ks), len(chains), workers)
+
+    results = []
+    with open(results_path, 'w') as f:
+        writer = csv.DictWriter(f, RESULT_COLUMNS)
+        writer.writeheader()
+        if not chains:
+            return results
+        pool = Pool(min(workers, len(chains)))
+        try:
+            for chain_results in pool.imap_unordered(sweep_chain, jobs):
+                writer.writerows(chain_results)
+                f.flush()
+                results.extend(chain_results)
+                for result in chain_results:
+                    print "   K = {:5d}  inertia {:.4g}  {:.1f}s".format(
+                          result['k'], result['inertia'], result['seconds'])
+        finally:
+            pool.close()
+            pool.join()
+
+    return sorted(results, key=lambda result: result['k'])
+
+
+if __name__ == '__main__':
+    data_path = sys.argv[1]
+    results_path = sys.argv[2]
+    ks = range(int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5]))
+    workers = int(sys.argv[6]) if len(sys.argv) > 6 else None
+
+    start_time = time()
+    run_sweep(data_path, ks, results_path, workers)
+    print "Sweep done in {:.1f}s, results in {}".format(time() - start_time,
+                                                         results_path)
@@ -0,0 +1,406 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: linkage_clustering.py
+# USAGE: from linkage_clustering import LinkageClustering
+#        python linkage_clustering.py <dataset> <num_clusters> [num_micro]
+#                                     [method]
+# DESCR: Hierarchical clustering of every chart. A distance matrix of 315k
+#        charts will never fit, so charts are first over clustered into a
+#        couple thousand micro clusters with streamed MiniBatchKMeans, then
+#        the micro cluster means are joined by exact Ward or average linkage
+#        with each one weighted by how many charts it holds (nearest neighbour
+#        chain with Lance-Williams updates). The tree is kept in scipy's
+#        linkage format and saved, so it can be cut at any K without refitting.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, micro clusters plus weighted nn chain
+#                      ward / average linkage, save and cut at any K
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+from scipy.spatial.distance import pdist, squareform
+from scipy import sparse
+from chunked_kmeans import fit_minibatch, predict_chunked, iter_chunks
+from chunked_kmeans import sample_rows, CHUNK_SIZE
+from time import time
+import numpy as np
+import sys
+
+# CONSTANT SECTION
+RANDOM_STATE = 42
+METHODS = ['ward', 'average']
+N_MICRO = 2000
+
+
+# FUNCTION SECTION
+def micro_cluster(X, n_micro, transform=None, chunk_size=CHUNK_SIZE,
+                  random_state=RANDOM_STATE):
+    """
+    DESCR: over cluster X with streamed MiniBatchKMeans, then the exact mean
+           and size of every micro cluster in one more pass. Micro clusters
+           nothing landed in are dropped
+    INPUT:
+        X - array - (n, n_features), memory mapped is fine
+        n_micro - int - micro clusters wanted
+        transform - function - applied to every chunk, ie weight_features
+        chunk_size - int
+        random_state - int
+    OUTPUT:
+        centers - array - (m, n_features) micro cluster means, m <= n_micro
+        weights - array - (m,) charts in each
+        labels - array - (n,) micro cluster of each chart
+    """
+    # Random rows start the centers, k-means++ over thousands of centers
+    # cost more than the fit and micro clusters only need to be small
+    init, _ = sample_rows(X, n_micro, random_state, transform)
+    cluster = fit_minibatch(X, n_micro, chunk_size, random_state=random_state,
+                            transform=transform, init=init)
+    labels, _ = predict_chunked(cluster, X, chunk_size, transform)
+
+    sums = np.zeros((n_micro, X.shape[1]))
+    for start, chunk in iter_chunks(X, chunk_size, transform=transform):
+        chunk_labels = labels[start:start + len(chunk)]
+        members = sparse.csr_matrix((np.ones(len(chunk)), (chunk_labels,
+                                     np.arange(len(chunk)))),
+                                    shape=(n_micro, len(chunk)))
+        sums += members.dot(chunk)
+
+    weights = np.bincount(labels, minlength=n_micro)
+    used = np.where(weights > 0)[0]
+    relabel = np.full(n_micro, -1, dtype=np.int64)
+    relabel[used] = np.arange(len(used))
+    centers = sums[used] / weights[used][:, None]
+    return centers, weights[used], relabel[labels]
+
+
+def initial_distances(centers, weights, method):
+    """
+    DESCR: linkage distance between every pair of weighted points. Ward of
+           two groups is sqrt(2 n_a n_b / (n_a + n_b)) times the distance of
+           their means, the same scale scipy uses, so unit weights give
+           plain euclidean
+    INPUT:
+        centers - array - (m, n_features)
+        weights - array - (m,)
+        method - str - one of METHODS
+    OUTPUT:
+        dists - array - (m, m) with inf on the diagonal
+    """
+    dists = squareform(pdist(centers))
+    if method == 'ward':
+        weights = np.asarray(weights, dtype=np.float64)
+        dists *= np.sqrt(2 * np.outer(weights, weights) /
+                         np.add.outer(weights, weights))
+    np.fill_diagonal(dists, np.inf)
+    return dists
+
+
+def lance_williams(dists, a, b, sizes, method):
+    """
+    DESCR: distance from every cluster to the union of clusters a and b
+    INPUT:
+        dists - array - (m, m) current distances
+        a, b - int - clusters being joined
+        sizes - array - (m,) weight of every cluster
+        method - str - one of METHODS
+    OUTPUT:
+        new - array - (m,) distance to the union, entries for a, b and
+              retired clusters are junk and get reset by the caller
+    """
+    d_a, d_b = dists[a], dists[b]
+    n_a, n_b = sizes[a], sizes[b]
+    with np.errstate(invalid='ignore'):
+        if method == 'ward':
+            n_k = sizes
+            new = ((n_a + n_k) * d_a ** 2 + (n_b + n_k) * d_b ** 2 -
+                   n_k * dists[a, b] ** 2) / (n_a + n_b + n_k)
+            return np.sqrt(np.maximum(new, 0))
+        return (n_a * d_a + n_b * d_b) / (n_a + n_b)
+
+
+def nn_chain(dists, weights, method):
+    """
+    DESCR: nearest neighbour chain, follow nearest neighbours until two
+           clusters are each other's nearest and join them. Exact for ward
+           and average since joining never brings a cluster closer to others
+    INPUT:
+        dists - array - (m, m) from initial_distances, changed in place
+        weights - array - (m,)
+        method - str - one of METHODS
+    OUTPUT:
+        merges - array - (m - 1, 3) [slot a, slot b, distance] in the order
+                 joined, the union is kept in slot b
+    """
+    m = len(dists)
+    sizes = np.asarray(weights, dtype=np.float64).copy()
+    active = np.ones(m, dtype=bool)
+    merges = np.empty((m - 1, 3))
+    chain = []
+    for step in range(m - 1):
+        if not chain:
+            chain.append(int(np.argmax(active)))
+        while True:
+            a = chain[-1]
+            b = int(np.argmin(dists[a]))
+            if len(chain) > 1 and dists[a, chain[-2]] <= dists[a, b]:
+                b = chain[-2]
+                break
+            chain.append(b)
+        chain.pop()
+        chain.pop()
+
+        merges[step] = a, b, dists[a, b]
+        new = lance_williams(dists, a, b, sizes, method)
+        sizes[b] += sizes[a]
+        active[a] = False
+        new[~active] = np.inf
+        new[b] = np.inf
+        dists[b, :] = new
+        dists[:, b] = new
+        dists[a, :] = np.inf
+        dists[:, a] = np.inf
+    return merges
+
+
+def merges_to_linkage(merges, n_leaves):
+    """
+    DESCR: scipy linkage matrix from nn_chain joins, sorted by distance and
+           relabeled with a union find the way scipy does it
+    INPUT:
+        merges - array - (m - 1, 3) from nn_chain
+        n_leaves - int - m
+    OUTPUT:
+        Z - array - (m - 1, 4) [cluster, cluster, distance, leaves in it]
+    """
+    merges = merges[np.argsort(merges[:, 2], kind='mergesort')]
+    parent = np.arange(2 * n_leaves - 1)
+    counts = np.concatenate([np.ones(n_leaves), np.zeros(n_leaves - 1)])
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    Z = np.empty((n_leaves - 1, 4))
+    for step, (a, b, dist) in enumerate(merges):
+        root_a, root_b = find(int(a)), find(int(b))
+        new = n_leaves + step
+        parent[root_a] = parent[root_b] = new
+        counts[new] = counts[root_a] + counts[root_b]
+        Z[step] = min(root_a, root_b), max(root_a, root_b), dist, counts[new]
+    return Z
+
+
+def weighted_linkage(centers, weights, method='ward'):
+    """
+    DESCR: exact linkage of weighted points
+    INPUT:
+        centers - array - (m, n_features)
+        weights - array - (m,) how many charts each point stands for
+        method - str - one of METHODS
+    OUTPUT:
+        Z - array - (m - 1, 4) scipy linkage matrix over the m points
+    """
+    if method not in METHODS:
+        raise ValueError("method should be one of {}, got {}".format(METHODS,
+                                                                    method))
+    merges = nn_chain(initial_distances(centers, weights, method), weights,
+                      method)
+    return merges_to_linkage(merges, len(centers))
+
+
+def cut_linkage(Z, n_clusters):
+    """
+    DESCR: exactly n_clusters flat clusters, the tree with its last
+           n_clusters - 1 joins undone
+    INPUT:
+        Z - array - (m - 1, 4) linkage matrix
+        n_clusters - int - 1 to m
+    OUTPUT:
+        labels - array - (m,) cluster of every leaf, numbered by first leaf
+    """
+    n_leaves = len(Z) + 1
+    if not 1 <= n_clusters <= n_leaves:
+        raise ValueError("n_clusters should be 1 to {}, got {}".format(
+                         n_leaves, n_clusters))
+    parent = np.arange(2 * n_leaves - 1)
+    for step in range(n_leaves - n_clusters):
+        parent[int(Z[step, 0])] = parent[int(Z[step, 1])] = n_leaves + step
+
+    # Point every leaf at its top node a level at a time
+    roots = parent[:n_leaves].copy()
+    while True:
+        up = parent[roots]
+        if np.array_equal(up, roots):
+            break
+        roots = up
+    _, first, labels = np.unique(roots, return_index=True, return_inverse=True)
+    return np.argsort(np.argsort(first))[labels]
+
+
+# CLASS SECTION
+class LinkageClustering(object):
+    """
+    DESCR: two stage hierarchical clustering, micro clusters then weighted
+           linkage. Has labels_ and cluster_centers_ for n_clusters like
+           sklearn KMeans, and cut gives any other K from the same tree
+    """
+
+    def __init__(self, n_clusters=8, n_micro=N_MICRO, method='ward',
+                 chunk_size=CHUNK_SIZE, random_state=RANDOM_STATE, verbose=0):
+        """
+        DESCR: store parameters, nothing is fit
+        INPUT:
+            n_clusters - int - K for labels_ and cluster_centers_
+            n_micro - int - micro clusters, charts are used as they are when
+                      there are no more than this
+            method - str - one of METHODS
+            chunk_size - int - rows per streamed chunk
+            random_state - int
+            verbose - int
+        OUTPUT: None
+        """
+        self.n_clusters = n_clusters
+        self.n_micro = n_micro
+        self.method = method
+        self.chunk_size = chunk_size
+        self.random_state = random_state
+        self.verbose = verbose
+
+    def fit(self, X, y=None, transform=None):
+        """
+        DESCR: micro cluster X and build the tree over the micro clusters
+        INPUT:
+            X - array - (n, n_features), memory mapped is fine
+            transform - function - applied to every chunk, ie weight_features
+        OUTPUT:
+            self
+        """
+        start_time = time()
+        if len(X) <= self.n_micro:
+            centers = np.asarray(X, dtype=np.float64)
+            if transform is not None:
+                centers = transform(centers)
+            weights = np.ones(len(X))
+            micro_labels = np.arange(len(X))
+        else:
+            centers, weights, micro_labels = micro_cluster(
+                X, self.n_micro, transform, self.chunk_size, self.random_state)
+        if self.verbose:
+            print "   {} micro clusters in {:.1f}s".format(len(centers),
+                                                           time() - start_time)
+
+        start_time = time()
+        self.linkage_ = weighted_linkage(centers, weights, self.method)
+        if self.verbose:
+            print "   {} linkage in {:.1f}s".format(self.method,
+                                                    time() - start_time)
+
+        self.micro_centers_ = centers
+        self.micro_weights_ = np.asarray(weights, dtype=np.float64)
+        self.micro_labels_ = micro_labels
+        return self.set_n_clusters(self.n_clusters)
+
+    def cut(self, n_clusters):
+        """
+        DESCR: cluster of every chart with the tree cut at n_clusters
+        INPUT:
+            n_clusters - int
+        OUTPUT:
+            labels - array - (n,)
+        """
+        return cut_linkage(self.linkage_, n_clusters)[self.micro_labels_]
+
+    def centers(self, n_clusters):
+        """
+        DESCR: chart mean of every cluster with the tree cut at n_clusters
+        INPUT:
+            n_clusters - int
+        OUTPUT:
+            centers - array - (n_clusters, n_features)
+        """
+        micro = cut_linkage(self.linkage_, n_clusters)
+        weights = np.bincount(micro, self.micro_weights_, n_clusters)
+        sums = np.zeros((n_clusters, self.micro_centers_.shape[1]))
+        np.add.at(sums, micro, self.micro_centers_ *
+                  self.micro_weights_[:, None])
+        return sums / weights[:, None]
+
+    def set_n_clusters(self, n_clusters):
+        """
+        DESCR: recut the saved tree, labels_ and cluster_centers_ follow
+        OUTPUT:
+            self
+        """
+        self.n_clusters = n_clusters
+        self.labels_ = self.cut(n_clusters)
+        self.cluster_centers_ = self.centers(n_clusters)
+        return self
+
+    def save(self, path):
+        """
+        DESCR: tree and micro clusters as an npz, what cut needs later
+        """
+        np.savez(path, linkage=self.linkage_, micro_centers=self.micro_centers_,
+                 micro_weights=self.micro_weights_,
+                 micro_labels=self.micro_labels_, method=self.method,
+                 n_clusters=self.n_clusters)
+
+    @classmethod
+    def load(cls, path):
+        """
+        DESCR: read back an npz written by save, ready to cut
+        """
+        saved = np.load(path)
+        model = cls(n_clusters=int(saved['n_clusters']),
+                    n_micro=len(saved['micro_centers']),
+                    method=str(saved['method']))
+        model.linkage_ = saved['linkage']
+        model.micro_centers_ = saved['micro_centers']
+        model.micro_weights_ = saved['micro_weights']
+        model.micro_labels_ = saved['micro_labels']
+        return model.set_n_clusters(model.n_clusters)
+
+
+if __name__ == '__main__':
+    """
+    DESCR: Test code, unit weight linkage against scipy, then a dataset
+    """
+    from scipy.cluster.hierarchy import linkage, fcluster
+    from sklearn.metrics import adjusted_rand_score
+    from chart_store import load_charts
+    import warnings
+    warnings.filterwarnings("ignore")
+
+    rng = np.random.RandomState(0)
+    points = rng.rand(400, 20)
+    for method in METHODS:
+        Z = weighted_linkage(points, np.ones(len(points)), method)
+        scipy_Z = linkage(points, method)
+        labels = cut_linkage(Z, 12)
+        print "{}: same tree as scipy {}, cut agrees with fcluster {}".format(
+              method, np.allclose(Z, scipy_Z),
+              adjusted_rand_score(labels, fcluster(scipy_Z, 12,
+                                                   'maxclust')) == 1.0)
+
+    store = load_charts(sys.argv[1])
+    num_clusters = int(sys.argv[2])
+    num_micro = int(sys.argv[3]) if len(sys.argv) > 3 else N_MICRO
+    method = sys.argv[4] if len(sys.argv) > 4 else 'ward'
+    X, _ = store.day_split()
+
+    start_time = time()
+    model = LinkageClustering(num_clusters, num_micro, method,
+                              verbose=1).fit(X)
+    print "Fit {} charts in {:.1f}s".format(len(X), time() - start_time)
+    model.save('linkage_test.npz')
+
+    model = LinkageClustering.load('linkage_test.npz')
+    for k in [num_clusters, 2 * num_clusters, 10 * num_clusters]:
+        start_time = time()
+        sizes = np.bincount(model.cut(k))
+        print "Cut at {}: {} clusters in {:.3f}s, sizes {} to {}".format(
+              k, len(sizes), time() - start_time, sizes.min(), sizes.max())
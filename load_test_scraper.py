@@ -0,0 +1,237 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: load_test_scraper.py
+# USAGE: python load_test_scraper.py <n_symbols> <concurrency> [--days N]
+#                                    [--latency MS] [--error-rate R]
+#                                    [--short-rate R] [--malformed-rate R]
+#                                    [--window-days N] [--rate R]
+#                                    [--retries N] [--backoff S]
+#                                    [--fixtures DIR] [--base-url URL]
+# DESCR: Runs pull_all_data.pull_all against the local barchart stub so pull
+#        throughput can be measured and tuned offline. Reports charts/sec,
+#        p50/p99 page latency (retries and backoff included) and what came of
+#        the 503s, short pages and malformed pages the stub threw in.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, load test of pull_all against stub
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+import pull_chart
+from pull_all_data import pull_all, make_date_pairs, make_windows
+from chart_fetcher import ChartFetcher
+from barchart_stub import StubConfig, start_stub
+from time import time
+import numpy as np
+import threading
+import datetime
+import tempfile
+import csv
+import os
+import sys
+
+# CONSTANT SECTION
+RECOGNIZED_OPTIONS = {"--days": int, "--latency": float,
+                      "--error-rate": float, "--short-rate": float,
+                      "--malformed-rate": float, "--window-days": int,
+                      "--rate": float, "--retries": int, "--backoff": float,
+                      "--fixtures": str, "--base-url": str}
+DEFAULT_DAYS = 20
+DEFAULT_BACKOFF = 0.05
+START_DATE = datetime.datetime(2014, 3, 3)
+
+
+# CLASS SECTION
+class TimedFetcher(ChartFetcher):
+    """
+    DESCR: ChartFetcher that keeps the time of every page and how each fetch
+           came out
+    """
+
+    def __init__(self, *args, **kwargs):
+        ChartFetcher.__init__(self, *args, **kwargs)
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.outcomes = {'chart': 0, 'bad_response': 0, 'too_few': 0,
+                         'exception': 0}
+
+    def get_page(self, url):
+        start_time = time()
+        response = ChartFetcher.get_page(self, url)
+        with self.lock:
+            self.latencies.append(time() - start_time)
+        return response
+
+    def tally(self, result):
+        if isinstance(result, (tuple, list)):
+            key = 'chart'
+        elif result == -2:
+            key = 'too_few'
+        else:
+            key = 'bad_response'
+        with self.lock:
+            self.outcomes[key] += 1
+
+    def fetch(self, symb, minutes, date_pair):
+        try:
+            result = ChartFetcher.fetch(self, symb, minutes, date_pair)
+        except Exception:
+            with self.lock:
+                self.outcomes['exception'] += 1
+            raise
+        self.tally(result)
+        return result
+
+    def fetch_window(self, symb, minutes, start_date, end_date):
+        try:
+            result = ChartFetcher.fetch_window(self, symb, minutes,
+                                               start_date, end_date)
+        except Exception:
+            with self.lock:
+                self.outcomes['exception'] += 1
+            raise
+        self.tally(result)
+        return result
+
+
+# FUNCTION SECTION
+def parse_options(args):
+    """
+    DESCR: read --name value pairs off the command line
+    INPUT:
+        args - list of str
+    OUTPUT:
+        options - dict - ie {"--latency": 50.0}
+    """
+    options = {}
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in RECOGNIZED_OPTIONS:
+            options[arg] = RECOGNIZED_OPTIONS[arg](args.pop(0))
+        else:
+            print "{} not recognized".format(arg)
+
+    return options
+
+
+def make_jobs(n_symbols, n_days, window_days=None):
+    """
+    DESCR: pull jobs for made up symbols over n_days weekdays
+    INPUT:
+        n_symbols - int
+        n_days - int - calendar days from START_DATE
+        window_days - int - pairs per request, None for one pair per request
+    OUTPUT:
+        jobs - list of (symb, minutes, date_pair)
+        n_charts - int - charts the jobs ask for
+    """
+    date_pairs = make_date_pairs(START_DATE,
+                                 START_DATE + datetime.timedelta(days=n_days))
+    symbols = ['LT{}'.format(ind) for ind in range(n_symbols)]
+    if window_days:
+        groups = make_windows(date_pairs, window_days)
+    else:
+        groups = date_pairs
+    jobs = [(symb, 5, group) for symb in symbols for group in groups]
+
+    return jobs, len(symbols) * len(date_pairs)
+
+
+def load_test(jobs, fetcher, out_file):
+    """
+    DESCR: run jobs through pull_all writing to out_file
+    INPUT:
+        jobs - list of (symb, minutes, date_pair)
+        fetcher - TimedFetcher
+        out_file - str - csv to write
+    OUTPUT:
+        stats - dict - from pull_all
+        seconds - float - wall time of the pull
+    """
+    with open(out_file, 'wt') as f:
+        writer = csv.writer(f)
+        start_time = time()
+        stats = pull_all(jobs, writer, fetcher, f)
+        seconds = time() - start_time
+
+    return stats, seconds
+
+
+def report(stats, seconds, fetcher, n_charts, stub_counts=None):
+    """
+    DESCR: print throughput, latency and error handling of a load test
+    INPUT:
+        stats - dict - from pull_all
+        seconds - float - wall time
+        fetcher - TimedFetcher
+        n_charts - int - charts asked for
+        stub_counts - dict - what the stub served, None if stub not in process
+    OUTPUT:
+        ok - bool - every chart asked for was either written or failed
+    """
+    latencies = np.array(fetcher.latencies) * 1000
+    print "Concurrency:     {}".format(fetcher.concurrency)
+    print "Charts written:  {} of {}".format(stats['written'], n_charts)
+    print "Charts failed:   {}".format(stats['failed'])
+    print "Seconds:         {:.2f}".format(seconds)
+    print "Charts/sec:      {:.1f}".format(stats['written'] / seconds)
+    print "Pages/sec:       {:.1f}".format(len(latencies) / seconds)
+    if len(latencies):
+        print "Page latency ms: p50 {:.1f}  p99 {:.1f}  max {:.1f}".format(
+              np.percentile(latencies, 50), np.percentile(latencies, 99),
+              latencies.max())
+    print "Fetch outcomes:  {}".format(fetcher.outcomes)
+    if stub_counts is not None:
+        print "Stub served:     {}".format(stub_counts)
+        retried = stub_counts['requests'] - len(latencies)
+        print "Retried pages:   {}".format(retried)
+
+    ok = stats['written'] + stats['failed'] == n_charts
+    if not ok:
+        print "MISMATCH: {} charts unaccounted for".format(
+              n_charts - stats['written'] - stats['failed'])
+    return ok
+
+
+if __name__ == '__main__':
+    n_symbols = int(sys.argv[1])
+    concurrency = int(sys.argv[2])
+    options = parse_options(sys.argv[3:])
+
+    # Stub runs in process unless pointed at one already running
+    stub = None
+    base_url = options.get("--base-url")
+    if base_url is None:
+        config = StubConfig(latency=options.get("--latency", 0.0),
+                            error_rate=options.get("--error-rate", 0.0),
+                            short_rate=options.get("--short-rate", 0.0),
+                            malformed_rate=options.get("--malformed-rate", 0.0),
+                            fixture_dir=options.get("--fixtures"), seed=0)
+        stub = start_stub(config)
+        base_url = stub.base_url
+    print "Load testing against {}".format(base_url)
+
+    # Keep pull errors out of the real error file
+    out_dir = tempfile.mkdtemp()
+    pull_chart.ERROR_FILE = os.path.join(out_dir, 'errors.txt')
+    out_file = os.path.join(out_dir, 'load_test.csv')
+
+    jobs, n_charts = make_jobs(n_symbols, options.get("--days", DEFAULT_DAYS),
+                               options.get("--window-days"))
+    fetcher = TimedFetcher(concurrency=concurrency, rate=options.get("--rate"),
+                           retries=options.get("--retries", 3),
+                           backoff=options.get("--backoff", DEFAULT_BACKOFF),
+                           base_url=base_url)
+    stats, seconds = load_test(jobs, fetcher, out_file)
+    fetcher.close()
+
+    ok = report(stats, seconds, fetcher, n_charts,
+                stub.config.counts if stub is not None else None)
+    if stub is not None:
+        stub.shutdown()
+
+    for name in os.listdir(out_dir):
+        os.remove(os.path.join(out_dir, name))
+    os.rmdir(out_dir)
+    sys.exit(0 if ok else -1)
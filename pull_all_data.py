@@ -2,24 +2,49 @@
 # AUTHOR: Robert Ranney
 # FILE: pull_all_data.py
 # USAGE: python pull_all_data <save_file_name> <symb_start_ind> <symb_end_ind>
+#                             [--concurrency N] [--rate R] [-incremental]
+#                             [--window-days N]
 # DESCR: functions to pull whole desired data set off of bar chart and store in
 #        a desired format
 # START DATE: 10/8/16
 # CHANGE LOG:
 #           10/8/16 - file initiated
+#           10/18/26 - Pulls through a ChartFetcher, shared keep alive session,
+#                      configurable concurrency and rate limit, retries
+#                    - One queue of (symbol, date_pair) jobs for all symbols
+#                      feeding a fixed pool, single writer thread batches rows
+#                    - Manifest of done and failed jobs, reruns skip what is
+#                      done and append, -incremental pulls up to today
+#                    - --window-days N pulls N day pairs per request and splits
+#                      them locally, far fewer requests and bytes
+#                    - -incremental picks up each symbol from its own last
+#                      finished day and retries its failed jobs
+#                    - Pull errors go in the error file, not just printed
 ###--------------------------------------------------------------------------###
 
 # IMPORT SECTION
 import datetime
 import pull_chart
 from pull_chart import CANDLES_IN_DAY, NUM_OF_NEXT_DAY_TO_KEEP
+from chart_fetcher import ChartFetcher, DEFAULT_CONCURRENCY
+from pull_manifest import PullManifest, trim_partial_row, DONE, FAILED
+from Queue import Queue
+import threading
 import csv
 from time import time
-from concurrent.futures import ThreadPoolExecutor
 import sys
+import os
+import re
 
 # CONSTANTS
 STOCK_SYMBOLS_FILE = 'SP_stock_symbols.txt'
+RECOGNIZED_OPTIONS = {"--concurrency": int, "--rate": float,
+                      "--window-days": int}
+RECOGNIZED_FLAGS = ["-incremental"]
+START_DATE = datetime.datetime(2014, 1, 1)
+END_DATE = datetime.datetime(2016, 10, 1)
+WRITE_BATCH_SIZE = 100
+MONTH_DAY_RE = re.compile(r'(\d+)/(\d+)')
 
 
 def get_stock_symbols(file_name):
@@ -37,7 +62,86 @@ def get_stock_symbols(file_name):
     return stocks
 
 
-def pull_and_record_chart(writer, symb, minutes, date_pair):
+def parse_options(args):
+    """
+    DESCR: read the optional flags and --name value pairs off the command line
+    INPUT:
+        args - list of str - args after the symbol indexes
+    OUTPUT:
+        flags - list of str - ie ["-incremental"]
+        options - dict - ie {"--concurrency": 20}
+    """
+    flags = []
+    options = {}
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in RECOGNIZED_FLAGS:
+            flags.append(arg)
+        elif arg in RECOGNIZED_OPTIONS:
+            options[arg] = RECOGNIZED_OPTIONS[arg](args.pop(0))
+        else:
+            print "{} not recognized".format(arg)
+
+    return flags, options
+
+
+def make_date_pairs(start_date, end_date):
+    """
+    DESCR: consecutive weekday pairs from start_date up to (not incl) end_date
+    INPUT:
+        start_date - datetime
+        end_date - datetime
+    OUTPUT:
+        date_pairs - list of (datetime, datetime)
+    """
+    days_gap = (end_date - start_date).days
+    weekdays = set([0,1,2,3,4])
+
+    # Create a list of date pairs to query data from
+    date_list = [start_date + datetime.timedelta(days=x) for x in range(0, days_gap) if (start_date + datetime.timedelta(days=x)).weekday() in weekdays]
+    return zip(date_list[:-1], date_list[1:])
+
+
+def incremental_jobs(symbols, manifest, end_date, minutes=5,
+                     window_days=None):
+    """
+    DESCR: jobs an -incremental run needs, every symbol picks up from its own
+           last finished day (START_DATE if none) through end_date, plus any
+           of its earlier jobs whose last try failed
+    INPUT:
+        symbols - list of str
+        manifest - PullManifest - record of the earlier pulls
+        end_date - datetime - pull up to, not incl
+        minutes - int - canclestick interval length
+        window_days - int - pairs per request, None for one pair per job
+    OUTPUT:
+        jobs - list of (symb, minutes, date_pair), date_pair a list of pairs
+               for windows
+    """
+    last_dates = manifest.last_dates()
+    failed = {}
+    for job in sorted(manifest.failed_jobs()):
+        failed.setdefault(job[0], []).append(job)
+
+    jobs = []
+    for symb in symbols:
+        start_date = last_dates.get(symb, START_DATE)
+        date_pairs = make_date_pairs(start_date, end_date)
+        if window_days:
+            jobs.extend((symb, minutes, window)
+                        for window in make_windows(date_pairs, window_days))
+        else:
+            jobs.extend((symb, minutes, date_pair) for date_pair in date_pairs)
+
+        # Failures from here on are in the new pairs already
+        jobs.extend(job for job in failed.get(symb, [])
+                    if job[2][0] < start_date)
+
+    return jobs
+
+
+def pull_and_record_chart(writer, symb, minutes, date_pair, fetcher=None):
     """
     DESCR: pull a desired stock and write to given csv
     INPUT:
@@ -45,64 +149,286 @@ def pull_and_record_chart(writer, symb, minutes, date_pair):
         symb - str - stock desigator
         minutes - int - canclestick interval length
         date_pair - tuple - (date_start, date_end)
+        fetcher - ChartFetcher - pooled connections, optional
     OUTPUT: none
     """
     try:
-        data, meta = pull_chart.pull_one_chart(symb,
-                                    minutes,
-                                    date_pair[0].month,
-                                    date_pair[0].day,
-                                    date_pair[0].year,
-                                    date_pair[1].month,
-                                    date_pair[1].day,
-                                    date_pair[1].year)
-        data.append(meta)
-        writer.writerow( data )
+        if fetcher is None:
+            result = pull_chart.pull_one_chart(symb,
+                                        minutes,
+                                        date_pair[0].month,
+                                        date_pair[0].day,
+                                        date_pair[0].year,
+                                        date_pair[1].month,
+                                        date_pair[1].day,
+                                        date_pair[1].year)
+        else:
+            result = fetcher.fetch(symb, minutes, date_pair)
+        record_chart(writer, result)
     except Exception as e:
         print e
+        pull_chart.record_pull_error(pull_chart.build_chart_url(symb, minutes,
+                                     date_pair[0].month, date_pair[0].day,
+                                     date_pair[0].year, date_pair[1].month,
+                                     date_pair[1].day, date_pair[1].year),
+                                     "Exception: {}".format(e))
+
+
+def record_chart(writer, result):
+    """
+    DESCR: write a pulled chart as a csv row, failed pulls are skipped
+    INPUT:
+        writer - csv_writer_ojbect - where will chart go
+        result - tuple or int - (candles, meta) or error code from a pull
+    OUTPUT:
+        recorded - bool - True if a row was written
+    """
+    if not isinstance(result, tuple):
+        return False
+    data, meta = result
+    writer.writerow( data + [meta] )
+    return True
+
+
+def make_windows(date_pairs, window_days):
+    """
+    DESCR: group consecutive date pairs so each group is one request
+    INPUT:
+        date_pairs - list of (datetime, datetime)
+        window_days - int - pairs per request
+    OUTPUT:
+        windows - list of lists of (datetime, datetime)
+    """
+    return [list(date_pairs[ind:ind + window_days])
+            for ind in range(0, len(date_pairs), window_days)]
+
+
+def match_window_charts(date_pairs, charts):
+    """
+    DESCR: line up charts split from a window with the date pairs asked for,
+           by the month and day in each chart's meta
+    INPUT:
+        date_pairs - list of (datetime, datetime) - pairs in window
+        charts - list of (candles, meta) or error code - from fetch_window
+    OUTPUT:
+        results - list of (date_pair, result) - -2 for pairs with no chart
+    """
+    by_day = {}
+    if isinstance(charts, list):
+        for chart in charts:
+            match = MONTH_DAY_RE.search(chart[1]['first_day'])
+            if match:
+                by_day[(int(match.group(1)), int(match.group(2)))] = chart
+
+    error = charts if not isinstance(charts, list) else -2
+    return [(date_pair, by_day.get((date_pair[0].month, date_pair[0].day), error))
+            for date_pair in date_pairs]
+
+
+def fetch_worker(fetcher, job_queue, result_queue):
+    """
+    DESCR: thread loop, pull jobs off the queue until a None shows up
+    INPUT:
+        fetcher - ChartFetcher - shared connection pool
+        job_queue - Queue - (symb, minutes, date_pair) jobs
+        result_queue - Queue - (job, result) sent on to writer
+    OUTPUT: None
+    """
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        symb, minutes, date_pair = job
+
+        # A list of date pairs is a window pulled in one request
+        if isinstance(date_pair, list):
+            try:
+                charts = fetcher.fetch_window(symb, minutes, date_pair[0][0],
+                                              date_pair[-1][1])
+            except Exception as e:
+                print "ERROR: {} {}".format(job, e)
+                pull_chart.record_pull_error(fetcher.chart_url(symb, minutes,
+                                             date_pair[0][0], date_pair[-1][1]),
+                                             "Exception: {}".format(e))
+                charts = -1
+            for pair, result in match_window_charts(date_pair, charts):
+                result_queue.put(((symb, minutes, pair), result))
+            continue
+
+        try:
+            result = fetcher.fetch(*job)
+        except Exception as e:
+            print "ERROR: {} {}".format(job, e)
+            pull_chart.record_pull_error(fetcher.chart_url(symb, minutes,
+                                         *date_pair), "Exception: {}".format(e))
+            result = -1
+        result_queue.put((job, result))
+
+
+def write_worker(writer, result_queue, stats, batch_size=WRITE_BATCH_SIZE,
+                 out_file=None, manifest=None):
+    """
+    DESCR: thread loop, only thread to touch the csv writer so rows never
+           interleave, writes in batches until a None shows up
+    INPUT:
+        writer - csv_writer_ojbect - where charts go
+        result_queue - Queue - (job, result) from fetch workers
+        stats - dict - counts of 'written' and 'failed', filled in here
+        batch_size - int - rows held before a write
+        out_file - file - flushed before jobs are marked done, optional
+        manifest - PullManifest - record of done and failed jobs, optional
+    OUTPUT: None
+    """
+    rows = []
+    jobs = []
+    while True:
+        item = result_queue.get()
+        if item is not None:
+            job, result = item
+            if isinstance(result, tuple):
+                data, meta = result
+                rows.append(data + [meta])
+                jobs.append(job)
+            else:
+                stats['failed'] += 1
+                if manifest is not None:
+                    manifest.record([job], FAILED)
+        if rows and (item is None or len(rows) >= batch_size):
+            writer.writerows(rows)
+            if out_file is not None:
+                out_file.flush()
+            if manifest is not None:
+                manifest.record(jobs, DONE)
+            stats['written'] += len(rows)
+            print "  {} charts written, {} failed".format(stats['written'],
+                                                          stats['failed'])
+            rows = []
+            jobs = []
+        if item is None:
+            break
+
+
+def pull_all(jobs, writer, fetcher, out_file=None, manifest=None):
+    """
+    DESCR: run every job through a fixed pool of fetch threads with one
+           writer thread, no stall between symbols
+    INPUT:
+        jobs - iterable of (symb, minutes, date_pair), date_pair can be a
+               list of date pairs to pull as one window
+        writer - csv_writer_ojbect - where charts go
+        fetcher - ChartFetcher - shared connection pool
+        out_file - file - under writer, flushed before jobs marked done
+        manifest - PullManifest - jobs already done are skipped, optional
+    OUTPUT:
+        stats - dict - counts of 'written', 'failed' and 'skipped' charts
+    """
+    job_queue = Queue(maxsize=fetcher.concurrency * 4)
+    result_queue = Queue()
+    stats = {'written': 0, 'failed': 0, 'skipped': 0}
+
+    workers = [threading.Thread(target=fetch_worker,
+                                args=(fetcher, job_queue, result_queue))
+               for _ in range(fetcher.concurrency)]
+    writer_thread = threading.Thread(target=write_worker,
+                                     args=(writer, result_queue, stats,
+                                           WRITE_BATCH_SIZE, out_file,
+                                           manifest))
+    for thread in workers + [writer_thread]:
+        thread.daemon = True
+        thread.start()
+
+    for job in jobs:
+        symb, minutes, date_pair = job
+        if isinstance(date_pair, list):
+            # Only pull the part of a window that is not done yet
+            pending = [pair for pair in date_pair if manifest is None or
+                       not manifest.is_done((symb, minutes, pair))]
+            stats['skipped'] += len(date_pair) - len(pending)
+            if pending:
+                job_queue.put((symb, minutes, pending))
+            continue
+        if manifest is not None and manifest.is_done(job):
+            stats['skipped'] += 1
+            continue
+        job_queue.put(job)
+    for _ in workers:
+        job_queue.put(None)
+    for thread in workers:
+        thread.join()
+
+    result_queue.put(None)
+    writer_thread.join()
+
+    return stats
 
 
 if __name__ == '__main__':
     save_name = sys.argv[1]
     start_ind = int(sys.argv[2])
     end_ind = int(sys.argv[3])
+    flags, options = parse_options(sys.argv[4:])
 
     # Get all symols for data collection
     symbols = get_stock_symbols(STOCK_SYMBOLS_FILE)
     symbols = symbols[start_ind:end_ind]
 
-    # Designate data collections ranges
-    start_date = datetime.datetime(2014, 1, 1)
-    end_date = datetime.datetime(2016, 10, 1)
-    gap = end_date - start_date
-    days_gap = gap.days
-    weekdays = set([0,1,2,3,4])
+    # What has already been pulled into this file
+    manifest = PullManifest(save_name)
+    if len(manifest) and not os.path.exists(save_name):
+        print "  {} missing, starting manifest over".format(save_name)
+        os.remove(manifest.path)
+        manifest = PullManifest(save_name)
+    resuming = len(manifest) > 0 and os.path.exists(save_name)
+    print "  Manifest: {}".format(manifest.counts())
 
-    # Create a list of date pairs to query data from
-    date_list = [start_date + datetime.timedelta(days=x) for x in range(0, days_gap) if (start_date + datetime.timedelta(days=x)).weekday() in weekdays]
-    date_pairs = zip(date_list[:-1], date_list[1:])
+    # Designate data collections ranges, incremental runs through today
+    end_date = END_DATE
+    if "-incremental" in flags:
+        end_date = datetime.datetime.combine(datetime.date.today(),
+                                             datetime.time()) + datetime.timedelta(days=1)
+    date_pairs = make_date_pairs(START_DATE, end_date)
 
 
     # Create csv header row
     header_row = [str(x) for x in range(CANDLES_IN_DAY+NUM_OF_NEXT_DAY_TO_KEEP)]
     header_row.append('meta')
 
-    # Make a csv writer object
-    f = open(save_name, 'wt')
-    writer = csv.writer(f)
-    writer.writerow(header_row)
+    # Make a csv writer object, appending if picking up an earlier pull
+    if resuming:
+        trimmed = trim_partial_row(save_name)
+        if trimmed:
+            print "  Removed {} bytes of half written row".format(trimmed)
+        f = open(save_name, 'at')
+        writer = csv.writer(f)
+    else:
+        f = open(save_name, 'wt')
+        writer = csv.writer(f)
+        writer.writerow(header_row)
 
     start_time = time()
 
-    for symb in symbols:
-        # Make 10 threads to grab and record all of this
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            for num, date_pair in enumerate(date_pairs):
-                executor.submit(pull_and_record_chart, writer, symb, 5, date_pair)
-                print "\n\n Chart {}: Getting info for {}".format(num, date_pair)
+    # One session of pooled connections for the whole pull
+    fetcher = ChartFetcher(concurrency=options.get("--concurrency",
+                                                   DEFAULT_CONCURRENCY),
+                           rate=options.get("--rate"))
+
+    # Every symbol and date pair in one queue, grouped into windows if asked,
+    # incremental starts each symbol where its last pull finished
+    if "-incremental" in flags:
+        jobs = incremental_jobs(symbols, manifest, end_date,
+                                window_days=options.get("--window-days"))
+    elif "--window-days" in options:
+        windows = make_windows(date_pairs, options["--window-days"])
+        jobs = ((symb, 5, window) for symb in symbols for window in windows)
+    else:
+        jobs = ((symb, 5, date_pair) for symb in symbols for date_pair in date_pairs)
+    stats = pull_all(jobs, writer, fetcher, f, manifest)
 
+    fetcher.close()
     f.close()
 
     end_time = time()
 
+    print "  {} charts written, {} failed, {} already done".format(
+          stats['written'], stats['failed'], stats['skipped'])
     print "  Stock pull in: {}".format(end_time-start_time)
@@ -8,119 +8,382 @@
 #           10/7/16 - File started, quick experimentation with pulling data
 #           10/8/16 - can successfuly pull the candlestick data for any given
 #                     chart. Currently can write to csv, skeptical of this.
+#           10/18/26 - Url building and page parsing split out of
+#                      pull_one_chart so other fetchers can reuse them, can
+#                      pass in a requests session to reuse connections
+#                    - Can pull a multi day window in one request and split
+#                      it locally into the usual day / next morning charts
+#                    - Fast extraction of candle text straight from the page
+#                      with regexes, soup path kept behind fast=False
+#                    - Pages that fail to parse go in the error file as -1
 ###--------------------------------------------------------------------------###
 
 # IMPORTS
 from bs4 import BeautifulSoup
+from HTMLParser import HTMLParser
 import requests
 import csv
+import re
 
 # CONSTANTS
 CANDLES_IN_DAY = 79
 NUM_OF_NEXT_DAY_TO_KEEP = 6
+BASE_URL = "http://www.barchart.com"
+ERROR_FILE = 'chart_pull_errors.txt'
+NUM_RE = re.compile(r'[0-9](?:.*[0-9])?')
+PRICE_RE = re.compile(r'[0-9]+(?:\.[0-9]+)?')
+ENTITIES = [('&#39;', "'"), ('&quot;', '"'), ('&amp;', '&')]
+CENTER_RE = re.compile(r'<center[\s>]', re.I)
+MAP_RE = re.compile(r'<map[\s>]', re.I)
+MAP_END_RE = re.compile(r'</map\s*>', re.I)
+AREA_RE = re.compile(r'<area\b[^>]*?\sonmousemove\s*=\s*(?:"([^"]*)"|\'([^\']*)\')',
+                     re.I)
 
 # FUNCTIONS
 def ugly_text_to_float(s):
     """
-    DESCR: Probably the worst way ever to deal with strip out numbers from
-           text. Strips both sides and returns the float.
+    DESCR: Used to be the worst way ever to strip numbers out of text, now
+           one regex search from first digit to last digit. Strips both sides
+           and returns the float.
     INPUT:
         s - str - something like '17.15000,'
     OUPTU:
         s - float - 17.15000
     """
-    nums = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']
-    while s[0] not in nums:
-        s = s[1:]
-    while s[-1] not in nums:
-        s = s[:-1]
+    match = NUM_RE.search(s)
+    if match is None:
+        raise ValueError("no number in {}".format(s))
 
-    return float(s)
+    return float(match.group())
 
 
-def pull_one_chart(symbol, minutes, start_month, start_day, start_year, end_month, end_day, end_year):
+def build_chart_url(symbol, minutes, start_month, start_day, start_year,
+                    end_month, end_day, end_year, base_url=BASE_URL):
     """
-    DESCR: grabs one chart worth of data
+    DESCR: url of the chart page for one symbol over a date range
     INPUT:
         symbol - str - stock identifier ie 'AAPL'
         minutes - int - minutes of cande intervals
-        start_month - int - piece of start date ie oct = 10
-        start_day - int - number of day in month ie 15 = 15th
-        start_year - int - ie 2016
-        end_month - int
-        end_day - int
-        end_year - int
+        start_month, start_day, start_year - int - first date
+        end_month, end_day, end_year - int - last date
+        base_url - str - site to pull from
     OUTPUT:
-        candles - list [[o,h,l,c], [o,h,l,c]]- list of cnadles
-        meta - dict - meta data for chart
+        url - str
     """
     # build date header strings
     start_date = "{}%2F{}%2F{}".format(start_month, start_day, start_year)
     end_date = "{}%2F{}%2F{}".format(end_month, end_day, end_year)
 
     # Buld request url
-    url = "http://www.barchart.com/chart.php?sym={}&style=technical&template=&p=I&d=L&im={}&sd={}&ed={}&size=S&log=0&t=CANDLE&v=0&evnt=1&late=1&o1=&o2=&o3=&sh=100&indicators=&addindicator=&submitted=1&fpage=&txtDate={}#jump".format(symbol, minutes, start_date, end_date, end_date)
+    url = "{}/chart.php?sym={}&style=technical&template=&p=I&d=L&im={}&sd={}&ed={}&size=S&log=0&t=CANDLE&v=0&evnt=1&late=1&o1=&o2=&o3=&sh=100&indicators=&addindicator=&submitted=1&fpage=&txtDate={}#jump".format(base_url, symbol, minutes, start_date, end_date, end_date)
 
-    # Get a page response
-    response = requests.get(url)
+    return url
 
-    if response.status_code != 200:
-        with open('chart_pull_errors.txt', 'a') as f:
-            f.write("ERROR: problem with {}".format(url))
-            f.write("   Response code: {}".format(response.status_code))
-        return -1
+
+def record_pull_error(url, message):
+    """
+    DESCR: note a failed pull in the error file
+    INPUT:
+        url - str - page that failed
+        message - str - what went wrong
+    OUTPUT: None
+    """
+    # One write per error so lines from pool threads never interleave
+    line = "ERROR: problem with {}   {}\n".format(url, message)
+    with open(ERROR_FILE, 'a') as f:
+        f.write(line)
+
+
+def extract_candle_text_fast(text):
+    """
+    DESCR: same as extract_candle_text without building a soup, finds the
+           first center > map in the raw page and regexes out every area's
+           onmousemove text
+    INPUT:
+        text - str - html of chart page
+    OUTPUT:
+        candles - list of str
+    """
+    center = CENTER_RE.search(text)
+    if center is None:
+        raise ValueError("no center tag in page")
+    map_start = MAP_RE.search(text, center.end())
+    if map_start is None:
+        raise ValueError("no map tag in page")
+    map_end = MAP_END_RE.search(text, map_start.end())
+    end = map_end.start() if map_end is not None else len(text)
+
+    candles = [double or single for double, single in
+               AREA_RE.findall(text, map_start.end(), end)]
+
+    # Only pay for unescaping entities if there are any, common ones first
+    if any('&' in candle for candle in candles):
+        for entity, char in ENTITIES:
+            candles = [candle.replace(entity, char) for candle in candles]
+        if any('&' in candle for candle in candles):
+            parser = HTMLParser()
+            candles = [parser.unescape(candle) for candle in candles]
+
+    return candles
+
+
+def extract_candle_text(text, fast=True):
+    """
+    DESCR: onmousemove text of every candle on a chart page, in page order
+    INPUT:
+        text - str - html of chart page
+        fast - bool - regex extraction, False to build a full soup
+    OUTPUT:
+        candles - list of str
+    """
+    if fast:
+        return extract_candle_text_fast(text)
+
+    # Make a soup
+    soup = BeautifulSoup(text, "lxml")
+
+    # pull out the chart candle objects
+    rects = soup.find('center').find('map').findAll('area')
+
+    # cut down to just data display info
+    return [rect['onmousemove'] for rect in rects]
+
+
+def split_candle_text(candles):
+    """
+    DESCR: put candle text in time order and split into fields
+    INPUT:
+        candles - list of str - from extract_candle_text
+    OUTPUT:
+        candles - list of lists of str - [day, year, symbol, o, h, l, c]
+    """
+    # Why are these stupid things backwars?
+    candles = candles[::-1]
+
+    # Split into useful stuff
+    return [candle.split(', ')[2:] for candle in candles]
+
+
+def candle_prices(candle):
+    """
+    DESCR: the four prices of a split candle, one regex pass for all four and
+           ugly_text_to_float on each only if that does not give four numbers
+    INPUT:
+        candle - list of str - from split_candle_text
+    OUTPUT:
+        prices - list of float - [o, h, l, c]
+    """
+    prices = PRICE_RE.findall(', '.join(candle[3:]))
+    if len(prices) != len(candle) - 3:
+        return [ugly_text_to_float(num) for num in candle[3:]]
+    return [float(num) for num in prices]
+
+
+def candles_prices(candles):
+    """
+    DESCR: prices of many split candles with a single regex pass, falls back
+           to candle_prices one candle at a time if the count is off
+    INPUT:
+        candles - list of lists of str - from split_candle_text
+    OUTPUT:
+        prices - list [[o,h,l,c], ...]
+    """
+    fields = [field for candle in candles for field in candle[3:]]
+    prices = PRICE_RE.findall(', '.join(fields))
+    if len(prices) != len(fields) or any(len(candle) != 7 for candle in candles):
+        return [candle_prices(candle) for candle in candles]
+    prices = map(float, prices)
+    return [prices[ind:ind + 4] for ind in range(0, len(prices), 4)]
+
+
+def build_chart(candles, prices=None):
+    """
+    DESCR: turn split candle text of a day and the day after into a chart
+    INPUT:
+        candles - list of lists of str - from split_candle_text, at least 156
+        prices - list [[o,h,l,c], ...] - already converted prices of candles,
+                 optional
+    OUTPUT:
+        candles - list [[o,h,l,c], [o,h,l,c]]- list of cnadles
+        meta - dict - meta data for chart
+    """
+    # Save meta data
+    meta = {}
+    meta['first_day'] = candles[0][0][2:]
+    meta['year'] = candles[0][1][:4]
+    meta['symbol'] = candles[0][2][1:-1]
+    meta['second_day'] = candles[79][0][2:]
+
+    # Chop this now redundant stuff and convert to nums
+    if prices is None:
+        candles = candles_prices(candles)
     else:
-        # Make a soup
-        soup = BeautifulSoup(response.text, "lxml")
+        candles = [list(candle) for candle in prices]
 
-        # pull out the chart candle objects
-        print url
-        rects = soup.find('center').find('map').findAll('area')
+    if len(candles) == 157 or len(candles) == 156:
+        if len(set(candles[78])) != 1:
+            new_candle = [candles[77][-1]]*4
+            candles = candles[:78] + [new_candle] + candles[78:]
 
-        # cut down to just data display info
-        candles = [rect['onmousemove'] for rect in rects]
 
-        # Confirm size
-        if len(candles) < 156:
-            with open('chart_pull_errors.txt', 'a') as f:
-                f.write("ERROR: problem with {}".format(url))
-                f.write("   Only contains {} candles\n".format(len(candles)))
-            return -2
+    # Keep just the day and the desired next day
+    candles = candles[:CANDLES_IN_DAY + NUM_OF_NEXT_DAY_TO_KEEP]
 
-        else:
+    return candles, meta
 
-            # Why are these stupid things backwars?
-            candles.reverse()
 
-            # Split into useful stuff
-            candles = [candle.split(', ')[2:] for candle in candles]
+def parse_chart_page(text, url='', fast=True):
+    """
+    DESCR: pull the candles and meta data out of a chart page
+    INPUT:
+        text - str - html of chart page
+        url - str - where page came from, for error file
+        fast - bool - regex extraction, False to build a full soup
+    OUTPUT:
+        candles - list [[o,h,l,c], [o,h,l,c]]- list of cnadles
+        meta - dict - meta data for chart
+        or -2 if page has to few candles
+    """
+    candles = extract_candle_text(text, fast)
+
+    # Confirm size
+    if len(candles) < 156:
+        record_pull_error(url, "Only contains {} candles".format(len(candles)))
+        return -2
+
+    return build_chart(split_candle_text(candles))
+
+
+def parse_or_record(parse, text, url):
+    """
+    DESCR: run a page parser, a page it chokes on is noted in the error file
+           like a bad response instead of raising
+    INPUT:
+        parse - function - parse_chart_page or parse_window_page
+        text - str - html of chart page
+        url - str - where page came from
+    OUTPUT:
+        whatever parse gives, or -1 if it raised
+    """
+    try:
+        return parse(text, url)
+    except Exception as e:
+        record_pull_error(url, "Parse error: {}".format(e))
+        return -1
+
+
+def group_by_day(candles):
+    """
+    DESCR: cut split candle text into one list per trading day
+    INPUT:
+        candles - list of lists of str - from split_candle_text
+    OUTPUT:
+        days - list of lists - candles of each day, in time order
+    """
+    days = []
+    last_day = None
+    for candle in candles:
+        if candle[0] != last_day:
+            days.append([])
+            last_day = candle[0]
+        days[-1].append(candle)
 
-            # Save meta data
-            meta = {}
-            meta['first_day'] = candles[0][0][2:]
-            meta['year'] = candles[0][1][:4]
-            meta['symbol'] = candles[0][2][1:-1]
-            meta['second_day'] = candles[79][0][2:]
+    return days
 
-            # Chop this now redundant stuff
-            candles = [candle[3:] for candle in candles]
 
-            # convert to nums
-            candles = [[ugly_text_to_float(num) for num in candle] for candle in candles]
+def parse_window_page(text, url='', fast=True):
+    """
+    DESCR: split a chart page covering many days into the same day / next
+           morning charts a request per day pair would have given
+    INPUT:
+        text - str - html of chart page
+        url - str - where page came from, for error file
+        fast - bool - regex extraction, False to build a full soup
+    OUTPUT:
+        charts - list of (candles, meta) - one per consecutive pair of days
+    """
+    days = group_by_day(split_candle_text(extract_candle_text(text, fast)))
+
+    # Each day is in two charts, only convert its prices once
+    prices = [candles_prices(day) for day in days]
+
+    charts = []
+    for ind in range(len(days) - 1):
+        candles = days[ind] + days[ind + 1]
+        if len(candles) < 156:
+            record_pull_error(url, "Day {} only contains {} candles".format(
+                              days[ind][0][0][2:], len(candles)))
+            continue
+        charts.append(build_chart(candles, prices[ind] + prices[ind + 1]))
+
+    return charts
+
+
+def pull_one_chart(symbol, minutes, start_month, start_day, start_year, end_month, end_day, end_year, session=None):
+    """
+    DESCR: grabs one chart worth of data
+    INPUT:
+        symbol - str - stock identifier ie 'AAPL'
+        minutes - int - minutes of cande intervals
+        start_month - int - piece of start date ie oct = 10
+        start_day - int - number of day in month ie 15 = 15th
+        start_year - int - ie 2016
+        end_month - int
+        end_day - int
+        end_year - int
+        session - requests.Session - reuse connections, optional
+    OUTPUT:
+        candles - list [[o,h,l,c], [o,h,l,c]]- list of cnadles
+        meta - dict - meta data for chart
+    """
+    url = build_chart_url(symbol, minutes, start_month, start_day, start_year,
+                          end_month, end_day, end_year)
 
-            if len(candles) == 157 or len(candles) == 156:
-                if len(set(candles[78])) != 1:
-                    new_candle = [candles[77][-1]]*4
-                    candles = candles[:78] + [new_candle] + candles[78:]
+    # Get a page response
+    if session is None:
+        response = requests.get(url)
+    else:
+        response = session.get(url)
 
+    if response.status_code != 200:
+        record_pull_error(url, "Response code: {}".format(response.status_code))
+        return -1
+    else:
+        print url
+        return parse_or_record(parse_chart_page, response.text, url)
 
-            # Keep just the day and the desired next day
-            candles = candles[:CANDLES_IN_DAY + NUM_OF_NEXT_DAY_TO_KEEP]
 
-            return candles, meta
 
+def pull_chart_window(symbol, minutes, start_date, end_date, session=None,
+                      base_url=BASE_URL):
+    """
+    DESCR: grabs every day / next morning chart between two dates with one
+           request instead of one per day pair
+    INPUT:
+        symbol - str - stock identifier ie 'AAPL'
+        minutes - int - minutes of cande intervals
+        start_date - datetime - first day
+        end_date - datetime - last day
+        session - requests.Session - reuse connections, optional
+        base_url - str - site to pull from
+    OUTPUT:
+        charts - list of (candles, meta) or -1 for bad response
+    """
+    url = build_chart_url(symbol, minutes,
+                          start_date.month, start_date.day, start_date.year,
+                          end_date.month, end_date.day, end_date.year,
+                          base_url=base_url)
 
+    # Get a page response
+    if session is None:
+        response = requests.get(url)
+    else:
+        response = session.get(url)
 
+    if response.status_code != 200:
+        record_pull_error(url, "Response code: {}".format(response.status_code))
+        return -1
+    return parse_or_record(parse_window_page, response.text, url)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,193 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# CLASS FILE: pull_manifest.py
+# USAGE: from pull_manifest import PullManifest
+# DESCR: Keeps track of which (symbol, date_pair) charts have already landed
+#        in a pull csv and which failed, so a crashed or restarted pull only
+#        redoes what is missing. Stored as a small append only csv next to the
+#        data file, last line for a job wins.
+# CREATION DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, manifest of done and failed jobs
+#                    - Last finished day of every symbol in one pass
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+import datetime
+import threading
+import os
+
+# CONSTANT SECTION
+MANIFEST_EXT = '.manifest'
+DATE_FORMAT = '%Y-%m-%d'
+DONE = 'done'
+FAILED = 'failed'
+
+
+# FUNCTION SECTION
+def job_key(job):
+    """
+    DESCR: hashable, printable key of a pull job
+    INPUT:
+        job - tuple - (symb, minutes, date_pair)
+    OUTPUT:
+        key - tuple of str - (symb, minutes, start, end)
+    """
+    symb, minutes, date_pair = job
+    return (symb, str(minutes), date_pair[0].strftime(DATE_FORMAT),
+            date_pair[1].strftime(DATE_FORMAT))
+
+
+def trim_partial_row(file_name):
+    """
+    DESCR: chop off a half written last row left by a crash, so appending
+           starts on a clean line
+    INPUT:
+        file_name - str - pull csv
+    OUTPUT:
+        trimmed - int - bytes removed
+    """
+    if not os.path.exists(file_name):
+        return 0
+    size = os.path.getsize(file_name)
+    with open(file_name, 'rb+') as f:
+        pos = size
+        while pos > 0:
+            step = min(65536, pos)
+            f.seek(pos - step)
+            block = f.read(step)
+            ind = block.rfind('\n')
+            if ind != -1:
+                pos = pos - step + ind + 1
+                break
+            pos -= step
+        f.truncate(pos)
+
+    return size - pos
+
+
+# CLASS SECTION
+class PullManifest(object):
+    """
+    DESCR: done/failed record of pull jobs backed by an append only file
+    """
+
+    def __init__(self, path):
+        """
+        DESCR: load any existing manifest at path
+        INPUT:
+            path - str - manifest file, MANIFEST_EXT added if missing
+        OUTPUT: None
+        """
+        if not path.endswith(MANIFEST_EXT):
+            path = path + MANIFEST_EXT
+        self.path = path
+        self.status = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    parts = line.strip().split(',')
+                    if len(parts) == 5:
+                        self.status[tuple(parts[:4])] = parts[4]
+
+    def __len__(self):
+        return len(self.status)
+
+    def is_done(self, job):
+        """
+        DESCR: True if chart for job already in the csv
+        """
+        return self.status.get(job_key(job)) == DONE
+
+    def record(self, jobs, status):
+        """
+        DESCR: mark jobs, written through to disk straight away
+        INPUT:
+            jobs - list of (symb, minutes, date_pair)
+            status - str - DONE or FAILED
+        OUTPUT: None
+        """
+        with self.lock:
+            with open(self.path, 'a') as f:
+                for job in jobs:
+                    key = job_key(job)
+                    self.status[key] = status
+                    f.write(','.join(key + (status,)) + '\n')
+
+    def counts(self):
+        """
+        DESCR: how many jobs are in each status
+        """
+        counts = {DONE: 0, FAILED: 0}
+        for status in self.status.values():
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def failed_jobs(self):
+        """
+        DESCR: jobs whose last try failed
+        OUTPUT:
+            jobs - list of (symb, minutes, date_pair)
+        """
+        jobs = []
+        for key, status in self.status.items():
+            if status == FAILED:
+                date_pair = tuple(datetime.datetime.strptime(day, DATE_FORMAT)
+                                  for day in key[2:])
+                jobs.append((key[0], int(key[1]), date_pair))
+        return jobs
+
+    def last_date(self, symb=None):
+        """
+        DESCR: latest start date of a finished job
+        INPUT:
+            symb - str - only look at this symbol, None for all
+        OUTPUT:
+            date - datetime or None if nothing finished
+        """
+        days = [key[2] for key, status in self.status.items()
+                if status == DONE and (symb is None or key[0] == symb)]
+        if not days:
+            return None
+        return datetime.datetime.strptime(max(days), DATE_FORMAT)
+
+    def last_dates(self):
+        """
+        DESCR: latest start date of a finished job for every symbol, one pass
+               instead of a last_date call per symbol
+        OUTPUT:
+            dates - dict - symbol to datetime, symbols with nothing done left out
+        """
+        days = {}
+        for key, status in self.status.items():
+            if status == DONE and key[2] > days.get(key[0], ''):
+                days[key[0]] = key[2]
+        return dict((symb, datetime.datetime.strptime(day, DATE_FORMAT))
+                    for symb, day in days.items())
+
+
+if __name__ == '__main__':
+    """
+    DESCR: Test code of manifest
+    """
+    path = 'manifest_test' + MANIFEST_EXT
+    if os.path.exists(path):
+        os.remove(path)
+
+    pair = (datetime.datetime(2014, 3, 6), datetime.datetime(2014, 3, 7))
+    later = (datetime.datetime(2014, 3, 7), datetime.datetime(2014, 3, 10))
+    manifest = PullManifest(path)
+    manifest.record([('AAPL', 5, pair)], DONE)
+    manifest.record([('MSFT', 5, pair)], FAILED)
+    manifest.record([('AAPL', 5, later)], DONE)
+
+    reopened = PullManifest(path)
+    print "AAPL done: {}".format(reopened.is_done(('AAPL', 5, pair)))
+    print "MSFT done: {}".format(reopened.is_done(('MSFT', 5, pair)))
+    print "Failed: {}".format(reopened.failed_jobs())
+    print "Last date: {}".format(reopened.last_date())
+    print "Last dates: {}".format(reopened.last_dates())
+    print reopened.counts()
+    os.remove(path)
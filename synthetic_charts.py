@@ -0,0 +1,227 @@
+###--------------------------------------------------------------------------###
+# AUTHOR: Robert Ranney
+# FILE: synthetic_charts.py
+# USAGE: from synthetic_charts import write_synthetic_csv
+#        python synthetic_charts.py <csv_path> <num_charts> [num_symbols]
+#                                   [seed]
+# DESCR: Fake chart csv in the exact layout pull_all_data writes, so the
+#        pipeline can be run and timed without the real scrape. Each symbol
+#        is one random walk of 5 minute candles over consecutive weekdays
+#        (same candle model as chart_fixtures.random_walk_day) with a jump
+#        between one day's close and the next day's open, so gaps and gap
+#        fills show up. A row is a day plus the next morning, like the pulled
+#        date pairs, and every cell is "[o, h, l, c]" with a str(dict) meta
+#        cell last. Walks are made with numpy a block of symbols at a time and
+#        rows are written with one string format each, 315k rows in about a
+#        minute.
+# START DATE: 10/18/26
+# CHANGE LOG:
+#           10/18/26 - File started, vectorized random walk charts written as
+#                      pull_all_data csv rows
+###--------------------------------------------------------------------------###
+
+# IMPORT SECTION
+from chart_store import CANDLES_IN_DAY, CANDLES_IN_CHART
+from time import time
+import numpy as np
+import datetime
+import sys
+
+# CONSTANT SECTION
+RANDOM_STATE = 42
+VOL = 0.002
+GAP_VOL = 0.01
+MIN_PRICE = 5.0
+MAX_PRICE = 500.0
+DAYS_PER_SYMBOL = 250
+SYMBOLS_PER_BLOCK = 50
+START_DATE = datetime.datetime(2014, 3, 6)
+HEADER = ",".join([str(x) for x in range(CANDLES_IN_CHART)] + ['meta']) + "\r\n"
+ROW_FORMAT = ",".join(['"[%r, %r, %r, %r]"'] * CANDLES_IN_CHART) + ',"%s"\r\n'
+
+
+# FUNCTION SECTION
+def weekdays(start_date, n_days):
+    """
+    DESCR: consecutive weekdays from a start date
+    INPUT:
+        start_date - datetime - first day, skipped if a weekend
+        n_days - int
+    OUTPUT:
+        days - list of datetime
+    """
+    days = []
+    day = start_date
+    while len(days) < n_days:
+        if day.weekday() < 5:
+            days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def random_walk_days(rng, prices, n_days, n_candles=CANDLES_IN_DAY, vol=VOL,
+                     gap_vol=GAP_VOL):
+    """
+    DESCR: random walk candles for several symbols at once. Inside a day each
+           open is the last close, each close moves by gauss(0, vol) and the
+           high and low reach past the body by |gauss(0, vol / 2)|, as in
+           chart_fixtures.random_walk_day. A day opens gauss(0, gap_vol) away
+           from the close before it
+    INPUT:
+        rng - RandomState
+        prices - array - (n_symbols,) open of each symbol's first candle
+        n_days - int
+        n_candles - int - candles in a day
+        vol - float - std of each candle's return
+        gap_vol - float - std of the overnight return
+    OUTPUT:
+        ohlc - array - (n_symbols, n_days, n_candles, 4) rounded to 4 places
+    """
+    shape = (len(prices), n_days, n_candles)
+
+    # Price steps in order: to each candle's open, then to its close
+    steps = np.ones(shape + (2,))
+    steps[:, 1:, 0, 0] += rng.normal(0, gap_vol, (len(prices), n_days - 1))
+    steps[..., 1] += rng.normal(0, vol, shape)
+    path = np.cumprod(steps.reshape(len(prices), -1), axis=1)
+    path = (path * np.asarray(prices)[:, None]).reshape(shape + (2,))
+
+    ohlc = np.empty(shape + (4,))
+    ohlc[..., 0] = path[..., 0]
+    ohlc[..., 1] = path.max(axis=-1) * (1 + np.abs(rng.normal(0, vol / 2,
+                                                              shape)))
+    ohlc[..., 2] = path.min(axis=-1) * (1 - np.abs(rng.normal(0, vol / 2,
+                                                              shape)))
+    ohlc[..., 3] = path[..., 1]
+    return np.round(ohlc, 4)
+
+
+def day_pair_charts(days_ohlc):
+    """
+    DESCR: every day of a walk with the morning after it, like a pulled date
+           pair cut to CANDLES_IN_CHART
+    INPUT:
+        days_ohlc - array - (n_symbols, n_days, CANDLES_IN_DAY, 4)
+    OUTPUT:
+        charts - array - (n_symbols, n_days - 1, CANDLES_IN_CHART, 4)
+    """
+    morning = CANDLES_IN_CHART - CANDLES_IN_DAY
+    return np.concatenate([days_ohlc[:, :-1], days_ohlc[:, 1:, :morning]],
+                          axis=2)
+
+
+def chart_meta(symbol, first_day, second_day):
+    """
+    DESCR: meta dict of a chart as pull_chart.build_chart makes it
+    INPUT:
+        symbol - str
+        first_day - datetime
+        second_day - datetime
+    OUTPUT:
+        meta - dict
+    """
+    return {'first_day': first_day.strftime('%m/%d'),
+            'year': str(first_day.year),
+            'symbol': symbol,
+            'second_day': second_day.strftime('%m/%d')}
+
+
+def symbol_names(n_symbols):
+    """
+    DESCR: made up tickers, four letters so they look like the real ones
+    INPUT:
+        n_symbols - int - up to 26 ** 4
+    OUTPUT:
+        symbols - list of str
+    """
+    letters = [chr(ord('A') + i) for i in range(26)]
+    symbols = []
+    for i in range(n_symbols):
+        name = ''
+        for _ in range(4):
+            i, ind = divmod(i, 26)
+            name = letters[ind] + name
+        symbols.append(name)
+    return symbols
+
+
+def write_chart_rows(f, charts, metas):
+    """
+    DESCR: write charts as csv rows, the same text csv.writer gives for
+           data + [meta] in pull_all_data.record_chart
+    INPUT:
+        f - file - open for writing
+        charts - array - (n, CANDLES_IN_CHART, 4)
+        metas - list of dicts
+    OUTPUT: none
+    """
+    rows = [ROW_FORMAT % (tuple(chart) + (meta,)) for chart, meta in
+            zip(charts.reshape(len(charts), -1).tolist(), metas)]
+    f.write("".join(rows))
+
+
+def write_synthetic_csv(path, n_charts, n_symbols=None,
+                        random_state=RANDOM_STATE, start_date=START_DATE):
+    """
+    DESCR: write a csv of random walk charts that reads like a real pull
+    INPUT:
+        path - str - csv to write
+        n_charts - int - rows wanted
+        n_symbols - int - default one per DAYS_PER_SYMBOL charts
+        random_state - int
+        start_date - datetime - first day of every symbol
+    OUTPUT:
+        n_charts - int - rows written
+    """
+    if n_symbols is None:
+        n_symbols = max(1, int(np.ceil(n_charts / float(DAYS_PER_SYMBOL))))
+    pairs_per_symbol = int(np.ceil(n_charts / float(n_symbols)))
+    days = weekdays(start_date, pairs_per_symbol + 1)
+    symbols = symbol_names(n_symbols)
+    rng = np.random.RandomState(random_state)
+
+    written = 0
+    with open(path, 'wb') as f:
+        f.write(HEADER)
+        for start in range(0, n_symbols, SYMBOLS_PER_BLOCK):
+            block = symbols[start:start + SYMBOLS_PER_BLOCK]
+            prices = rng.uniform(MIN_PRICE, MAX_PRICE, len(block))
+            charts = day_pair_charts(random_walk_days(rng, prices, len(days)))
+            for symbol, symbol_charts in zip(block, charts):
+                n_rows = min(len(symbol_charts), n_charts - written)
+                metas = [chart_meta(symbol, days[i], days[i + 1])
+                         for i in range(n_rows)]
+                write_chart_rows(f, symbol_charts[:n_rows], metas)
+                written += n_rows
+    return written
+
+
+if __name__ == '__main__':
+    """
+    DESCR: Write a synthetic csv and check it reads back the same both ways
+    """
+    from chart_reader import read_chart_csv
+    import pandas as pd
+    from ast import literal_eval
+
+    try:
+        csv_path = sys.argv[1]
+        n_charts = int(sys.argv[2])
+        n_symbols = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        seed = int(sys.argv[4]) if len(sys.argv) > 4 else RANDOM_STATE
+    except:
+        print "ERROR Usage: python synthetic_charts.py <csv_path> " \
+              "<num_charts> [num_symbols] [seed]"
+        sys.exit(-1)
+
+    start_time = time()
+    written = write_synthetic_csv(csv_path, n_charts, n_symbols, seed)
+    print "Wrote {} charts in {:.1f}s".format(written, time() - start_time)
+
+    store = read_chart_csv(csv_path)
+    df = pd.read_csv(csv_path, nrows=100)
+    old = np.array([[literal_eval(cell) for cell in row[:-1]]
+                    for row in df.values])
+    print "Fast reader got {} charts, old read_csv path agrees: {}".format(
+          len(store), np.array_equal(old, store.ohlc[:len(old)]))
+    print store.meta.head()
@@ -7,12 +7,14 @@
 # START DATE: 10/15/16
 # CHANGE LOG:
 #           10/15/16 - initial attempt to try and cluster 340 feature data set
+#           10/18/26 - data loaded with load_charts, X and y are array views
+#                    - centers reshaped to candles, not merged column by column
 ###--------------------------------------------------------------------------###
 
 # IMPORT SECTION
 import pandas as pd
 from sklearn.cluster import KMeans
-from helper_functions import merge_float_df_to_candles, day_split
+from chart_store import load_charts
 from helper_functions import float_chart_to_candle_chart
 from chart_plotter import build_candle_chart
 import matplotlib.pyplot as plt
@@ -33,23 +35,23 @@ if __name__ == '__main__':
         sys.exit(-1)
 
     # Load in data
-    df = pd.read_pickle(data_pickle)
-    X, y = day_split(df)
+    store = load_charts(data_pickle)
+    X, y = store.day_split()
     cluster = pickle.load( open(cluster_pickle, 'rb') )
 
     # Create dictionary of cluster sizes
     sizes = Counter(cluster.labels_)
 
-    # Create dataframe of cluster centers converted to candles
-    centers = pd.DataFrame(cluster.cluster_centers_)
-    centers = merge_float_df_to_candles(centers)
+    # Cluster centers viewed as candles, only shown ones become CandleSticks
+    centers = cluster.cluster_centers_.reshape(len(cluster.cluster_centers_),
+                                               -1, 4)
 
     # See some clusters
     for i in range(0,centers.shape[0],50):
-        inds = X[cluster.labels_==i].index.tolist()
-        first = float_chart_to_candle_chart(X.iloc[random.choice(inds), : ])
-        second = float_chart_to_candle_chart(X.iloc[random.choice(inds), : ])
-        cluster_chart = centers.iloc[i,:]
+        inds = np.where(cluster.labels_==i)[0].tolist()
+        first = float_chart_to_candle_chart(X[random.choice(inds)])
+        second = float_chart_to_candle_chart(X[random.choice(inds)])
+        cluster_chart = float_chart_to_candle_chart(centers[i])
         fig, ax = plt.subplots()
 
         build_candle_chart(fig, ax, cluster_chart)